@@ -1 +1,19 @@
-from jahs_bench.api import Benchmark, BenchmarkTypes, BenchmarkTasks
+from typing import TYPE_CHECKING
+
+__all__ = ["Benchmark", "BenchmarkTypes", "BenchmarkTasks"]
+
+if TYPE_CHECKING:
+    from jahs_bench.api import Benchmark, BenchmarkTypes, BenchmarkTasks
+
+
+def __getattr__(name: str):
+    # The API is only imported once it is used, such that importing any other module of
+    # the package, e.g. the downloader, does not pay for importing pandas and ConfigSpace
+    if name in __all__:
+        from jahs_bench import api
+        return getattr(api, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,142 @@
+"""
+An asyncio interface to the benchmark. Queries made concurrently from many coroutines
+are coalesced into batches, which are answered by a single batched prediction each in an
+executor, such that the event loop is never blocked by the benchmark.
+
+    benchmark = AsyncBenchmark(task="cifar10")
+    results = await benchmark.query(config, nepochs=200)
+"""
+
+import asyncio
+import logging
+from concurrent.futures import Executor, ThreadPoolExecutor
+from functools import partial
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from jahs_bench.api import Benchmark, BenchmarkTypes
+
+_log = logging.getLogger(__name__)
+
+
+class AsyncBenchmark:
+    """ Wraps a surrogate or tabular `Benchmark` such that it can be queried from
+    coroutines. Every query is queued and the queue is flushed as a single batched query
+    either `max_delay` seconds after the first query was queued or as soon as
+    `max_batch` queries are waiting, whichever happens first. """
+
+    def __init__(self, benchmark: Optional[Benchmark] = None, max_batch: int = 256,
+                 max_delay: float = 5e-4, executor: Optional[Executor] = None,
+                 **benchmark_kwargs):
+        """
+        :param benchmark: optional Benchmark
+            The benchmark to be queried. When None, a new benchmark is created by passing
+            `benchmark_kwargs` on to `jahs_bench.Benchmark`.
+        :param max_batch: int
+            The maximum number of queries answered with a single batched call.
+        :param max_delay: float
+            The maximum time, in seconds, that a query waits for other queries to be
+            batched with.
+        :param executor: optional concurrent.futures.Executor
+            The executor running the batched queries. Defaults to a single dedicated
+            thread, which is shut down by `close()`.
+        """
+
+        self.benchmark = Benchmark(**benchmark_kwargs) if benchmark is None else benchmark
+        if self.benchmark.kind not in (BenchmarkTypes.Surrogate, BenchmarkTypes.Table):
+            raise ValueError(f"AsyncBenchmark does not support benchmarks of the kind "
+                             f"{self.benchmark.kind.value}.")
+
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._own_executor = executor is None
+        self._executor = executor if executor is not None else \
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix="AsyncBenchmark")
+        self._pending: List[Tuple[dict, Optional[int], bool, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.nbatches = 0
+
+    @property
+    def metrics(self) -> Tuple[str, ...]:
+        return self.benchmark.metrics
+
+    async def query(self, config: dict, nepochs: Optional[int] = 200,
+                    full_trajectory: bool = False) -> dict:
+        """ Query the benchmark, exactly as `Benchmark.__call__()` would, but without
+        blocking the event loop. """
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((config, nepochs, full_trajectory, future))
+
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._flush)
+
+        return await future
+
+    async def query_batch(self, *args, **kwargs):
+        """ Run `Benchmark.query_batch()` in the executor. """
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, lambda: self.benchmark.query_batch(*args, **kwargs))
+
+    def sample_config(self, *args, **kwargs) -> dict:
+        return self.benchmark.sample_config(*args, **kwargs)
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        pending, self._pending = self._pending, []
+        groups: Dict[bool, list] = {}
+        for request in pending:
+            # Queries whose caller has been cancelled need not be answered
+            if not request[3].done():
+                groups.setdefault(request[2], []).append(request)
+
+        loop = asyncio.get_running_loop()
+        for full_trajectory, requests in groups.items():
+            self.nbatches += 1
+            configs = [r[0] for r in requests]
+            nepochs = [r[1] for r in requests]
+            batch = loop.run_in_executor(self._executor, self.benchmark._call_batch,
+                                         configs, nepochs, full_trajectory)
+            batch.add_done_callback(partial(self._resolve, requests=requests))
+
+    def _resolve(self, batch: asyncio.Future, requests: Sequence[tuple]):
+        if batch.exception() is None:
+            for (*_, future), result in zip(requests, batch.result()):
+                if not future.done():
+                    future.set_result(result)
+            return
+
+        if len(requests) == 1:
+            if not requests[0][3].done():
+                requests[0][3].set_exception(batch.exception())
+            return
+
+        # Find out which queries were at fault, without failing the others
+        loop = asyncio.get_running_loop()
+        for request in requests:
+            single = loop.run_in_executor(self._executor, self.benchmark._call_batch,
+                                          [request[0]], [request[1]], request[2])
+            single.add_done_callback(partial(self._resolve, requests=[request]))
+
+    async def close(self):
+        """ Answer all queued queries and release the executor, if it was created by
+        this object. """
+
+        if self._pending:
+            self._flush()
+        if self._own_executor:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self._executor.shutdown)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
@@ -1,29 +1,72 @@
 import logging
+import shutil
+import time
 from enum import Enum, unique, auto
 from pathlib import Path
-from typing import Optional, Union, Sequence, Tuple, Iterable
+from typing import Optional, Union, Sequence, Tuple, Iterable, Dict, List, Callable, \
+    TYPE_CHECKING, cast
 
 import numpy as np
 import pandas as pd
 
+from jahs_bench.lib.core import columnar
 from jahs_bench.lib.core.configspace import joint_config_space
-from jahs_bench.surrogate.model import XGBSurrogate
-import jahs_bench.download
+from jahs_bench.lib.core.encoding import joint_config_encoder
+from jahs_bench.lib.core.result_cache import ResultCache
+from jahs_bench.lib.core.table_index import TableIndex
+
+# The surrogate models depend on xgboost and, unless they have been compiled, on
+# scikit-learn, neither of which the other kinds of benchmarks need. They are imported
+# only once a surrogate benchmark is loaded.
+if TYPE_CHECKING:
+    from jahs_bench.surrogate.cache import ModelCache
+    from jahs_bench.surrogate.compiled import CompiledSurrogate
+    from jahs_bench.surrogate.model import XGBSurrogate
 
-## Requires installation of the optional "data_creation" components and dependencies
-try:
+_log = logging.getLogger(__name__)
+_log.setLevel(logging.WARNING)
+
+
+# Only bound once the optional "data_creation" components have been probed
+data_creation_available: bool
+if TYPE_CHECKING:
     from jahs_bench.tabular.sampling import run_task
     from jahs_bench.tabular.lib.core.constants import Datasets as _Tasks
-    from jahs_bench.tabular.lib.core.utils import DirectoryTree, MetricLogger, \
+    from jahs_bench.tabular.lib.core.utils import DirectoryTree, MetricLogger, AttrDict
+
+
+def _load_data_creation() -> bool:
+    """ Import the optional "data_creation" components, which pull in torch, the first
+    time a live benchmark needs them rather than whenever the package is imported.
+    Returns whether they are installed. """
+
+    global data_creation_available, run_task, _Tasks, DirectoryTree, MetricLogger, \
         AttrDict
-    import shutil
-except ImportError as e:
-    data_creation_available = False
-else:
-    data_creation_available = True
+    try:
+        return data_creation_available
+    except NameError:
+        pass
+
+    ## Requires installation of the optional "data_creation" components and dependencies
+    try:
+        from jahs_bench.tabular.sampling import run_task
+        from jahs_bench.tabular.lib.core.constants import Datasets as _Tasks
+        from jahs_bench.tabular.lib.core.utils import DirectoryTree, MetricLogger, \
+            AttrDict
+    except ImportError as e:
+        _log.debug(f"The optional component 'data_creation' is not available: {e}")
+        data_creation_available = False
+    else:
+        data_creation_available = True
+    return data_creation_available
+
+
+def __getattr__(name: str):
+    # Only probe for the optional components when their availability is asked for
+    if name == "data_creation_available":
+        return _load_data_creation()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-_log = logging.getLogger(__name__)
-_log.setLevel(logging.WARNING)
 
 @unique
 class BenchmarkTypes(Enum):
@@ -40,16 +83,24 @@ class BenchmarkTasks(Enum):
 
 
 class Benchmark:
-    _call_fn = None
+    _call_fn: Callable[..., dict]
+    _batch_fn: Callable[..., pd.DataFrame]
     _surrogates = None
+    _fused_surrogate = None
+    _model_cache = None
     _table = None
+    _table_index = None
     __known_metrics = ("FLOPS", "latency", "runtime", "size_MB", "test-acc", "train-acc",
                        "valid-acc")
 
     def __init__(self, task: Union[str, BenchmarkTasks],
                  kind: Union[str, BenchmarkTypes] = BenchmarkTypes.Surrogate,
                  download: bool = True, save_dir: Union[str, Path] = "jahs_bench_data",
-                 metrics: Optional[Iterable[str]] = None, lazy: bool = False):
+                 metrics: Optional[Iterable[str]] = None, lazy: bool = False,
+                 table_format: Optional[str] = None,
+                 model_cache: Optional["ModelCache"] = None,
+                 result_cache: Optional[ResultCache] = None,
+                 n_threads: Optional[int] = None):
         """
         Public facing API for accessing JAHS-Bench, capable of querying a single
         configuration at a time on any known task in three different modes: surrogate,
@@ -79,11 +130,37 @@ class Benchmark:
             be predicted by the benchmark. This is especially useful for the surrogate
             benchmark, as specifying only a subset of the available metrics drastically
             reduces the memory requirements of the surrogate model.
-        lazy: bool  # TODO: Finalize
-            (Experimental) A flag to enable lazy loading of the surrogate models (future:
-            extend to tabular and live), thereby loading each metric's surrogate model
-            once per query and one at a time, in order to reduce the instantaneous memory
-            requirements of the surrogate benchmark.
+        lazy: bool
+            A flag to enable lazy loading of the surrogate models (future: extend to
+            tabular and live). Each metric's surrogate model is then only loaded when it
+            is first needed and kept in a least-recently-used cache with a bounded
+            memory budget, see `model_cache`. Models are only loaded ahead of the
+            queries that need them when `prefetch()` is called.
+        table_format: optional string
+            Only used by the tabular benchmark. "pickle" loads the compressed pickles of
+            performance data, "columnar" memory maps the columnar version of the same
+            data (see `jahs_bench.lib.core.columnar`), which loads much faster, reads
+            only the columns of the requested `metrics` and is shared between all
+            processes using the same table. When None, the columnar format is used if it
+            is available, otherwise the pickles are used.
+        model_cache: optional ModelCache
+            Only used when `lazy` is True. The cache holding the lazily loaded surrogate
+            models, which may be shared by several benchmarks, e.g. one per task, in
+            order to serve all of them under a single memory budget. Defaults to the
+            cache shared by the entire process, which has a budget of 1 GiB, see
+            `jahs_bench.surrogate.cache.default_cache()`.
+        result_cache: optional ResultCache
+            When given, the results of all queries made by calling the benchmark are
+            memoized in this cache and repeated queries are answered from it, see
+            `jahs_bench.lib.core.result_cache`. Not used for live training.
+        n_threads: optional int
+            Only used by the surrogate benchmark. The number of threads that a single
+            query may use. Each booster then predicts single-threaded, the boosters of
+            the metrics are evaluated concurrently and batches of more than a few
+            thousand rows are split into one chunk per thread. When None, XGBoost's
+            own defaults are kept. The models of a lazily loaded benchmark are shared
+            through the model cache and always keep XGBoost's defaults. Regardless of
+            this option, all query methods may be called from several threads at once.
         """
 
         if isinstance(task, str):
@@ -102,10 +179,19 @@ class Benchmark:
                 raise ValueError(f"Invalid/Unknown value of parameter 'kind': '{kind}'. "
                                  f"Must be one of {valid}.") from e
 
+        if n_threads is not None and n_threads < 1:
+            raise ValueError(f"Invalid value of parameter 'n_threads': {n_threads}. Must "
+                             f"be None or a positive integer.")
+
+        if table_format not in (None, "pickle", "columnar"):
+            raise ValueError(f"Invalid/Unknown value of parameter 'table_format': "
+                             f"'{table_format}'. Must be one of None, 'pickle' or "
+                             f"'columnar'.")
+
         # Validate the metrics passed in
         if metrics is not None:
             metrics = set(metrics)
-            unknown = set(self.__known_metrics) - metrics
+            unknown = metrics - set(self.__known_metrics)
             if any(unknown):
                 raise ValueError(
                     f"Unknown `metrics` {unknown}, must be in {self.__known_metrics}"
@@ -114,19 +200,43 @@ class Benchmark:
         self.kind = kind
         self.task = task
         self.metrics = tuple(metrics) if metrics is not None else self.__known_metrics
+        self._selected_metrics = None if metrics is None else self.metrics
         self.save_dir = Path(save_dir)
         self.surrogate_dir = self.save_dir / "assembled_surrogates"
         self.table_dir = self.save_dir / "metric_data"
         self.task_dir = self.save_dir / "tasks"
         self._lazy = lazy
-
+        self._table_format = table_format
+        self.result_cache = result_cache
+        self.n_threads = n_threads
+        self._executor = None
+        if n_threads is not None and n_threads > 1:
+            # Shared by all fused models of this benchmark, threads are started on demand
+            from concurrent.futures import ThreadPoolExecutor
+            self._executor = ThreadPoolExecutor(max_workers=n_threads)
+        # Results of different tasks, kinds and data directories are never mixed up
+        self._result_namespace = (task.value, kind.value, str(self.save_dir.resolve()))
+        # The time, in seconds, spent in each phase of setting up the benchmark
+        self.startup_times = {"download": 0., "extract": 0., "deserialize": 0.,
+                              "index": 0.}
+        if lazy:
+            from jahs_bench.surrogate.cache import default_cache
+            self._model_cache = default_cache() if model_cache is None else model_cache
+
+        # Only the data of this task and, for the surrogates, of these metrics is fetched
         if download and kind is BenchmarkTypes.Surrogate:
-            if not self.surrogate_dir.exists():
-                jahs_bench.download.download_surrogates(self.save_dir)
+            missing = [m for m in self.metrics
+                       if not (self.surrogate_dir / task.value / m).is_dir()]
+            if missing:
+                from jahs_bench.download import download_surrogates
+                self.startup_times.update(download_surrogates(
+                    self.save_dir, tasks=[task.value], metrics=missing))
 
         if download and kind is BenchmarkTypes.Table:
-            if not self.table_dir.exists():
-                jahs_bench.download.download_metrics(self.save_dir)
+            if not (self.table_dir / task.value).is_dir():
+                from jahs_bench.download import download_metrics
+                self.startup_times.update(download_metrics(
+                    self.save_dir, tasks=[task.value]))
 
         if download and kind is BenchmarkTypes.Live:
             # TODO: Implement
@@ -142,10 +252,16 @@ class Benchmark:
 
         # Setup the benchmark
         loaders[kind]()
+        _log.info(f"Set up the {kind.value} benchmark for the task {task.value} in "
+                  f"{sum(self.startup_times.values()):.2f} seconds: " +
+                  ", ".join(f"{k} {v:.2f}s" for k, v in self.startup_times.items()))
 
     def _load_surrogate(self):
+        from jahs_bench.surrogate.compiled import CompiledSurrogate, FusedSurrogate
+
         assert self.surrogate_dir.exists() and self.surrogate_dir.is_dir()
 
+        start = time.perf_counter()
         model_path = self.surrogate_dir / self.task.value
         outputs = [p.name for p in model_path.iterdir()
                    if p.is_dir() and p.name in self.metrics]
@@ -154,100 +270,491 @@ class Benchmark:
 
         for o in outputs:
             pth = model_path / str(o)
-            self._surrogates[o] = XGBSurrogate.load(pth) if not self._lazy else \
-                _LazySurrogate(model_pth=pth)
+            if self._lazy:
+                self._surrogates[o] = _LazySurrogate(
+                    model_pth=pth, cache=self._model_cache, key=(self.task.value, o))
+            elif CompiledSurrogate.exists(pth):
+                # Skips importing scikit-learn and unpickling the pipeline entirely
+                self._surrogates[o] = CompiledSurrogate.load(pth)
+            else:
+                from jahs_bench.surrogate.model import XGBSurrogate
+                self._surrogates[o] = XGBSurrogate.load(pth)
+        self.startup_times["deserialize"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        if not self._lazy:
+            # All metrics are predicted from a single, shared encoding of the queries
+            try:
+                compiled = {o: s if isinstance(s, CompiledSurrogate) else s.compile()
+                            for o, s in self._surrogates.items()}
+                if self.n_threads is not None:
+                    # The threads are spent on chunks and models, not within a booster
+                    for model in compiled.values():
+                        model.set_nthread(1)
+                self._fused_surrogate = FusedSurrogate(
+                    compiled, max_workers=self.n_threads, executor=self._executor)
+            except NotImplementedError as e:
+                _log.warning(f"Could not compile the surrogate models, falling back to "
+                             f"their sklearn pipelines: {e}")
+        self.startup_times["index"] = time.perf_counter() - start
 
         self._call_fn = self._benchmark_surrogate
+        self._batch_fn = self._batch_surrogate
+
+    def prefetch(self) -> list:
+        """ For a lazily loaded surrogate benchmark, start loading all surrogate models
+        into the model cache in the background, e.g. ahead of an expected burst of
+        queries. Returns a list of futures, one per model. """
+
+        if self._model_cache is None:
+            return []
+        assert self._surrogates is not None
+        return self._model_cache.prefetch(
+            (s.key, s.model_pth) for s in self._surrogates.values())
 
     def _load_table(self):
         assert self.save_dir.exists() and self.save_dir.is_dir()
 
-        table_path = self.save_dir / self.task.value
-        table_names = ["train_set.pkl.gz", "valid_set.pkl.gz", "test_set.pkl.gz"]
-        tables = [pd.read_pickle(table_path / n) for n in table_names]
-        table = pd.concat(tables, axis=0)
-        del tables
+        table_path = self.table_dir / self.task.value
+        columnar_path = table_path / columnar.COLUMNAR_DIR_NAME
+        use_columnar = self._table_format == "columnar" or (
+            self._table_format is None and
+            (columnar_path / columnar.MANIFEST_NAME).exists())
 
         # level_0_cols = ["features", "labels"]
         features: list = joint_config_space.get_hyperparameter_names() + ["epoch"]
 
-        if table["features"].columns.intersection(features).size != len(features):
+        start = time.perf_counter()
+        if use_columnar:
+            self._table_features, self._table_labels = columnar.read_columnar(
+                columnar_path, labels=self._selected_metrics)
+            table_path = columnar_path
+        else:
+            table_names = ["train_set.pkl.gz", "valid_set.pkl.gz", "test_set.pkl.gz"]
+            tables = [pd.read_pickle(table_path / n) for n in table_names]
+            if self._selected_metrics is not None:
+                # Drop the unused labels before the tables are concatenated
+                tables = [t.loc[:, [c for c in t.columns
+                                    if c[0] != "labels" or c[1] in self.metrics]]
+                          for t in tables]
+            table = pd.concat(tables, axis=0)
+            del tables
+            self._table_features = table.loc[:, "features"]
+            self._table_labels = table.loc[:, "labels"]
+            if self._selected_metrics is not None:
+                self._table_labels = self._table_labels.loc[:, list(self.metrics)]
+            del table
+        self.startup_times["deserialize"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        if self._table_features.columns.intersection(features).size != len(features):
             raise ValueError(f"The given performance datasets at {table_path} could not "
                              f"be resolved against the known search space consisting of "
                              f"the parameters {features}")
 
-        self._features = table["features"].columns
-        self._labels: pd.Index = table["labels"].columns
-        self._table_features = table.loc[:, "features"]
-        self._table_labels = table.loc[:, "labels"]
-        self._table_features.rename_axis("Sample ID", axis=0, inplace=True)
-        self._table_features = self._table_features.reset_index()
+        self._features = self._table_features.columns
+        self._labels: pd.Index = self._table_labels.columns
+        # Equivalent to reset_index(), but does not copy (memory mapped) columns
+        self._table_features = pd.DataFrame(
+            {"Sample ID": self._table_features.index.to_numpy(),
+             **{c: self._table_features[c].values for c in self._features}},
+            copy=False)
+        self._table_index = TableIndex(
+            self._table_features,
+            parameters=joint_config_space.get_hyperparameter_names())
+        # Direct views of the columns, used to answer single queries without pandas
+        self._table_epochs = self._table_features["epoch"].to_numpy()
+        self._table_label_columns = {c: self._table_labels[c].to_numpy()
+                                     for c in self._labels}
+        self.startup_times["index"] = time.perf_counter() - start
         self._call_fn = self._benchmark_tabular
+        self._batch_fn = self._batch_tabular
 
     def _load_live(self):
+        _load_data_creation()
         self._call_fn = self._benchmark_live
+        self._batch_fn = self._batch_live
 
     def __call__(self, config: dict, nepochs: Optional[int] = 200,
                  full_trajectory: bool = False, **kwargs):
-        return self._call_fn(config=config, nepochs=nepochs,
-                             full_trajectory=full_trajectory, **kwargs)
+        if self.result_cache is None or self.kind is BenchmarkTypes.Live:
+            return self._call_fn(config=config, nepochs=nepochs,
+                                 full_trajectory=full_trajectory, **kwargs)
+
+        assert nepochs is not None
+        key = self._result_key(config, nepochs, full_trajectory)
+        result = self.result_cache.get(key)
+        if result is None:
+            result = self._call_fn(config=config, nepochs=nepochs,
+                                   full_trajectory=full_trajectory, **kwargs)
+            self.result_cache.put(key, result)
+        return result
 
-    def _benchmark_surrogate(self, config: dict, nepochs: Optional[int] = 200,
-                             full_trajectory: bool = False, **kwargs) -> dict:
-        assert nepochs > 0
+    def _result_key(self, config: dict, nepochs: int, full_trajectory: bool) -> str:
+        assert self.result_cache is not None
+        return self.result_cache.key(config, nepochs, full_trajectory, self.metrics,
+                                     namespace=self._result_namespace)
 
-        if full_trajectory:
-            features = pd.DataFrame([config] * nepochs)
-            epochs = list(range(1, nepochs+1))
-            features = features.assign(epoch=epochs)
-        else:
-            features = pd.Series(config).to_frame().transpose()
-            epochs = [nepochs]
-            features.loc[:, "epoch"] = nepochs
+    def query_batch(self, configs: Union[Sequence[dict], pd.DataFrame, np.ndarray],
+                    nepochs: Union[int, Sequence[int], np.ndarray] = 200,
+                    full_trajectory: bool = False,
+                    metrics: Optional[Sequence[str]] = None, **kwargs) -> pd.DataFrame:
+        """
+        Query the benchmark for a whole batch of configurations in a single call. For
+        the surrogate benchmark, the entire batch is encoded and passed to each metric's
+        model exactly once, which is significantly faster than repeatedly calling the
+        benchmark with individual configurations.
+
+        configs: sequence of dicts, pandas DataFrame or NumPy array
+            The configurations to be queried. A NumPy array may either be a structured
+            array with fields named after the parameters of the search space or a 2D
+            array whose columns follow the order of
+            `joint_config_space.get_hyperparameter_names()`. Any "epoch" values present
+            in `configs` are ignored in favour of `nepochs`.
+        nepochs: int or sequence of ints
+            Either a single number of epochs used for every configuration or one value
+            per configuration.
+        full_trajectory: bool
+            When True, the metrics for every epoch from 1 up to and including the
+            respective value of `nepochs` are returned for each configuration. As for
+            `__call__()`, the tabular benchmark skips the epochs missing from the table.
+        metrics: optional sequence of str
+            Only query these metrics, which must be a subset of `Benchmark.metrics`. For
+            the surrogate benchmark, the models of all other metrics are skipped.
+
+        Returns a pandas DataFrame with one column per metric, indexed by a MultiIndex
+        with the levels "config", the position of the configuration in `configs`, and
+        "epoch".
+        """
 
-        outputs = []
-        for model in self._surrogates.values():
-            outputs.append(model.predict(features))
+        metrics = self._check_metrics(metrics)
+        features = self._configs_to_columns(configs)
+        config_idx, epochs = self._expand_epochs(
+            len(next(iter(features.values()))), nepochs, full_trajectory)
+        return self._batch_fn(features=features, config_idx=config_idx, epochs=epochs,
+                              metrics=metrics, full_trajectory=full_trajectory,
+                              **kwargs)
+
+    def _check_metrics(self, metrics: Optional[Sequence[str]]) -> Optional[List[str]]:
+        if metrics is None:
+            return None
+
+        unknown = set(metrics).difference(self.metrics)
+        if unknown:
+            raise ValueError(f"Unknown `metrics` {unknown}, must be in {self.metrics}")
+        return list(metrics)
+
+    def _query_arrays(self, configs: Union[Sequence[dict], pd.DataFrame, np.ndarray],
+                      nepochs: Union[int, Sequence[int], np.ndarray] = 200,
+                      metrics: Optional[Sequence[str]] = None) \
+            -> Tuple[np.ndarray, List[str]]:
+        """ Same as `query_batch()` without `full_trajectory`, but returns the results as
+        an array of shape [n_configs, n_metrics] along with the names of its columns,
+        which skips the construction of a DataFrame and its index, e.g. for the many
+        small queries of a simulation. """
+
+        metrics = self._check_metrics(metrics)
+        features = self._configs_to_columns(configs)
+        config_idx, epochs = self._expand_epochs(
+            len(next(iter(features.values()))), nepochs, False)
+
+        if self.kind is BenchmarkTypes.Surrogate:
+            return self._predict_surrogate(features, config_idx, epochs, metrics)
 
-        outputs: pd.DataFrame = pd.concat(outputs, axis=1)
-        # outputs = outputs.reindex(index=epochs)
-        outputs.index = epochs
-        return outputs.to_dict(orient="index")
+        if self.kind is BenchmarkTypes.Table:
+            rows = self._table_rows(features, config_idx, epochs)
+            labels = list(self._table_label_columns.keys()) if metrics is None \
+                else metrics
+            outputs = np.column_stack([self._table_label_columns[k][rows]
+                                       for k in labels])
+            return outputs, labels
+
+        result = self._batch_fn(features=features, config_idx=config_idx, epochs=epochs,
+                                metrics=metrics)
+        return result.to_numpy(), result.columns.tolist()
+
+    def _call_batch(self, configs: Sequence[dict],
+                    nepochs: Union[int, Sequence[int]] = 200,
+                    full_trajectory: bool = False) -> List[dict]:
+        """ Answer many individual queries with a single call to `query_batch()`. Returns
+        one result per configuration, in the same format as `__call__()`. Only the
+        queries missing from the result cache, if any, are passed on. """
+
+        if self.result_cache is None or self.kind is BenchmarkTypes.Live:
+            return self._split_batch(configs, nepochs, full_trajectory)
+
+        counts: List[int] = np.broadcast_to(np.asarray(nepochs), (len(configs),)).tolist()
+        keys = [self._result_key(c, n, full_trajectory) for c, n in zip(configs, counts)]
+        results = [self.result_cache.get(k) for k in keys]
+        missing = [i for i, r in enumerate(results) if r is None]
+        if missing:
+            computed = self._split_batch([configs[i] for i in missing],
+                                         [counts[i] for i in missing], full_trajectory)
+            for i, result in zip(missing, computed):
+                self.result_cache.put(keys[i], result)
+                results[i] = result
+        return cast(List[dict], results)
+
+    def _split_batch(self, configs: Sequence[dict], nepochs: Union[int, Sequence[int]],
+                     full_trajectory: bool) -> List[dict]:
+        result = self.query_batch(configs, nepochs=nepochs,
+                                  full_trajectory=full_trajectory)
+        labels = result.columns.tolist()
+        values = result.to_numpy().tolist()
+        epochs = result.index.get_level_values("epoch").tolist()
+        # The rows of each configuration are contiguous and in order
+        bounds = cast(List[int], np.searchsorted(
+            result.index.get_level_values("config").to_numpy(),
+            np.arange(len(configs) + 1)).tolist())
+        return [{epochs[j]: dict(zip(labels, values[j])) for j in range(start, stop)}
+                for start, stop in zip(bounds[:-1], bounds[1:])]
+
+    def learning_curves(self, configs: Union[Sequence[dict], pd.DataFrame, np.ndarray],
+                        epochs: Optional[Sequence[int]] = None) -> np.ndarray:
+        """
+        Query the learning curves of a batch of configurations on a common grid of
+        epochs. For the surrogate benchmark, each configuration is encoded only once
+        and only the epoch is varied, which makes this the most efficient way of
+        querying many full or partial trajectories, e.g. for multi-fidelity optimizers.
+
+        configs: sequence of dicts, pandas DataFrame or NumPy array
+            The configurations to be queried, consult `query_batch()` for details.
+        epochs: optional sequence of ints
+            The epochs at which the metrics are queried. Need not be contiguous, e.g.
+            [1, 3, 9, 27, 81, 200]. Defaults to every epoch from 1 to 200.
+
+        Returns a dense array of shape [n_configs, n_epochs, n_metrics], where the
+        metrics follow the order of `Benchmark.metrics`.
+        """
 
-    def _benchmark_tabular(self, config: dict, nepochs: Optional[int] = 200,
-                           full_trajectory: bool = False, **kwargs) -> dict:
-        assert nepochs > 1
-        assert self._table_features is not None and self._table_labels is not None,\
+        grid = np.arange(1, 201) if epochs is None else np.asarray(epochs, dtype=int)
+        assert grid.ndim == 1 and np.all(grid > 0)
+        features = self._configs_to_columns(configs)
+        nconfigs = len(next(iter(features.values())))
+
+        if self.kind is BenchmarkTypes.Surrogate and self._fused_surrogate is not None:
+            return self._fused_surrogate.predict_learning_curves(
+                features, grid, models=list(self.metrics),
+                codes=joint_config_encoder.codes(features))
+
+        config_idx = np.repeat(np.arange(nconfigs), grid.size)
+        outputs = self._batch_fn(features=features, config_idx=config_idx,
+                                 epochs=np.tile(grid, nconfigs))
+        outputs = outputs.loc[:, list(self.metrics)].to_numpy()
+        return outputs.reshape(nconfigs, grid.size, len(self.metrics))
+
+    def start(self, config: dict) -> "BenchmarkRun":
+        """
+        Start a run of the given configuration, which can then be advanced to ever larger
+        numbers of epochs, as multi-fidelity optimizers such as Hyperband or freeze-thaw
+        do. Everything that does not depend on the epoch, i.e. the encoding of the
+        configuration for the surrogate or the location of its trajectory in the table,
+        is computed only once here, and each call to `BenchmarkRun.advance()` only
+        computes the epochs that are new.
+
+        config: dict
+            The configuration to be evaluated. Any "epoch" value is ignored.
+        """
+
+        features = self._configs_to_columns([config])
+        if self.kind is BenchmarkTypes.Surrogate:
+            query = self._start_surrogate(features)
+        elif self.kind is BenchmarkTypes.Table:
+            query = self._start_tabular(config)
+        else:
+            raise NotImplementedError(f"Runs are not supported for benchmarks of the "
+                                      f"kind {self.kind.value}.")
+        return BenchmarkRun(joint_config_encoder.to_dicts(features)[0], query)
+
+    def _start_surrogate(self, features: Dict[str, np.ndarray]) \
+            -> Callable[[np.ndarray], Tuple[np.ndarray, List[str]]]:
+        codes = joint_config_encoder.codes(features)
+        fused = self._fused_surrogate
+        if fused is None:
+            return lambda epochs: self._predict_surrogate(
+                features, np.zeros_like(epochs), epochs)
+
+        prepared = fused.prepare(features, codes=codes)
+        labels = list(fused.label_headers)
+        return lambda epochs: (fused.predict_prepared(
+            prepared, np.zeros_like(epochs), epochs), labels)
+
+    def _start_tabular(self, config: dict) \
+            -> Callable[[np.ndarray], Tuple[np.ndarray, List[str]]]:
+        assert self._table_index is not None, \
             "No performance dataset has been loaded into memory - a tabular query " \
             "cannot be made."
 
-        query = config.copy()
-        if "epoch" in query:
-            query.pop("epoch")
+        rows = self._table_index.trajectory(config)
+        labels = list(self._table_label_columns.keys())
+        outputs = np.column_stack([self._table_label_columns[k][rows] for k in labels])
+        # Epochs in ascending order, resolving duplicates to their first occurrence
+        order = np.argsort(self._table_epochs[rows], kind="stable")
+        known = self._table_epochs[rows][order]
+
+        def query(epochs: np.ndarray) -> Tuple[np.ndarray, List[str]]:
+            pos = np.minimum(np.searchsorted(known, epochs), known.size - 1)
+            missing = known[pos] != epochs
+            if np.any(missing):
+                raise KeyError(f"Could not find any entries for the config {config} at "
+                               f"{epochs[missing].tolist()} epochs.")
+            return outputs[order[pos]], labels
+
+        return query
+
+    @staticmethod
+    def _configs_to_columns(configs: Union[Sequence[dict], pd.DataFrame, np.ndarray]) \
+            -> Dict[str, np.ndarray]:
+        """ Convert a batch of configurations given in any of the formats supported by
+        `query_batch()` into a dict mapping each parameter of the search space to a 1D
+        array of values, dropping any "epoch" values. """
+
+        return joint_config_encoder.columns(configs)
+
+    @staticmethod
+    def _expand_epochs(nconfigs: int, nepochs: Union[int, Sequence[int], np.ndarray],
+                       full_trajectory: bool) -> Tuple[np.ndarray, np.ndarray]:
+        """ Generate the index of the configuration and the epoch of every row to be
+        queried. """
+
+        counts = np.broadcast_to(np.asarray(nepochs, dtype=int), (nconfigs,))
+        assert np.all(counts > 0)
+
+        if full_trajectory:
+            config_idx = np.repeat(np.arange(nconfigs), counts)
+            # Per-config epoch counters, 1..nepochs[i], without a Python level loop
+            offsets = np.repeat(np.cumsum(counts) - counts, counts)
+            epochs = np.arange(config_idx.size) - offsets + 1
+        else:
+            config_idx = np.arange(nconfigs)
+            epochs = counts.copy()
 
-        query_df = pd.DataFrame(query, index=list(range(1, nepochs+1)) \
-                                if full_trajectory else [nepochs])
-        query_df.rename_axis("epoch", axis=0, inplace=True)
-        query_df = query_df.reset_index()
+        return config_idx, epochs
 
-        check = self._features.difference(query_df.columns)
-        if check.size != 0:
-            raise ValueError(f"The given query has missing parameters: {check.tolist()}")
+    def _benchmark_surrogate(self, config: dict, nepochs: Optional[int] = 200,
+                             full_trajectory: bool = False, **kwargs) -> dict:
+        assert nepochs is not None and nepochs > 0
+
+        features = self._configs_to_columns([config])
+        _, epochs = self._expand_epochs(1, nepochs, full_trajectory)
+        outputs, labels = self._predict_surrogate(
+            features, np.zeros_like(epochs), epochs)
+        return {e: dict(zip(labels, row)) for e, row in
+                zip(epochs.tolist(), outputs.tolist())}
+
+    def _batch_surrogate(self, features: Dict[str, np.ndarray], config_idx: np.ndarray,
+                         epochs: np.ndarray, metrics: Optional[List[str]] = None,
+                         full_trajectory: bool = False,
+                         **kwargs) -> pd.DataFrame:
+        outputs, labels = self._predict_surrogate(features, config_idx, epochs, metrics)
+        index = pd.MultiIndex.from_arrays([config_idx, epochs], names=["config", "epoch"])
+        return pd.DataFrame(outputs, index=index, columns=labels)
+
+    def _predict_surrogate(self, features: Dict[str, np.ndarray], config_idx: np.ndarray,
+                           epochs: np.ndarray, metrics: Optional[List[str]] = None) \
+            -> Tuple[np.ndarray, List[str]]:
+        """ Predict all metrics, or only those in `metrics`, for the configurations in
+        `features` selected by `config_idx` at the corresponding `epochs`. Returns the
+        predictions as an array along with the names of its columns. """
+
+        # Validates the configurations and maps their categories to integer codes once,
+        # which all surrogate models then share for their one-hot encodings
+        codes = joint_config_encoder.codes(features)
+        assert self._surrogates is not None
+
+        if self._fused_surrogate is not None and metrics is None:
+            # Each configuration is encoded once, no matter how many epochs are queried
+            outputs = self._fused_surrogate.predict_at(features, config_idx, epochs,
+                                                       codes=codes)
+            return outputs, list(self._fused_surrogate.label_headers)
+
+        surrogates = self._surrogates if metrics is None else \
+            {o: self._surrogates[o] for o in metrics}
+        if self._fused_surrogate is not None:
+            fused = self._fused_surrogate
+            outputs = fused.predict_at(features, config_idx, epochs, models=metrics,
+                                       codes=codes)
+            labels = [h for o in metrics for h in fused.models[o].label_headers]
+            return outputs, labels
+
+        if self._model_cache is not None:
+            # Only the models of the queried metrics are loaded
+            models = {o: s.model for o, s in surrogates.items()}
+            from jahs_bench.surrogate.compiled import CompiledSurrogate, FusedSurrogate
+            if all(isinstance(m, CompiledSurrogate) for m in models.values()):
+                fused = FusedSurrogate(models, max_workers=self.n_threads,
+                                       executor=self._executor)
+                outputs = fused.predict_at(features, config_idx, epochs, codes=codes)
+                return outputs, list(fused.label_headers)
+
+        frame = pd.DataFrame(features).take(config_idx).assign(epoch=epochs)
+        predictions = pd.concat([_predict_frame(model, frame)
+                                 for model in surrogates.values()], axis=1)
+        return predictions.to_numpy(), predictions.columns.tolist()
 
-        idx = pd.merge(self._table_features, query_df, how="inner")["Sample ID"]
+    def _benchmark_tabular(self, config: dict, nepochs: Optional[int] = 200,
+                           full_trajectory: bool = False, **kwargs) -> dict:
+        assert nepochs is not None and nepochs > 0
+        assert self._table_index is not None, \
+            "No performance dataset has been loaded into memory - a tabular query " \
+            "cannot be made."
 
-        if idx.size == 0:
-            raise KeyError(f"Could not find any entries for the config {config} at "
-                           f"{nepochs} epochs.") from e
-        elif full_trajectory:
+        if full_trajectory:
             # Return the full trajectory, but only for the first instance of this config
             # that was found.
-            result = self._table_labels.loc[idx, :].iloc[:nepochs]
+            rows = self._table_index.trajectory(config, nepochs)
         else:
             # Return only the first result that was found
-            result = self._table_labels.loc[idx, :].iloc[:1]
+            rows = [self._table_index.lookup(config, nepochs)]
 
-        return result.to_dict(orient="index")
+        epochs = self._table_epochs[rows].tolist()
+        columns = {k: v[rows].tolist() for k, v in self._table_label_columns.items()}
+        return {e: {k: v[i] for k, v in columns.items()} for i, e in enumerate(epochs)}
+
+    def _batch_tabular(self, features: Dict[str, np.ndarray], config_idx: np.ndarray,
+                       epochs: np.ndarray, metrics: Optional[List[str]] = None,
+                       full_trajectory: bool = False, **kwargs) -> pd.DataFrame:
+        assert self._table_index is not None, \
+            "No performance dataset has been loaded into memory - a tabular query " \
+            "cannot be made."
+
+        rows = self._table_rows(features, config_idx, epochs,
+                                partial_trajectories=full_trajectory)
+        if full_trajectory:
+            # Same as `__call__()`, the epochs missing from a trajectory are skipped
+            found = rows >= 0
+            rows, config_idx, epochs = rows[found], config_idx[found], epochs[found]
+        labels = self._table_labels if metrics is None else self._table_labels[metrics]
+        result = labels.iloc[rows]
+        result.index = pd.MultiIndex.from_arrays([config_idx, epochs],
+                                                 names=["config", "epoch"])
+        return result
+
+    def _table_rows(self, features: Dict[str, np.ndarray], config_idx: np.ndarray,
+                    epochs: np.ndarray, partial_trajectories: bool = False) -> np.ndarray:
+        """ The positions of the rows of the table containing the configurations in
+        `features` selected by `config_idx` at the corresponding `epochs`. Raises a
+        KeyError if any (config, epoch) pair is missing. With `partial_trajectories`,
+        missing pairs are marked with -1 instead and a KeyError is only raised if none of
+        the epochs of a configuration were found. """
+
+        # Only the first instance of each (config, epoch) pair in the table is used
+        assert self._table_index is not None
+        configs = {k: v[config_idx] for k, v in features.items()}
+        rows = self._table_index.lookup_batch(configs, epochs)
+
+        if partial_trajectories:
+            found = np.zeros(len(next(iter(features.values()))), dtype=bool)
+            found[config_idx[rows >= 0]] = True
+            missing = np.flatnonzero(~found[config_idx])
+        else:
+            missing = np.flatnonzero(rows < 0)
+        if missing.size != 0:
+            examples = list(zip(config_idx[missing[:5]].tolist(),
+                                epochs[missing[:5]].tolist()))
+            raise KeyError(f"Could not find any entries for {missing.size} of the "
+                           f"queried (config, epoch) pairs, e.g. {examples}.")
+        return rows
 
     def _benchmark_live(self, config: dict, nepochs: Optional[int] = 200,
                         full_trajectory: bool = False, *,
@@ -265,7 +772,7 @@ class Benchmark:
         temporary files after the function call.
         """
 
-        if not data_creation_available:
+        if not _load_data_creation():
             raise RuntimeError(
                 f"Cannot train the given configuration since the required modules have "
                 f"not been installed. Optional component 'data_creation' of "
@@ -307,12 +814,35 @@ class Benchmark:
 
         return result
 
+    def _batch_live(self, features: Dict[str, np.ndarray], config_idx: np.ndarray,
+                    epochs: np.ndarray, metrics: Optional[List[str]] = None,
+                    full_trajectory: bool = False,
+                    **kwargs) -> pd.DataFrame:
+        # Live training can not be batched, each unique configuration is trained once up
+        # to the largest number of epochs requested for it.
+        query = pd.DataFrame({"config": config_idx, "epoch": epochs})
+        results = []
+        for i, group in query.groupby("config", sort=False):
+            config = {k: v[i].item() for k, v in features.items()}
+            trajectory = self._benchmark_live(config, nepochs=int(group.epoch.max()),
+                                              full_trajectory=True, **kwargs)
+            trajectory = pd.DataFrame.from_dict(trajectory, orient="index")
+            trajectory = trajectory.reindex(group.epoch.values)
+            trajectory.index = pd.MultiIndex.from_arrays(
+                [group.config.values, group.epoch.values], names=["config", "epoch"])
+            results.append(trajectory)
+
+        results = pd.concat(results, axis=0).reindex(
+            pd.MultiIndex.from_arrays([config_idx, epochs], names=["config", "epoch"]))
+        return results if metrics is None else results[metrics]
+
     def sample_config(self,
                       random_state: Optional[Union[int, np.random.RandomState]] = None,
                       ) -> dict:
         """ For a tabular benchmark, return a random configuration from the set of
         configurations recorded in the currently loaded dataset. Otherwise, randomly
-        sample a configuration from the full search space and return it. """
+        sample a configuration from the full search space and return it. Only the given
+        random state is used, thus the method is thread-safe. """
 
         if not isinstance(random_state, np.random.RandomState):
             random_state = np.random.RandomState(random_state)
@@ -325,28 +855,130 @@ class Benchmark:
             row = self._table_features.loc[index].drop("Sample ID")
             config = row.to_dict()
         else:
-            joint_config_space.random = random_state
-            config = joint_config_space.sample_configuration().get_dictionary()
+            # Unlike joint_config_space.sample_configuration(), leaves the random state
+            # of the shared config space alone
+            config = joint_config_encoder.to_dicts(
+                joint_config_encoder.sample(1, random_state))[0]
             nepochs = random_state.randint(1, 200)
             config['epoch'] = nepochs
 
         return config
 
+    def sample_configs(self, n: int,
+                       random_state: Optional[Union[int, np.random.RandomState]] = None,
+                       encoded: bool = False) -> Union[List[dict], np.ndarray]:
+        """
+        Sample many configurations at once, in the same manner as `sample_config()`.
+        Every parameter is sampled in a single vectorized call and the random state of
+        `joint_config_space` is left untouched, which makes this considerably faster
+        than repeatedly calling `sample_config()`, e.g. for random search baselines.
+
+        n: int
+            The number of configurations to be sampled.
+        random_state: optional int or np.random.RandomState
+            The source of randomness. Passing the same seed reproduces the same samples.
+        encoded: bool
+            When True, the configurations are returned as a float32 array of shape
+            [n, joint_config_encoder.n_features], as generated by
+            `joint_config_encoder.encode()`, without the epochs. Otherwise, a list of
+            dicts in the format of `sample_config()` is returned.
+        """
+
+        if not isinstance(random_state, np.random.RandomState):
+            random_state = np.random.RandomState(random_state)
+
+        if self.kind is BenchmarkTypes.Table:
+            assert self._table_features is not None, \
+                "Cannot extract random samples - the tabular benchmark could not be " \
+                "properly initialized."
+            rows = random_state.choice(self._table_features.shape[0], size=n)
+            samples = self._table_features.drop(columns="Sample ID").take(rows)
+            columns = {c: samples[c].to_numpy() for c in samples.columns}
+        else:
+            columns = joint_config_encoder.sample(n, random_state)
+            columns["epoch"] = random_state.randint(1, 200, size=n)
+
+        if encoded:
+            return joint_config_encoder.encode(columns)
+
+        names = list(columns.keys())
+        values = [columns[c].tolist() for c in names]
+        return [dict(zip(names, row)) for row in zip(*values)]
+
+
+class BenchmarkRun:
+    """ A single configuration being evaluated on a benchmark, epoch by epoch. Created by
+    `Benchmark.start()`. The run keeps track of the epoch it has been advanced to and of
+    the simulated time spent on training it so far, as given by the "runtime" metric,
+    such that multi-fidelity optimization can be simulated faithfully with respect to
+    wall-clock time. """
+
+    def __init__(self, config: dict,
+                 query: Callable[[np.ndarray], Tuple[np.ndarray, List[str]]]):
+        self.config = config
+        self.epoch = 0
+        self.runtime: Optional[float] = None
+        self._query = query
+
+    def advance(self, to_epoch: int) -> dict:
+        """
+        Continue the run up to and including `to_epoch` epochs and return the metrics of
+        the newly reached epochs only, in the same format as `Benchmark.__call__()` with
+        `full_trajectory=True`. Nothing is computed and an empty dict is returned if the
+        run has already reached `to_epoch`.
+        """
+
+        if to_epoch <= self.epoch:
+            return {}
 
-class _LazySurrogate(XGBSurrogate):
-    """ A wrapper around the XGBSurrogate object that defers the actual read of the
+        epochs = np.arange(self.epoch + 1, to_epoch + 1)
+        outputs, labels = self._query(epochs)
+        results = {e: dict(zip(labels, row)) for e, row in
+                   zip(epochs.tolist(), outputs.tolist())}
+
+        self.epoch = to_epoch
+        if "runtime" in labels:
+            # The runtime metric is the cumulative training time up to the epoch
+            self.runtime = results[to_epoch]["runtime"]
+        return results
+
+    def __repr__(self) -> str:
+        return f"BenchmarkRun(epoch={self.epoch}, runtime={self.runtime}, " \
+               f"config={self.config})"
+
+
+def _predict_frame(model: Union["CompiledSurrogate", "XGBSurrogate"],
+                   features: pd.DataFrame) -> pd.DataFrame:
+    """ Predictions of either kind of surrogate model as a DataFrame, as returned by
+    `XGBSurrogate.predict()`. """
+
+    from jahs_bench.surrogate.compiled import CompiledSurrogate
+    if not isinstance(model, CompiledSurrogate):
+        return model.predict(features)
+
+    return pd.DataFrame(model.predict(features), index=features.index,
+                        columns=list(model.label_headers))
+
+
+class _LazySurrogate:
+    """ A stand-in for an XGBSurrogate object that defers the actual read of the
     surrogate model from the disk to the moment at which the model is actually used for a
-    prediction, thus reducing overall memory requirements at the expense of more disk
-    reads. """
+    prediction. The loaded model is kept in a ModelCache, thus the memory requirements
+    are bounded by the cache's budget while repeated queries need not read the model
+    from the disk again, unless it was evicted in the meantime. """
 
-    def __init__(self, model_pth: Union[str, Path], **kwargs):
-        self._model_pth = Path(model_pth)
+    def __init__(self, model_pth: Union[str, Path], cache: "ModelCache",
+                 key: Tuple[str, str], **kwargs):
+        self.model_pth = Path(model_pth)
+        self.cache = cache
+        self.key = key
+
+    @property
+    def model(self) -> Union["CompiledSurrogate", "XGBSurrogate"]:
+        return self.cache.get(self.key, self.model_pth)
 
     def predict(self, features: pd.DataFrame) -> pd.DataFrame:
-        model = XGBSurrogate.load(self._model_pth)
-        res = model.predict(features)
-        del model
-        return res
+        return _predict_frame(self.model, features)
 
     def fit(self, *args, **kwargs):
         raise RuntimeError("Lazy loading of surrogates is enabled. This mode only "
@@ -362,7 +994,6 @@ class _LazySurrogate(XGBSurrogate):
                            "supports the predict() functionality.")
 
 
-
 if __name__ == "__main__":
     b = Benchmark(task="cifar10", kind="surrogate")
     config = b.sample_config()
@@ -1,33 +1,592 @@
-import requests
+""" Downloads and extracts the archives of the surrogate models and the performance
+datasets. An archive is downloaded in several concurrent segments using HTTP range
+requests, written to the disk chunk by chunk, and extracted while it is still being
+downloaded, by reading it as a stream in the order of its bytes. Interrupted downloads
+are resumed where they stopped, the archive's SHA-256 digest is computed on the fly and,
+if an expected digest is given or was recorded when the archive was downloaded,
+verified before any extracted file is moved into place, and the extraction can be
+limited to a subset of the archive's members, e.g. a single task or metric. """
+
+import fnmatch
+import hashlib
+import json
+import os
+import shutil
 import tarfile
+import threading
+import time
 from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import requests
 
 surrogate_url = "https://ml.informatik.uni-freiburg.de/research-artifacts/jahs_bench_201/v1.1.0/assembled_surrogates.tar"
 metric_url = "https://ml.informatik.uni-freiburg.de/research-artifacts/jahs_bench_201/v1.1.0/metric_data.tar"
 
+CHUNK_SIZE = 1 << 20
+
+
+class _Segment:
+    """ The byte range [start, end) of a download, of which the first `done` bytes have
+    been written to the disk. `end` is None when the size of the download is unknown. """
+
+    def __init__(self, start: int, end: Optional[int], done: int = 0):
+        self.start = start
+        self.end = end
+        self.done = done
+
+    @property
+    def complete(self) -> bool:
+        return self.end is not None and self.start + self.done >= self.end
+
+
+def _probe(url: str, timeout: float) -> Tuple[Optional[int], bool]:
+    """ The size of the file at `url` and whether the server supports range requests. """
+
+    with requests.get(url, headers={"Range": "bytes=0-0"}, stream=True,
+                      timeout=timeout) as response:
+        response.raise_for_status()
+        if response.status_code == 206:
+            total = response.headers.get("Content-Range", "").rpartition("/")[2]
+            return (int(total), True) if total.isdigit() else (None, False)
+        size = response.headers.get("Content-Length")
+        return (int(size) if size is not None else None), False
+
+
+class _Download:
+    """ Downloads the file at `url` to `path` in concurrent segments and, at the same
+    time, provides a sequential, file-like view of it, whose `read()` blocks until the
+    requested bytes have arrived. The progress of every segment is saved next to the
+    file, such that an interrupted download can be resumed. """
+
+    def __init__(self, url: str, path: Path, workers: int = 4,
+                 chunk_size: int = CHUNK_SIZE, timeout: float = 60., retries: int = 3,
+                 report_interval: float = 10., save_interval: float = 1.):
+        self.url = url
+        self.path = path
+        self.state_path = path.with_name(path.name + ".json")
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.retries = retries
+        self.report_interval = report_interval
+        self.save_interval = save_interval
+
+        self.size, self.ranges = _probe(url, timeout)
+        if self.size is None or not self.ranges:
+            # Neither resumable nor divisible into segments
+            self.ranges = False
+            workers = 1
+        segments = self._resume() if self.ranges else None
+        if segments is None:
+            segments = self._split(workers)
+            with open(self.path, "wb") as f:
+                if self.size is not None:
+                    f.truncate(self.size)
+        self.segments: List[_Segment] = segments
+
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._errors: List[BaseException] = []
+        self._threads = [threading.Thread(target=self._fetch, args=(s,), daemon=True)
+                         for s in self.segments if not s.complete]
+        # Unbuffered, since the file is filled in by other file objects: a buffered
+        # reader could keep serving the zeros it read ahead of the downloaded bytes
+        self._reader = open(self.path, "rb", buffering=0)
+        self._pos = 0
+        # The time for which the extraction was stalled, waiting for the download
+        self.waited = 0.
+        self._hash = hashlib.sha256()
+        self._last_report = time.monotonic()
+        self._started = time.monotonic()
+        self._resumed = self._downloaded()
+        self._save_lock = threading.Lock()
+        self._last_save = time.monotonic()
+
+    def _split(self, workers: int) -> List[_Segment]:
+        if self.size is None:
+            return [_Segment(0, None)]
+        step = max(-(-self.size // max(workers, 1)), 1)
+        return [_Segment(start, min(start + step, self.size))
+                for start in range(0, self.size, step)] or [_Segment(0, 0)]
+
+    def _resume(self) -> Optional[List[_Segment]]:
+        """ The segments of an earlier, interrupted download of the same file. """
+
+        if not (self.path.exists() and self.state_path.exists()):
+            return None
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if state.get("url") != self.url or state.get("size") != self.size or \
+                self.path.stat().st_size != self.size:
+            return None
+
+        segments = [_Segment(*s) for s in state["segments"]]
+        print(f"Resuming the download of {self.url} with "
+              f"{sum(s.done for s in segments) / 2 ** 20:.1f} MiB already downloaded.")
+        return segments
+
+    def save_state(self):
+        # Progress is only counted once written, thus the saved state never claims more
+        # than what is on the disk, even if the process is killed at any point
+        with self._cond:
+            state = {"url": self.url, "size": self.size,
+                     "segments": [(s.start, s.end, s.done) for s in self.segments]}
+        with self._save_lock:
+            tmp = self.state_path.with_name(self.state_path.name + ".tmp")
+            with open(tmp, "w") as f:
+                json.dump(state, f)
+            os.replace(tmp, self.state_path)
+            self._last_save = time.monotonic()
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+
+    def _fetch(self, segment: _Segment):
+        attempt = 0
+        while not segment.complete and not self._stop.is_set():
+            headers = {}
+            if self.ranges:
+                # With range requests, the size and thus the end of every segment is known
+                assert segment.end is not None
+                offset = segment.start + segment.done
+                headers["Range"] = f"bytes={offset}-{segment.end - 1}"
+            try:
+                with requests.get(self.url, headers=headers, stream=True,
+                                  timeout=self.timeout) as response, \
+                        open(self.path, "r+b", buffering=0) as f:
+                    response.raise_for_status()
+                    if self.ranges and response.status_code != 206:
+                        raise IOError(f"The server did not honour the range request "
+                                      f"for {self.url}.")
+                    f.seek(segment.start + segment.done)
+                    for chunk in response.iter_content(chunk_size=self.chunk_size):
+                        if self._stop.is_set():
+                            return
+                        f.write(chunk)
+                        with self._cond:
+                            segment.done += len(chunk)
+                            self._cond.notify_all()
+                        if self.ranges and \
+                                time.monotonic() - self._last_save > self.save_interval:
+                            self.save_state()
+                if segment.end is None:
+                    # The download of a file of unknown size ends with the stream
+                    with self._cond:
+                        segment.end = segment.start + segment.done
+                        self._cond.notify_all()
+                elif not segment.complete and not self._stop.is_set():
+                    raise IOError(f"The connection to {self.url} was closed early.")
+            except (requests.RequestException, OSError) as e:
+                attempt += 1
+                # Without range requests, a broken stream cannot be continued
+                if attempt > self.retries or not self.ranges:
+                    self._fail(e)
+                    return
+                time.sleep(min(2 ** attempt, 30))
+            except BaseException as e:
+                self._fail(e)
+                return
+
+    def _fail(self, error: BaseException):
+        with self._cond:
+            self._errors.append(error)
+            self._cond.notify_all()
+
+    def _downloaded(self) -> int:
+        return sum(s.done for s in self.segments)
+
+    def _available(self) -> Optional[int]:
+        """ The number of contiguous bytes available from the start of the file, or None
+        once the entire file is available. Must be called while holding the lock. """
+
+        available = 0
+        for segment in self.segments:
+            if not segment.complete:
+                return available + segment.done
+            assert segment.end is not None
+            available = segment.end
+        return None
+
+    def read(self, n: int = -1) -> bytes:
+        if n == 0:
+            return b""
+
+        with self._cond:
+            while True:
+                if self._errors:
+                    raise self._errors[0]
+                available = self._available()
+                if available is None or available > self._pos:
+                    break
+                start = time.monotonic()
+                self._cond.wait()
+                self.waited += time.monotonic() - start
+
+        if available is not None:
+            n = available - self._pos if n is None or n < 0 else \
+                min(n, available - self._pos)
+        self._reader.seek(self._pos)
+        data = self._reader.read(n)
+        self._pos += len(data)
+        self._hash.update(data)
+        self._report()
+        return data
+
+    def _report(self):
+        now = time.monotonic()
+        if now - self._last_report < self.report_interval:
+            return
+        self._last_report = now
+        downloaded = self._downloaded()
+        rate = (downloaded - self._resumed) / 2 ** 20 / max(now - self._started, 1e-9)
+        total = "" if self.size is None else \
+            f" of {self.size / 2 ** 20:.1f} MiB ({100 * downloaded / self.size:.0f}%)"
+        print(f"Downloaded {downloaded / 2 ** 20:.1f} MiB{total} at {rate:.1f} MiB/s, "
+              f"extracted {self._pos / 2 ** 20:.1f} MiB.")
+
+    def finish(self) -> str:
+        """ Wait for the download to complete, read any bytes not yet read and return
+        the SHA-256 digest of the entire file. """
+
+        while self.read(self.chunk_size):
+            pass
+        for thread in self._threads:
+            thread.join()
+        return self._hash.hexdigest()
+
+    def close(self):
+        """ Stop downloading and save the progress, such that the download can be
+        resumed. """
+
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._reader.close()
+        self.save_state()
+
+
+class _LocalFile:
+    """ A file-like view of an already downloaded archive that computes its digest. """
+
+    waited = 0.
+
+    def __init__(self, path: Path):
+        self._file = open(path, "rb")
+        self._hash = hashlib.sha256()
+
+    def read(self, n: int = -1) -> bytes:
+        data = self._file.read(n)
+        self._hash.update(data)
+        return data
+
+    def finish(self) -> str:
+        while self.read(CHUNK_SIZE):
+            pass
+        return self._hash.hexdigest()
+
+    def close(self):
+        self._file.close()
+
+
+class _RemoteFile:
+    """ A seekable, read-only file-like view of the file at `url` that downloads only the
+    byte ranges which are actually read, using HTTP range requests. Reading a tar archive
+    through it in seekable mode skips the contents of all members that are not
+    extracted. Small reads, e.g. of the members' headers, are served from a read-ahead
+    buffer, and the contents of a member announced by `expect()` are requested at once,
+    in pieces of at most `max_request` bytes. """
+
+    def __init__(self, url: str, size: int, timeout: float = 60., retries: int = 3,
+                 read_ahead: int = 1 << 16, max_request: int = 1 << 24):
+        self.url = url
+        self.size = size
+        self.timeout = timeout
+        self.retries = retries
+        self.read_ahead = read_ahead
+        self.max_request = max_request
+
+        self._pos = 0
+        self._buffer = b""
+        self._buffer_start = 0
+        self._expected = (0, 0)
+        self.fetched = 0
+        self.requests = 0
+        # The time spent waiting for the server
+        self.waited = 0.
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        if whence == os.SEEK_CUR:
+            offset += self._pos
+        elif whence == os.SEEK_END:
+            offset += self.size
+        self._pos = max(offset, 0)
+        return self._pos
+
+    def expect(self, offset: int, n: int):
+        """ Announce that the `n` bytes starting at `offset` are going to be read. """
+
+        self._expected = (offset, offset + n)
+
+    def read(self, n: int = -1) -> bytes:
+        remaining = self.size - self._pos
+        n = remaining if n is None or n < 0 else min(n, remaining)
+        if n <= 0:
+            return b""
+
+        chunks = []
+        while n > 0:
+            offset = self._pos - self._buffer_start
+            if not 0 <= offset < len(self._buffer):
+                start, end = self._expected
+                ahead = end - self._pos if start <= self._pos < end else self.read_ahead
+                self._fill(self._pos, max(n, min(ahead, self.max_request)))
+                offset = 0
+            chunks.append(self._buffer[offset:offset + n])
+            self._pos += len(chunks[-1])
+            n -= len(chunks[-1])
+        return b"".join(chunks)
+
+    def _fill(self, start: int, n: int):
+        end = min(start + n, self.size)
+        attempt = 0
+        began = time.monotonic()
+        while True:
+            try:
+                response = requests.get(self.url, timeout=self.timeout,
+                                        headers={"Range": f"bytes={start}-{end - 1}"})
+                response.raise_for_status()
+                if response.status_code != 206 or len(response.content) != end - start:
+                    raise IOError(f"The server did not honour the range request for "
+                                  f"{self.url}.")
+                break
+            except (requests.RequestException, OSError):
+                attempt += 1
+                if attempt > self.retries:
+                    raise
+                time.sleep(min(2 ** attempt, 30))
+
+        self._buffer = response.content
+        self._buffer_start = start
+        self.fetched += len(self._buffer)
+        self.requests += 1
+        self.waited += time.monotonic() - began
+
+    def close(self):
+        self._buffer = b""
+
+
+def _selected(name: str, include: Optional[Sequence[str]]) -> bool:
+    """ Whether the archive member `name` lies within, or is a parent directory of, any
+    of the paths in `include`, which may contain shell-style wildcards per component. """
+
+    if include is None:
+        return True
+    parts = Path(name).parts
+    for pattern in include:
+        pattern_parts = Path(pattern).parts
+        n = min(len(parts), len(pattern_parts))
+        if all(fnmatch.fnmatchcase(parts[i], pattern_parts[i]) for i in range(n)):
+            return True
+    return False
+
+
+def _extract(stream, outdir: Path, include: Optional[Sequence[str]],
+             seekable: bool = False) -> int:
+    """ Extract the selected members of a tar archive read as a stream or, if `seekable`,
+    from a seekable, uncompressed file. Returns the number of extracted files. """
+
+    nfiles = 0
+    archive = tarfile.open(fileobj=stream, mode="r:") if seekable else \
+        tarfile.open(fileobj=stream, mode="r|*")
+    with archive:
+        for member in archive:
+            name = os.path.normpath(member.name)
+            if os.path.isabs(name) or name.split(os.sep)[0] == "..":
+                raise ValueError(f"Refusing to extract the archive member {member.name} "
+                                 f"outside of the target directory.")
+            if not (member.isdir() or member.isfile()) or not _selected(name, include):
+                continue
+            if isinstance(stream, _RemoteFile):
+                stream.expect(member.offset_data, member.size)
+            if hasattr(tarfile, "data_filter"):
+                archive.extract(member, path=outdir, filter="data")
+            else:
+                archive.extract(member, path=outdir)
+            nfiles += member.isfile()
+    return nfiles
+
+
+def _merge_tree(src: Path, dst: Path):
+    """ Move the contents of the directory `src` into the directory `dst`, replacing
+    existing files. """
+
+    dst.mkdir(parents=True, exist_ok=True)
+    for entry in src.iterdir():
+        target = dst / entry.name
+        if entry.is_dir() and target.is_dir():
+            _merge_tree(entry, target)
+        else:
+            if target.is_dir():
+                shutil.rmtree(target)
+            os.replace(entry, target)
+
+
+def download_and_extract_url(url: str, save_dir, filename: str,
+                             sha256: Optional[str] = None,
+                             include: Optional[Sequence[str]] = None, workers: int = 4,
+                             chunk_size: int = CHUNK_SIZE, keep_archive: bool = True,
+                             sparse: bool = True) -> Dict[str, float]:
+    """
+    Download the tar archive at `url` and extract it into `save_dir`, extracting while
+    the archive is being downloaded. An archive that has already been downloaded
+    completely is extracted again without downloading it, and a partial download left
+    behind by an interruption is resumed.
+
+    :param url: str
+        The URL of the archive.
+    :param save_dir: Path-like
+        The directory that the archive is saved to and extracted into.
+    :param filename: str
+        The name under which the archive is saved.
+    :param sha256: optional str
+        The expected SHA-256 digest of the archive, as a hex string. On a mismatch, the
+        download is discarded, nothing is extracted and a RuntimeError is raised. When
+        None, the digest of a downloaded archive is only reported and recorded next to
+        it, and a previously downloaded archive is verified against its recorded digest.
+    :param include: optional sequence of str
+        When given, only the archive members within these paths are extracted, e.g.
+        ["assembled_surrogates/cifar10/valid-acc"]. Path components may contain
+        shell-style wildcards, e.g. "assembled_surrogates/*/valid-acc".
+    :param workers: int
+        The number of segments downloaded concurrently. Servers that do not support
+        range requests are downloaded in a single, non-resumable stream.
+    :param chunk_size: int
+        The number of bytes written to the disk at once.
+    :param keep_archive: bool
+        When False, the archive is deleted after it was extracted.
+    :param sparse: bool
+        When True, `include` is given, `sha256` is not and the archive has not been
+        downloaded, neither completely nor partially, only the headers of the archive's
+        members and the contents of the selected members are downloaded, using range
+        requests, and the archive itself is not saved. This transfers only a fraction of
+        the archive, but since the archive is never read as a whole, its digest cannot
+        be verified, and the members are fetched one after another by a single
+        connection without resuming an interrupted download. Whenever `sha256` is
+        given, the entire archive is downloaded and verified instead. Also falls back to
+        downloading the entire archive if the server does not support range requests.
+    :return: dict
+        The time, in seconds, spent waiting for the "download" and the remaining time
+        spent to "extract" the archive. Since both overlap, their sum is the total time.
+    """
 
-def download_and_extract_url(url, save_dir, filename):
     save_dir = Path(save_dir)
     save_dir.mkdir(parents=True, exist_ok=True)
-    save_tar_file = save_dir / filename
+    archive = save_dir / filename
+    partial = save_dir / (filename + ".part")
+    record = save_dir / (filename + ".sha256")
+    staging = save_dir / f".{filename}.extracting"
+    if staging.exists():
+        shutil.rmtree(staging)
+
+    start = time.monotonic()
+    source: Union[_LocalFile, _RemoteFile, _Download]
+    expected = sha256
+    if archive.exists():
+        print(f"Extracting the previously downloaded archive {archive}.")
+        source = _LocalFile(archive)
+        if expected is None and record.exists():
+            expected = record.read_text().strip()
+    else:
+        size, ranges = None, False
+        if sparse and include is not None and sha256 is None and not partial.exists():
+            size, ranges = _probe(url, timeout=60.)
+        if size is not None and ranges:
+            print(f"Downloading the selected members of {url}.")
+            source = _RemoteFile(url, size)
+        else:
+            print(f"Starting download of {url}, this might take a while.")
+            download = _Download(url, partial, workers=workers, chunk_size=chunk_size)
+            download.start()
+            source = download
+
+    try:
+        nfiles = _extract(source, staging, include,
+                          seekable=isinstance(source, _RemoteFile))
+        digest = None if isinstance(source, _RemoteFile) else source.finish()
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    finally:
+        source.close()
+
+    if expected is not None and digest != expected.lower():
+        shutil.rmtree(staging, ignore_errors=True)
+        corrupt = archive if isinstance(source, _LocalFile) else partial
+        corrupt.unlink()
+        for path in (partial.with_name(partial.name + ".json"), record):
+            if path.exists():
+                path.unlink()
+        raise RuntimeError(f"The SHA-256 digest {digest} of the archive downloaded from "
+                           f"{url} does not match the expected digest {expected}. The "
+                           f"archive has been deleted, please try again.")
+
+    if staging.exists():
+        _merge_tree(staging, save_dir)
+        shutil.rmtree(staging)
+    if isinstance(source, _Download):
+        os.replace(partial, archive)
+        source.state_path.unlink()
+        record.write_text(f"{digest}\n")
+    if not keep_archive:
+        for path in (archive, record):
+            if path.exists():
+                path.unlink()
+
+    elapsed = time.monotonic() - start
+    if isinstance(source, _RemoteFile):
+        print(f"Done, extracted {nfiles} files in {elapsed:.1f} seconds, downloading "
+              f"{source.fetched / 2 ** 20:.1f} MiB of the "
+              f"{source.size / 2 ** 20:.1f} MiB archive in {source.requests} requests.")
+    else:
+        print(f"Done, extracted {nfiles} files in {elapsed:.1f} seconds. SHA-256 digest "
+              f"of the archive: {digest}")
+    return {"download": source.waited, "extract": elapsed - source.waited}
 
-    print(f"Starting download of {url}, this might take a while.")
-    with requests.get(url, stream=True) as response:
-        with open(save_tar_file, 'wb') as f:
-            f.write(response.raw.read())
 
-    print("Download finished, extracting now")
-    with tarfile.open(save_tar_file, 'r') as f:
-        f.extractall(path=save_dir)
-    print("Done extracting")
+def download_surrogates(save_dir="jahs_bench_data", tasks: Optional[Sequence[str]] = None,
+                        metrics: Optional[Sequence[str]] = None, url: str = surrogate_url,
+                        **kwargs):
+    """ Download the surrogate models. Only the models of the given `tasks` and `metrics`
+    are extracted, all of them when None. Consult `download_and_extract_url()` for the
+    other arguments. """
 
+    include = None
+    if tasks is not None or metrics is not None:
+        include = [f"assembled_surrogates/{t}/{m}" for t in (tasks or ["*"])
+                   for m in (metrics or ["*"])]
+    return download_and_extract_url(url, save_dir, "assembled_surrogates.tar",
+                                    include=include, **kwargs)
 
-def download_surrogates(save_dir="jahs_bench_data"):
-    download_and_extract_url(surrogate_url, save_dir, "assembled_surrogates.tar")
 
+def download_metrics(save_dir="jahs_bench_data", tasks: Optional[Sequence[str]] = None,
+                     url: str = metric_url, **kwargs):
+    """ Download the performance datasets. Only the datasets of the given `tasks` are
+    extracted, all of them when None. Consult `download_and_extract_url()` for the other
+    arguments. """
 
-def download_metrics(save_dir="jahs_bench_data"):
-    download_and_extract_url(metric_url, save_dir, "metric_data.tar")
+    include = None if tasks is None else [f"metric_data/{t}" for t in tasks]
+    return download_and_extract_url(url, save_dir, "metric_data.tar", include=include,
+                                    **kwargs)
 
 
 if __name__ == "__main__":
@@ -35,12 +594,28 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--target", default="surrogates", choices=["surrogates", "metrics", "all"])
     parser.add_argument("--save_dir", default="jahs_bench_data")
+    parser.add_argument("--tasks", nargs="+", default=None,
+                        help="Only extract the data of these tasks.")
+    parser.add_argument("--metrics", nargs="+", default=None,
+                        help="Only extract the surrogate models of these metrics.")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="The number of segments downloaded concurrently.")
+    parser.add_argument("--sha256", default=None,
+                        help="The expected SHA-256 digest of the archive, as a hex "
+                             "string. When given, the entire archive is downloaded and "
+                             "nothing is extracted unless its digest matches. Only valid "
+                             "for a single target.")
     args = parser.parse_args()
+    if args.sha256 is not None and args.target == "all":
+        parser.error("--sha256 requires --target to be 'surrogates' or 'metrics'.")
 
     if args.target == "surrogates":
-        download_surrogates(args.save_dir)
+        download_surrogates(args.save_dir, tasks=args.tasks, metrics=args.metrics,
+                            workers=args.workers, sha256=args.sha256)
     elif args.target == "metrics":
-        download_metrics(args.save_dir)
+        download_metrics(args.save_dir, tasks=args.tasks, workers=args.workers,
+                         sha256=args.sha256)
     else:
-        download_surrogates(args.save_dir)
-        download_metrics(args.save_dir)
+        download_surrogates(args.save_dir, tasks=args.tasks, metrics=args.metrics,
+                            workers=args.workers)
+        download_metrics(args.save_dir, tasks=args.tasks, workers=args.workers)
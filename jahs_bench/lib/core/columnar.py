@@ -0,0 +1,223 @@
+""" A columnar on-disk format for the tables of performance data. Every column of a
+table is stored as a separate, uncompressed NumPy array, such that tables can be memory
+mapped instead of being unpickled, only the columns that are needed are ever read and
+every process reading the same table shares a single copy of it in the page cache.
+
+A table in this format is a directory containing the following files:
+    manifest.json           The version of the format, the number of rows, the dtype and
+                            (for categorical columns) the categories of every column.
+    index.npy               The index of the original DataFrame ("Sample ID").
+    features/<column>.npy   One file per input feature.
+    labels/<column>.npy     One file per performance metric.
+    sampling_index/<column>.npy
+                            Optional, the IDs of the model config ("model_ID") and the
+                            fidelity ("fidelity_ID") of every row of the raw dataset.
+
+String valued columns, e.g. "Activation", are stored as integer codes into the list of
+categories saved in the manifest and are loaded as pandas Categoricals. """
+
+import json
+import logging
+from pathlib import Path
+from typing import Dict, Optional, Sequence, Tuple, Union, TYPE_CHECKING
+
+import numpy as np
+import pandas as pd
+
+if TYPE_CHECKING:
+    from typing import Literal
+
+    MmapModeType = Optional[Literal["r+", "r", "w+", "c"]]
+
+_log = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+COLUMNAR_DIR_NAME = "columnar"
+TABLE_NAMES = ("train_set.pkl.gz", "valid_set.pkl.gz", "test_set.pkl.gz")
+GROUPS = ("features", "labels")
+OPTIONAL_GROUPS = ("sampling_index",)
+
+
+def _column_file(group: str, name: str) -> str:
+    return f"{group}/{name}.npy"
+
+
+def write_columnar(table: pd.DataFrame, outdir: Union[str, Path]) -> Path:
+    """
+    Save a table of performance data in the columnar format.
+
+    :param table: pandas DataFrame
+        A table with the two-level columns used by the performance datasets, i.e. the
+        first level is one of "features" or "labels", or optionally "sampling_index",
+        and the second level is the name of the respective feature or metric.
+    :param outdir: Path-like
+        The directory that the table is written to. It is created if it does not exist.
+    :return: Path
+        The path to the manifest of the written table.
+    """
+
+    outdir = Path(outdir)
+    present = table.columns.get_level_values(0)
+    groups = GROUPS + tuple(g for g in OPTIONAL_GROUPS if g in present)
+    for group in groups:
+        (outdir / group).mkdir(parents=True, exist_ok=True)
+
+    manifest: dict = {"version": FORMAT_VERSION, "nrows": int(table.shape[0]),
+                      "index": {"file": "index.npy",
+                                "name": table.index.name or "Sample ID"},
+                      "columns": {g: [] for g in groups}}
+    np.save(outdir / "index.npy", np.ascontiguousarray(table.index.to_numpy()))
+
+    for group, name in table.columns:
+        if group not in groups:
+            raise ValueError(f"Unknown column group {group!r} for column {name!r}, must "
+                             f"be one of {GROUPS + OPTIONAL_GROUPS}.")
+
+        values = table[(group, name)]
+        entry = {"name": name, "file": _column_file(group, name), "categories": None}
+        if values.dtype == object or isinstance(values.dtype, pd.CategoricalDtype):
+            values = pd.Categorical(values)
+            if values.isna().any():
+                raise ValueError(f"Column {name!r} contains missing values, which "
+                                 f"cannot be stored as categories.")
+            entry["categories"] = values.categories.tolist()
+            values = values.codes
+        else:
+            values = values.to_numpy()
+
+        entry["dtype"] = values.dtype.str
+        np.save(outdir / entry["file"], np.ascontiguousarray(values))
+        manifest["columns"][group].append(entry)
+
+    manifest_pth = outdir / MANIFEST_NAME
+    with open(manifest_pth, "w") as fp:
+        json.dump(manifest, fp, indent=2)
+
+    _log.info(f"Wrote {table.shape[0]} rows and {table.shape[1]} columns to {outdir}.")
+    return manifest_pth
+
+
+def convert_pickles(table_dir: Union[str, Path],
+                    outdir: Optional[Union[str, Path]] = None,
+                    table_names: Sequence[str] = TABLE_NAMES) -> Path:
+    """
+    Convert the compressed pickles of performance data of one task, as downloaded, into
+    a single table in the columnar format. The pickles are concatenated in the given
+    order, which is the same order in which the tabular benchmark concatenates them.
+
+    :param table_dir: Path-like
+        The directory containing the pickles, e.g. "metric_data/cifar10".
+    :param outdir: optional Path-like
+        The directory that the table is written to. Defaults to "columnar" within
+        `table_dir`, where the tabular benchmark will look for it.
+    :param table_names: sequence of str
+        The names of the pickles to be converted.
+    :return: Path
+        The path to the manifest of the written table.
+    """
+
+    table_dir = Path(table_dir)
+    outdir = table_dir / COLUMNAR_DIR_NAME if outdir is None else Path(outdir)
+    table = pd.concat([pd.read_pickle(table_dir / n) for n in table_names], axis=0)
+    return write_columnar(table, outdir)
+
+
+def read_manifest(path: Union[str, Path]) -> dict:
+    with open(Path(path) / MANIFEST_NAME) as fp:
+        manifest = json.load(fp)
+
+    if manifest.get("version") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported version {manifest.get('version')} of the columnar "
+                         f"table at {path}, expected version {FORMAT_VERSION}.")
+    return manifest
+
+
+def _read_column(path: Path, entry: dict, mmap_mode: "MmapModeType", nrows: int,
+                 rows: slice = slice(None)) -> Union[np.ndarray, pd.Categorical]:
+    values = np.load(path / entry["file"], mmap_mode=mmap_mode, allow_pickle=False)
+    if values.shape != (nrows,) or values.dtype.str != entry["dtype"]:
+        raise ValueError(f"The column {entry['name']!r} at {path} does not match its "
+                         f"manifest, found shape {values.shape} and dtype "
+                         f"{values.dtype.str}.")
+
+    values = values[rows]
+    if entry["categories"] is not None:
+        values = pd.Categorical.from_codes(values, categories=entry["categories"])
+    return values
+
+
+def read_group(path: Union[str, Path], group: str,
+               columns: Optional[Sequence[str]] = None, rows: Optional[slice] = None,
+               mmap_mode: "MmapModeType" = "r", manifest: Optional[dict] = None) \
+        -> pd.DataFrame:
+    """
+    Load the columns of one group of a table in the columnar format, optionally only
+    for a contiguous range of rows. With memory mapping, only the pages of the selected
+    rows are ever read, such that a table larger than the memory can be processed in
+    chunks of rows.
+
+    :param path: Path-like
+        The directory containing the table.
+    :param group: str
+        One of "features" and "labels", or "sampling_index" if the table has it.
+    :param columns: optional sequence of str
+        The names of the columns to be loaded. All columns of the group when None.
+    :param rows: optional slice
+        The rows to be loaded. All rows when None.
+    :param mmap_mode: optional str
+        Passed on to `numpy.load()`. When None, the columns are read into memory.
+    :param manifest: optional dict
+        The manifest of the table, if it has already been read.
+    :return: pandas DataFrame
+        The columns, indexed by the original index of the table.
+    """
+
+    path = Path(path)
+    manifest = read_manifest(path) if manifest is None else manifest
+    nrows = manifest["nrows"]
+    rows = slice(None) if rows is None else rows
+    if group not in manifest["columns"]:
+        raise KeyError(f"The table at {path} has no column group {group!r}, known "
+                       f"groups: {list(manifest['columns'].keys())}.")
+
+    entries: Dict[str, dict] = {e["name"]: e for e in manifest["columns"][group]}
+    if columns is not None:
+        unknown = [c for c in columns if c not in entries]
+        if unknown:
+            raise KeyError(f"Could not find the {group} {unknown} in the table at "
+                           f"{path}, known {group}: {list(entries.keys())}.")
+        entries = {c: entries[c] for c in columns}
+
+    index = np.load(path / manifest["index"]["file"], mmap_mode=mmap_mode)[rows]
+    index = pd.Index(index, name=manifest["index"]["name"], copy=False)
+    data = {c: _read_column(path, e, mmap_mode, nrows, rows) for c, e in entries.items()}
+    return pd.DataFrame(data, index=index, copy=False)
+
+
+def read_columnar(path: Union[str, Path], features: Optional[Sequence[str]] = None,
+                  labels: Optional[Sequence[str]] = None,
+                  mmap_mode: "MmapModeType" = "r") \
+        -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Load a table in the columnar format. Only the requested columns are read and,
+    unless `mmap_mode` is None, numerical columns are memory mapped rather than read
+    into memory, such that the returned DataFrames are read-only views of the files.
+
+    :param path: Path-like
+        The directory containing the table.
+    :param features: optional sequence of str
+        The names of the features to be loaded. All features are loaded when None.
+    :param labels: optional sequence of str
+        The names of the metrics to be loaded. All metrics are loaded when None.
+    :param mmap_mode: optional str
+        Passed on to `numpy.load()`. When None, the columns are read into memory.
+    :return: tuple of two pandas DataFrames
+        The features and the labels, in that order, both indexed by the original index
+        of the table.
+    """
+
+    manifest = read_manifest(path)
+    return tuple(read_group(path, group, selected, mmap_mode=mmap_mode,
+                            manifest=manifest)
+                 for group, selected in zip(GROUPS, (features, labels)))
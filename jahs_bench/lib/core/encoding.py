@@ -0,0 +1,333 @@
+""" A vectorized encoder for configurations of the search space, built once from a
+ConfigSpace object and shared by every query path of the benchmark. It converts batches
+of configurations given in any of the supported formats into one array per parameter,
+maps categorical and ordinal values to integer codes while validating every value
+against its domain, and encodes whole batches into dense matrices, e.g. for model based
+optimizers, which can be decoded back into configurations. """
+
+import logging
+from collections.abc import Mapping
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+import ConfigSpace as CS
+import numpy as np
+import pandas as pd
+
+from jahs_bench.lib.core.configspace import joint_config_space
+
+_log = logging.getLogger(__name__)
+
+ConfigsType = Union[Sequence[Union[dict, CS.Configuration]], Mapping, pd.DataFrame,
+                    np.ndarray]
+
+# Below this many configurations, Python level lookups are faster than vectorized ones
+_SMALL_BATCH = 8
+
+
+class ConfigCodes(NamedTuple):
+    """ The integer codes of the values of the categorical and ordinal parameters of a
+    batch of configurations, i.e. the index of each value in `choices`. """
+    codes: Dict[str, np.ndarray]
+    choices: Dict[str, tuple]
+
+
+class _Param(NamedTuple):
+    name: str
+    kind: str  # One of "categorical", "ordinal", "float" or "integer"
+    choices: Optional[np.ndarray]
+    weights: Optional[np.ndarray]
+    lower: Optional[float]
+    upper: Optional[float]
+    log: bool
+
+
+class ConfigEncoder:
+    """ Encodes batches of configurations of a fixed search space. Categorical parameters
+    are one-hot encoded, ordinal parameters are encoded as the position of their value in
+    their sequence, scaled to [0, 1], and numerical parameters are scaled to [0, 1],
+    after a log-transformation for log-scaled parameters. """
+
+    def __init__(self, config_space: CS.ConfigurationSpace = joint_config_space):
+        self.config_space = config_space
+        self.names: Tuple[str, ...] = tuple(config_space.get_hyperparameter_names())
+
+        self._params: Dict[str, _Param] = {}
+        for hp in config_space.get_hyperparameters():
+            if isinstance(hp, CS.CategoricalHyperparameter):
+                weights = None if hp.probabilities is None else \
+                    np.asarray(hp.probabilities, dtype=np.float64)
+                param = _Param(hp.name, "categorical", np.asarray(hp.choices), weights,
+                               None, None, False)
+            elif isinstance(hp, CS.OrdinalHyperparameter):
+                param = _Param(hp.name, "ordinal", np.asarray(hp.sequence), None, None,
+                               None, False)
+            elif isinstance(hp, CS.Constant):
+                param = _Param(hp.name, "categorical", np.asarray([hp.value]), None,
+                               None, None, False)
+            elif isinstance(hp, (CS.UniformFloatHyperparameter,
+                                 CS.UniformIntegerHyperparameter)):
+                kind = "float" if isinstance(hp, CS.UniformFloatHyperparameter) \
+                    else "integer"
+                param = _Param(hp.name, kind, None, None, hp.lower, hp.upper, hp.log)
+            else:
+                raise NotImplementedError(f"Cannot encode the hyperparameter {hp}.")
+            self._params[hp.name] = param
+
+        self.choices: Dict[str, tuple] = {p.name: tuple(p.choices.tolist())
+                                          for p in self._params.values()
+                                          if p.choices is not None}
+        self._lookups = {name: {c: i for i, c in enumerate(choices)}
+                         for name, choices in self.choices.items()}
+        self._indexes = {name: pd.Index(self._params[name].choices)
+                         for name in self.choices}
+
+        self.feature_names: Tuple[str, ...] = tuple(
+            f"{p.name}={c}" if p.kind == "categorical" else p.name
+            for p in self._params.values()
+            for c in (p.choices.tolist() if p.kind == "categorical"
+                      and p.choices is not None else [None]))
+
+    @property
+    def n_features(self) -> int:
+        return len(self.feature_names)
+
+    def columns(self, configs: ConfigsType) -> Dict[str, np.ndarray]:
+        """
+        Convert a batch of configurations into a dict mapping each parameter of the
+        search space to a 1D array of values. Any other values, such as "epoch", are
+        dropped.
+
+        :param configs: sequence of dicts or Configurations, mapping, pandas DataFrame or
+            NumPy array
+            The configurations. A mapping, such as a dict, must map each parameter to a
+            1D array of values. A NumPy array may either be a structured array with
+            fields named after the parameters or a 2D array whose columns follow the
+            order of `names`, optionally followed by one more column, e.g. the epoch.
+        """
+
+        names = self.names
+        if isinstance(configs, CS.Configuration):
+            configs = [configs]
+
+        if isinstance(configs, pd.DataFrame):
+            available = configs.columns
+        elif isinstance(configs, Mapping):
+            available = configs.keys()
+        elif isinstance(configs, np.ndarray) and configs.dtype.names is not None:
+            available = configs.dtype.names
+        elif isinstance(configs, np.ndarray):
+            if configs.ndim != 2 or configs.shape[1] not in (len(names), len(names) + 1):
+                raise ValueError(
+                    f"A 2D array of configurations must have one column for each of the "
+                    f"parameters {list(names)}, optionally followed by the epoch, but an "
+                    f"array of shape {configs.shape} was given.")
+            return {name: configs[:, i] for i, name in enumerate(names)}
+        else:
+            configs = [c.get_dictionary() if isinstance(c, CS.Configuration) else c
+                       for c in configs]
+            available = set.intersection(*(set(c) for c in configs)) if configs else []
+
+        missing = set(names).difference(available)
+        if missing:
+            raise ValueError(f"The given configurations have missing parameters: "
+                             f"{sorted(missing)}")
+
+        if isinstance(configs, Mapping):
+            return {name: np.asarray(configs[name]).reshape(-1) for name in names}
+        if isinstance(configs, (pd.DataFrame, np.ndarray)):
+            return {name: np.asarray(configs[name]) for name in names}
+        return {name: np.asarray([c[name] for c in configs]) for name in names}
+
+    def canonical(self, config: Mapping, digits: int = 10) -> tuple:
+        """ A hashable key of a single configuration, which is equal for equal
+        configurations. Categorical and ordinal values are replaced by their codes, such
+        that e.g. 1, 1.0 and True are not told apart, and numerical values are rounded to
+        `digits` significant digits. Values outside the domain of their parameter are
+        kept as they are. """
+
+        key = []
+        for name in self.names:
+            try:
+                value = config[name]
+            except KeyError as e:
+                raise ValueError(f"The given configuration has a missing parameter: "
+                                 f"{name}") from e
+
+            lookup = self._lookups.get(name)
+            if lookup is not None:
+                key.append(lookup.get(value, value))
+            else:
+                key.append(float(f"{float(value):.{digits}g}"))
+        return tuple(key)
+
+    def codes(self, configs: ConfigsType, validate: bool = True) -> ConfigCodes:
+        """ The integer codes of the categorical and ordinal parameters of the given
+        configurations. Unless `validate` is False, all values, including those of
+        numerical parameters, are checked to lie within their domains and a ValueError is
+        raised otherwise. Unknown categorical and ordinal values are always an error. """
+
+        columns = self.columns(configs)
+
+        codes = {}
+        for name, lookup in self._lookups.items():
+            values = columns[name]
+            if len(values) <= _SMALL_BATCH:
+                code = [lookup.get(v, -1) for v in values.tolist()]
+                valid = -1 not in code
+                code = np.array(code, dtype=np.intp)
+            else:
+                code = self._indexes[name].get_indexer(values)
+                unmatched = np.flatnonzero(code < 0)
+                if unmatched.size:
+                    # Fall back to Python's notion of equality, e.g. 1 == True
+                    code[unmatched] = [lookup.get(v, -1)
+                                       for v in values[unmatched].tolist()]
+                valid = not np.any(code < 0)
+            if not valid:
+                raise ValueError(f"Found unknown values {np.unique(values[code < 0])} "
+                                 f"of the parameter {name}, must be one of "
+                                 f"{list(self.choices[name])}.")
+            codes[name] = code
+
+        if validate:
+            self._validate_numerical(columns)
+        return ConfigCodes(codes=codes, choices=self.choices)
+
+    def validate(self, configs: ConfigsType):
+        """ Raise a ValueError if any value of the given configurations lies outside the
+        domain of its parameter. """
+
+        self.codes(configs, validate=True)
+
+    def _validate_numerical(self, columns: Dict[str, np.ndarray]):
+        for p in self._params.values():
+            if p.choices is not None:
+                continue
+            values = np.asarray(columns[p.name], dtype=np.float64)
+            if values.size <= _SMALL_BATCH and \
+                    all(p.lower <= v <= p.upper for v in values.tolist()):
+                continue
+            invalid = ~((values >= p.lower) & (values <= p.upper))
+            if np.any(invalid):
+                raise ValueError(f"Found values {np.unique(values[invalid])[:5]} of the "
+                                 f"parameter {p.name} outside of its domain "
+                                 f"[{p.lower}, {p.upper}].")
+
+    def encode(self, configs: ConfigsType, dtype=np.float32) -> np.ndarray:
+        """ Encode the given configurations into a dense matrix of shape
+        [n_configs, n_features], with columns as described by `feature_names`. """
+
+        columns = self.columns(configs)
+        codes = self.codes(columns).codes
+        nrows = len(columns[self.names[0]])
+        encoded = np.zeros((nrows, self.n_features), dtype=dtype)
+        rows = np.arange(nrows)
+
+        col = 0
+        for p in self._params.values():
+            if p.kind == "categorical":
+                assert p.choices is not None
+                encoded[rows, col + codes[p.name]] = 1.
+                col += p.choices.size
+                continue
+
+            if p.kind == "ordinal":
+                assert p.choices is not None
+                encoded[:, col] = codes[p.name] / max(p.choices.size - 1, 1)
+            else:
+                assert p.lower is not None and p.upper is not None
+                values = np.asarray(columns[p.name], dtype=np.float64)
+                lower, upper = p.lower, p.upper
+                if p.log:
+                    values, lower, upper = np.log(values), np.log(lower), np.log(upper)
+                encoded[:, col] = (values - lower) / (upper - lower)
+            col += 1
+
+        return encoded
+
+    def decode(self, encoded: np.ndarray) -> Dict[str, np.ndarray]:
+        """ Invert `encode()`, returning the configurations in the format of
+        `columns()`. One-hot encoded blocks are decoded to their largest entry and
+        ordinal and integer values are rounded, thus any matrix of the right shape, e.g.
+        a perturbed encoding, can be decoded. Continuous values are recovered up to the
+        precision of the encoding's dtype. """
+
+        encoded = np.asarray(encoded)
+        if encoded.ndim != 2 or encoded.shape[1] != self.n_features:
+            raise ValueError(f"Expected an array of shape [n, {self.n_features}], got "
+                             f"an array of shape {encoded.shape}.")
+
+        columns = {}
+        col = 0
+        for p in self._params.values():
+            if p.kind == "categorical":
+                assert p.choices is not None
+                block = encoded[:, col:col + p.choices.size]
+                columns[p.name] = p.choices[np.argmax(block, axis=1)]
+                col += p.choices.size
+                continue
+
+            values = np.clip(encoded[:, col].astype(np.float64), 0., 1.)
+            if p.kind == "ordinal":
+                assert p.choices is not None
+                codes = np.rint(values * (p.choices.size - 1)).astype(int)
+                columns[p.name] = p.choices[codes]
+            else:
+                assert p.lower is not None and p.upper is not None
+                lower, upper = p.lower, p.upper
+                if p.log:
+                    lower, upper = np.log(lower), np.log(upper)
+                values = values * (upper - lower) + lower
+                values = np.exp(values) if p.log else values
+                columns[p.name] = np.rint(values).astype(int) if p.kind == "integer" \
+                    else np.clip(values, p.lower, p.upper)
+            col += 1
+
+        return {name: columns[name] for name in self.names}
+
+    def sample(self, n: int,
+               random_state: Optional[Union[int, np.random.RandomState]] = None) \
+            -> Dict[str, np.ndarray]:
+        """ Draw `n` configurations uniformly at random, honouring the weights of
+        categorical parameters and the log-scaling of numerical parameters, in the format
+        of `columns()`. Every parameter is sampled in a single vectorized call, using only
+        the given random state, thus the random state of the config space is unaffected.
+        """
+
+        if self.config_space.get_conditions() or self.config_space.get_forbiddens():
+            raise NotImplementedError("Cannot sample from a search space with conditions "
+                                      "or forbidden clauses.")
+        if not isinstance(random_state, np.random.RandomState):
+            random_state = np.random.RandomState(random_state)
+
+        columns = {}
+        for p in self._params.values():
+            if p.choices is not None:
+                codes = random_state.choice(p.choices.size, size=n, p=p.weights)
+                columns[p.name] = p.choices[codes]
+                continue
+
+            assert p.lower is not None and p.upper is not None
+            lower, upper = p.lower, p.upper
+            if p.kind == "integer":
+                # Sample from the widened interval such that both bounds are as likely
+                # as any other integer after rounding
+                lower, upper = lower - 0.4999, upper + 0.4999
+            if p.log:
+                lower, upper = np.log(lower), np.log(upper)
+            values = random_state.uniform(lower, upper, size=n)
+            values = np.exp(values) if p.log else values
+            columns[p.name] = np.rint(values).astype(int) if p.kind == "integer" \
+                else np.clip(values, p.lower, p.upper)
+
+        return {name: columns[name] for name in self.names}
+
+    def to_dicts(self, columns: Dict[str, np.ndarray]) -> List[dict]:
+        """ Convert configurations in the format of `columns()` into a list of dicts of
+        Python scalars. """
+
+        values = [columns[name].tolist() for name in self.names]
+        return [dict(zip(self.names, row)) for row in zip(*values)]
+
+
+joint_config_encoder = ConfigEncoder(joint_config_space)
@@ -0,0 +1,153 @@
+""" A memoization cache for the results of benchmark queries, such that optimizers which
+repeatedly query the same (configuration, epochs) pairs, e.g. when re-evaluating
+incumbents or promoting configurations to larger budgets, do not pay for the surrogate
+models' predictions again. Results are kept in a bounded least-recently-used cache in
+memory and, optionally, in an SQLite database on the local disk, which is shared by all
+processes using the same file and persists across runs. """
+
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Hashable, Optional, Sequence, Union
+
+from jahs_bench.lib.core.encoding import ConfigEncoder, joint_config_encoder
+
+_log = logging.getLogger(__name__)
+
+ResultType = Dict[int, Dict[str, float]]
+
+
+class ResultCache:
+    """ Memoizes query results keyed by the canonical form of the configuration (see
+    `ConfigEncoder.canonical()`), the number of epochs, whether the full trajectory was
+    requested and the set of queried metrics, as well as the task and kind of benchmark,
+    such that one cache can be shared by several benchmarks. """
+
+    def __init__(self, max_entries: Optional[int] = 100000,
+                 path: Optional[Union[str, Path]] = None, digits: int = 10,
+                 encoder: ConfigEncoder = joint_config_encoder):
+        """
+        :param max_entries: int or None
+            The maximum number of results kept in memory. The least recently used results
+            are evicted beyond this number. When None, results are never evicted.
+        :param path: optional Path-like
+            The path of an SQLite database in which all results are additionally stored.
+            Results missing from memory are looked up in the database before the
+            benchmark is queried. The database may be shared by any number of processes
+            and is never pruned.
+        :param digits: int
+            The number of significant digits that numerical parameters, such as the
+            learning rate, are rounded to before the configurations are compared.
+        :param encoder: ConfigEncoder
+            Determines the canonical form of the configurations.
+        """
+
+        self.max_entries = max_entries
+        self.path = None if path is None else Path(path)
+        self.digits = digits
+        self.encoder = encoder
+
+        self._entries: "OrderedDict[str, ResultType]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._stats = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+
+        if self.path is not None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(self.path), timeout=60.,
+                                       check_same_thread=False)
+            # Readers and writers in other processes do not block each other
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS results "
+                             "(key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self._db.commit()
+
+    @property
+    def stats(self) -> dict:
+        """ The numbers of hits, of which `disk_hits` were answered by the database, of
+        misses and of evicted results, as well as the hit rate and the number of results
+        in memory. """
+
+        with self._lock:
+            stats: dict = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        total = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / total if total else 0.
+        return stats
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def key(self, config: dict, nepochs: int, full_trajectory: bool,
+            metrics: Sequence[str], namespace: Hashable = None) -> str:
+        """ The key of a query. `namespace` separates the results of different
+        benchmarks, e.g. (task, kind). """
+
+        key = (namespace, self.encoder.canonical(config, self.digits), int(nepochs),
+               bool(full_trajectory), tuple(sorted(metrics)))
+        return hashlib.blake2b(repr(key).encode(), digest_size=16).hexdigest()
+
+    def get(self, key: str) -> Optional[ResultType]:
+        """ Return a copy of the result stored under `key`, or None. """
+
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return _copy(result)
+
+            if self._db is not None:
+                row = self._db.execute("SELECT value FROM results WHERE key = ?",
+                                       (key,)).fetchone()
+                if row is not None:
+                    result = {int(e): m for e, m in json.loads(row[0]).items()}
+                    self._insert(key, result)
+                    self._stats["hits"] += 1
+                    self._stats["disk_hits"] += 1
+                    return _copy(result)
+
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, key: str, result: ResultType):
+        """ Store a copy of `result` under `key`. """
+
+        result = _copy(result)
+        with self._lock:
+            self._insert(key, result)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO results VALUES (?, ?)",
+                                 (key, json.dumps(result)))
+                self._db.commit()
+
+    def _insert(self, key: str, result: ResultType):
+        """ Must be called while holding the lock. """
+
+        self._entries[key] = result
+        self._entries.move_to_end(key)
+        if self.max_entries is not None:
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def clear(self):
+        """ Remove all results from memory. The database, if any, is left as is. """
+
+        with self._lock:
+            self._entries.clear()
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+def _copy(result: ResultType) -> ResultType:
+    return {e: dict(m) for e, m in result.items()}
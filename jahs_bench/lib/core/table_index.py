@@ -0,0 +1,143 @@
+""" A hashed index over the tables of performance data, such that any point or trajectory
+lookup costs O(1) instead of a join over the entire table. """
+
+import logging
+from typing import Dict, Hashable, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+_log = logging.getLogger(__name__)
+
+
+class TableIndex:
+    """ Maps the canonical tuple of hyperparameter values of every configuration present
+    in a table to the slice of rows containing its trajectory. The rows of each
+    trajectory are kept in their original order, thus, when a configuration occurs
+    multiple times in a table, lookups always resolve to its first occurrence, just like
+    a join against the table would. """
+
+    def __init__(self, features: pd.DataFrame, parameters: Sequence[str],
+                 epoch: str = "epoch"):
+        """
+        :param features: pandas DataFrame
+            The table of input features, with one row per (configuration, epoch) pair.
+            The positions of the rows in this DataFrame are what lookups return.
+        :param parameters: sequence of str
+            The names of the columns which, together, uniquely identify a configuration.
+        :param epoch: str
+            The name of the column containing the epochs.
+        """
+
+        self.parameters = tuple(parameters)
+        self.epoch = epoch
+
+        group_ids = features.groupby(list(self.parameters), sort=False, observed=True,
+                                     dropna=False).ngroup().to_numpy()
+
+        # Sort rows by configuration, preserving the table order within configurations
+        self._order = np.argsort(group_ids, kind="stable")
+        self._counts = np.bincount(group_ids)
+        self._starts = np.cumsum(self._counts) - self._counts
+        self._epochs = features[epoch].to_numpy()[self._order]
+
+        first_rows = self._order[self._starts]
+        self._keys = features[list(self.parameters)].take(first_rows)
+        self._groups: Dict[Tuple[Hashable, ...], int] = {
+            key: i for i, key in
+            enumerate(self._keys.itertuples(index=False, name=None))
+        }
+        self._multiindex: Optional[pd.MultiIndex] = None
+
+        _log.debug(f"Indexed {features.shape[0]} rows containing {len(self._groups)} "
+                   f"unique configurations.")
+
+    def __len__(self) -> int:
+        return len(self._groups)
+
+    def key(self, config: Mapping) -> Tuple[Hashable, ...]:
+        """ The canonical key of a configuration. """
+
+        try:
+            return tuple(config[p] for p in self.parameters)
+        except KeyError as e:
+            missing = [p for p in self.parameters if p not in config]
+            raise ValueError(f"The given query has missing parameters: {missing}") from e
+
+    def _group(self, config: Mapping) -> int:
+        try:
+            return self._groups[self.key(config)]
+        except KeyError as e:
+            raise KeyError(f"Could not find any entries for the config {config}.") from e
+
+    def lookup(self, config: Mapping, epoch: int) -> int:
+        """ Return the position of the first row containing the given configuration at
+        the given epoch. Raises a KeyError if no such row exists. """
+
+        group = self._group(config)
+        start, count = self._starts[group], self._counts[group]
+
+        # Trajectories are almost always stored as the contiguous epochs 1, 2, 3, ...
+        pos = start + epoch - 1
+        if 0 < epoch <= count and self._epochs[pos] == epoch:
+            return int(self._order[pos])
+
+        hits = np.flatnonzero(self._epochs[start:start + count] == epoch)
+        if hits.size == 0:
+            raise KeyError(f"Could not find any entries for the config {config} at "
+                           f"{epoch} epochs.")
+        return int(self._order[start + hits[0]])
+
+    def trajectory(self, config: Mapping, nepochs: Optional[int] = None) -> np.ndarray:
+        """ Return the positions of the rows containing the trajectory of the given
+        configuration up to and including `nepochs` epochs, or the entire trajectory when
+        `nepochs` is None. Raises a KeyError if no such rows exist. """
+
+        group = self._group(config)
+        start, count = self._starts[group], self._counts[group]
+        epochs = self._epochs[start:start + count]
+        if nepochs is None:
+            sel = np.flatnonzero(epochs >= 1)
+        else:
+            sel = np.flatnonzero((epochs >= 1) & (epochs <= nepochs))[:nepochs]
+        if sel.size == 0:
+            raise KeyError(f"Could not find any entries for the config {config} at "
+                           f"{nepochs} epochs.")
+        return self._order[start + sel]
+
+    def lookup_batch(self, configs: Mapping[str, Sequence], epochs: Sequence[int]) \
+            -> np.ndarray:
+        """ Vectorized version of `lookup()`. `configs` maps each parameter to an array of
+        values and `epochs` contains the corresponding epochs. Returns an array with the
+        row position of each query or -1 for queries that could not be found. """
+
+        missing = [p for p in self.parameters if p not in configs]
+        if missing:
+            raise ValueError(f"The given query has missing parameters: {missing}")
+
+        if self._multiindex is None:
+            self._multiindex = pd.MultiIndex.from_frame(self._keys)
+
+        query = pd.MultiIndex.from_arrays([np.asarray(configs[p])
+                                           for p in self.parameters])
+        groups = self._multiindex.get_indexer(query)
+        queried = np.asarray(epochs)
+
+        found = groups >= 0
+        starts = np.where(found, self._starts[groups], 0)
+        counts = np.where(found, self._counts[groups], 0)
+        pos = starts + queried - 1
+        fast = found & (queried > 0) & (queried <= counts)
+        fast[fast] = self._epochs[pos[fast]] == queried[fast]
+
+        rows = np.full(groups.shape, -1, dtype=np.int64)
+        rows[fast] = self._order[pos[fast]]
+
+        # Fall back to a scan of the trajectory for non-contiguous epochs
+        for i in np.flatnonzero(found & ~fast):
+            start, count = starts[i], counts[i]
+            hits = np.flatnonzero(self._epochs[start:start + count] == queried[i])
+            if hits.size:
+                rows[i] = self._order[start + hits[0]]
+
+        return rows
@@ -0,0 +1,3 @@
+import logging
+
+_log = logging.getLogger(__name__)
@@ -0,0 +1,108 @@
+"""
+Precompute the surrogate's predictions on a dense grid, see `jahs_bench.surrogate.grid`.
+An interrupted build is resumed when the script is run again with the same arguments.
+Once built, the lookups of random configurations on the grid are verified against the
+surrogate and the time needed for either is reported, e.g.
+
+    python -m jahs_bench.scripts.build_prediction_grid --task cifar10 \
+        --out grids/cifar10 --choices '{"Resolution": [1.0], "N": [5]}'
+"""
+
+import argparse
+import json
+import logging
+import time
+from pathlib import Path
+from typing import Optional, Sequence
+
+import numpy as np
+
+from jahs_bench.api import Benchmark
+from jahs_bench.surrogate.grid import PredictionGrid
+
+_log = logging.getLogger(__name__)
+
+
+def main(task: str, save_dir: Path, out: Path, learning_rates: Sequence[float],
+         weight_decays: Sequence[float], epochs: Sequence[int],
+         choices: Optional[dict] = None, metrics: Optional[Sequence[str]] = None,
+         dtype: str = "float32", chunk_size: int = 1 << 16, nsamples: int = 10000,
+         seed: Optional[int] = None):
+    benchmark = Benchmark(task=task, save_dir=save_dir, download=False, metrics=metrics)
+
+    start = time.perf_counter()
+    grid = PredictionGrid.build(benchmark, out,
+                                {"LearningRate": learning_rates,
+                                 "WeightDecay": weight_decays},
+                                epochs, choices=choices, dtype=dtype,
+                                chunk_size=chunk_size)
+    _log.info(f"Built the prediction grid of shape {grid.data.shape}, taking "
+              f"{grid.nbytes / 2 ** 30:.2f} GiB, in {time.perf_counter() - start:.1f} "
+              f"seconds.")
+
+    rng = np.random.RandomState(seed)
+    configs = grid.configs(rng.randint(0, grid.values(grid.metrics[0],
+                                                      grid.epochs[-1]).size, nsamples))
+    nepochs = rng.choice(grid.epochs, nsamples)
+
+    start = time.perf_counter()
+    looked_up = grid.query(configs, nepochs)
+    grid_time = time.perf_counter() - start
+    start = time.perf_counter()
+    outputs, metric_names = benchmark._query_arrays(configs, nepochs=nepochs)
+    surrogate_time = time.perf_counter() - start
+
+    predicted = outputs[:, [metric_names.index(m) for m in grid.metrics]]
+    error = np.abs(looked_up - predicted.astype(grid.data.dtype)).max()
+    _log.info(f"Looked up {nsamples} random configurations in {grid_time:.3f} seconds, "
+              f"the surrogate took {surrogate_time:.3f} seconds. The largest deviation "
+              f"from the surrogate's predictions is {error:g}.")
+    return grid
+
+
+def parse_cli():
+    parser = argparse.ArgumentParser(
+        "Precompute the surrogate's predictions on a dense grid of the search space."
+    )
+    parser.add_argument("--task", type=str, default="cifar10",
+                        help="The task of the benchmark.")
+    parser.add_argument("--save_dir", type=Path, default=Path("jahs_bench_data"),
+                        help="The directory containing the surrogate models.")
+    parser.add_argument("--out", type=Path,
+                        help="The directory to which the grid is saved.")
+    parser.add_argument("--learning_rates", type=float, nargs="+",
+                        default=[1e-3, 1e-2, 1e-1, 1.],
+                        help="The grid of values of the learning rate.")
+    parser.add_argument("--weight_decays", type=float, nargs="+",
+                        default=[1e-5, 1e-4, 1e-3, 1e-2],
+                        help="The grid of values of the weight decay.")
+    parser.add_argument("--epochs", type=int, nargs="+", default=[1, 12, 50, 200],
+                        help="The epochs at which the predictions are computed.")
+    parser.add_argument("--choices", type=json.loads, default=None,
+                        help="A JSON object restricting the lattice to the given values "
+                             "of some of the discrete parameters, e.g. "
+                             "'{\"Resolution\": [1.0]}'.")
+    parser.add_argument("--metrics", type=str, nargs="+", default=None,
+                        help="Only store these metrics. Defaults to all metrics.")
+    parser.add_argument("--dtype", type=str, default="float32",
+                        choices=["float16", "float32", "float64"],
+                        help="The dtype of the stored predictions.")
+    parser.add_argument("--chunk_size", type=int, default=1 << 16,
+                        help="The number of configurations queried at once.")
+    parser.add_argument("--nsamples", type=int, default=10000,
+                        help="The number of random configurations used to verify the "
+                             "grid.")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Seed for sampling random configurations.")
+
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_cli()
+    logging.basicConfig(level=logging.INFO,
+                        format="[%(asctime)s] %(name)s %(levelname)s: %(message)s",
+                        datefmt="%m/%d %H:%M:%S")
+    _log.setLevel(logging.INFO)
+    main(**vars(args))
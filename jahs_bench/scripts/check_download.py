@@ -0,0 +1,140 @@
+"""
+Check that downloading an archive in concurrent segments streams exactly the bytes that
+end up on the disk. A random file is served by a local HTTP server that supports range
+requests and sends its responses in small, delayed pieces, such that the segments arrive
+interleaved. For every run, the bytes returned by the sequential reader of the download
+and their SHA-256 digest are compared with the downloaded file and with the original.
+Exits with an error if any run differs.
+"""
+
+import argparse
+import hashlib
+import logging
+import re
+import tempfile
+import threading
+import time
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import numpy as np
+
+from jahs_bench.download import _Download
+
+_log = logging.getLogger(__name__)
+
+
+class _RangeHandler(BaseHTTPRequestHandler):
+    """ Serves a single file, honouring range requests, in delayed pieces. """
+
+    def __init__(self, *args, data: bytes, piece: int, delay: float, **kwargs):
+        self.data = data
+        self.piece = piece
+        self.delay = delay
+        super().__init__(*args, **kwargs)
+
+    def do_GET(self):
+        match = re.fullmatch(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        start, end = 0, len(self.data)
+        if match:
+            start = int(match.group(1))
+            end = int(match.group(2)) + 1 if match.group(2) else end
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end - 1}/{len(self.data)}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(end - start))
+        self.end_headers()
+        for offset in range(start, end, self.piece):
+            self.wfile.write(self.data[offset:min(offset + self.piece, end)])
+            self.wfile.flush()
+            time.sleep(self.delay)
+
+    def log_message(self, *args):
+        pass
+
+
+def check(url: str, data: bytes, path: Path, workers: int, piece: int,
+          read_size: int) -> bool:
+    """ Download `url` once and compare the streamed bytes with the file and `data`. """
+
+    download = _Download(url, path, workers=workers, chunk_size=piece,
+                         report_interval=np.inf)
+    download.start()
+    chunks = []
+    try:
+        while True:
+            chunk = download.read(read_size)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        digest = download.finish()
+    finally:
+        download.close()
+
+    streamed = b"".join(chunks)
+    on_disk = path.read_bytes()
+    expected = hashlib.sha256(data).hexdigest()
+    return streamed == on_disk == data and digest == expected
+
+
+def main(runs: int = 12, workers: int = 4, size: int = 1 << 20, piece: int = 1000,
+         delay: float = 0.001, read_size: int = 512, seed: int = 0):
+    data = np.random.RandomState(seed).bytes(size)
+    handler = partial(_RangeHandler, data=data, piece=piece, delay=delay)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/archive.tar"
+
+    failures = 0
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for run in range(runs):
+                path = Path(tmpdir) / f"archive_{run}.tar.part"
+                ok = check(url, data, path, workers, piece, read_size)
+                failures += not ok
+                _log.info(f"Run {run}: {'identical' if ok else 'CORRUPTED'}.")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    if failures:
+        raise RuntimeError(f"The streamed bytes differed from the downloaded file in "
+                           f"{failures} of {runs} runs.")
+    _log.info(f"The streamed bytes matched the downloaded file in all {runs} runs.")
+
+
+def parse_cli():
+    parser = argparse.ArgumentParser(
+        "Check that the bytes streamed by a segmented download match the downloaded "
+        "file."
+    )
+    parser.add_argument("--runs", type=int, default=12,
+                        help="The number of downloads.")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="The number of concurrent segments of every download.")
+    parser.add_argument("--size", type=int, default=1 << 20,
+                        help="The size of the served file in bytes.")
+    parser.add_argument("--piece", type=int, default=1000,
+                        help="The number of bytes the server sends at once.")
+    parser.add_argument("--delay", type=float, default=0.001,
+                        help="The delay in seconds between the pieces sent by the "
+                             "server.")
+    parser.add_argument("--read_size", type=int, default=512,
+                        help="The number of bytes requested from the download at once, "
+                             "by default one block of a tar archive.")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Seed for the contents of the served file.")
+
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_cli()
+    logging.basicConfig(level=logging.INFO,
+                        format="[%(asctime)s] %(name)s %(levelname)s: %(message)s",
+                        datefmt="%m/%d %H:%M:%S")
+    _log.setLevel(logging.INFO)
+    main(**vars(args))
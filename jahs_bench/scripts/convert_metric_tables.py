@@ -0,0 +1,52 @@
+"""
+Convert the downloaded performance datasets from compressed pickles into the columnar
+format, which the tabular benchmark memory maps instead of unpickling. The converted
+tables are placed in "metric_data/<task>/columnar", where they are found by
+`jahs_bench.Benchmark(kind="table")`.
+"""
+
+import argparse
+import logging
+from pathlib import Path
+
+from jahs_bench.api import BenchmarkTasks
+from jahs_bench.lib.core import columnar
+
+_log = logging.getLogger(__name__)
+
+
+def main(save_dir: Path, tasks=None):
+    tasks = [t.value for t in BenchmarkTasks] if tasks is None else tasks
+    for task in tasks:
+        table_dir = save_dir / "metric_data" / task
+        if not table_dir.exists():
+            _log.warning(f"No performance data found for the task {task} at "
+                         f"{table_dir}, skipping.")
+            continue
+
+        _log.info(f"Converting the performance data of the task {task}.")
+        manifest = columnar.convert_pickles(table_dir)
+        _log.info(f"Saved the columnar table to {manifest.parent}.")
+
+
+def parse_cli():
+    parser = argparse.ArgumentParser(
+        "Convert the performance datasets into the columnar format."
+    )
+    parser.add_argument("--save_dir", type=Path, default=Path("jahs_bench_data"),
+                        help="The directory containing the downloaded 'metric_data'.")
+    parser.add_argument("--tasks", type=str, nargs="+", default=None,
+                        choices=[t.value for t in BenchmarkTasks],
+                        help="The tasks to be converted. Defaults to all tasks.")
+
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_cli()
+    logging.basicConfig(level=logging.INFO,
+                        format="[%(asctime)s] %(name)s %(levelname)s: %(message)s",
+                        datefmt="%m/%d %H:%M:%S")
+    _log.setLevel(logging.INFO)
+    main(**vars(args))
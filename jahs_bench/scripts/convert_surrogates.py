@@ -0,0 +1,85 @@
+"""
+Export already assembled surrogate models, e.g. the downloaded ones, in the native format
+of XGBoost along with a JSON manifest, which the public API loads instead of the pickled
+sklearn pipelines whenever it is present. Each model is only exported after its
+predictions have been verified to be bit-for-bit identical to those of the original
+pipeline, otherwise an error is raised. The time needed to load either version of the
+model is reported.
+"""
+
+import argparse
+import logging
+import time
+from pathlib import Path
+from typing import Optional, Sequence
+
+import pandas as pd
+
+from jahs_bench.scripts.profile_surrogate_latency import random_features
+from jahs_bench.surrogate.compiled import CompiledSurrogate
+from jahs_bench.surrogate.model import XGBSurrogate
+
+_log = logging.getLogger(__name__)
+
+
+def main(model_dir: Path, outputs: Optional[Sequence[str]] = None, nsamples: int = 1000,
+         seed: Optional[int] = None):
+    assert model_dir.exists() and model_dir.is_dir()
+
+    outputs = outputs or sorted(p.name for p in model_dir.iterdir() if p.is_dir())
+    features = random_features(nsamples, seed)
+
+    results = {}
+    for output in outputs:
+        pth = model_dir / output
+        start = time.perf_counter()
+        surrogate = XGBSurrogate.load(pth)
+        pickle_time = time.perf_counter() - start
+
+        # Raises an error and saves nothing unless the predictions are identical
+        surrogate.save_compiled(pth, features)
+
+        start = time.perf_counter()
+        CompiledSurrogate.load(pth)
+        native_time = time.perf_counter() - start
+
+        results[output] = {"pickle_load_s": pickle_time, "native_load_s": native_time}
+        _log.info(f"Exported the surrogate for output {output} to {pth}.")
+
+    results = pd.DataFrame.from_dict(results, orient="index")
+    results.loc[:, "speedup"] = results.pickle_load_s / results.native_load_s
+    _log.info(f"Load times of the pickled and the exported models:\n"
+              f"{results.to_string()}")
+    return results
+
+
+def parse_cli():
+    parser = argparse.ArgumentParser(
+        "Export assembled surrogate models in the native format of XGBoost."
+    )
+    parser.add_argument("--model_dir", type=Path,
+                        help="The directory containing one sub-directory with a trained "
+                             "surrogate per metric, e.g. "
+                             "'jahs_bench_data/assembled_surrogates/cifar10'.")
+    parser.add_argument("--nsamples", type=int, default=1000,
+                        help="The number of random configurations used to verify that "
+                             "the exported models generate identical predictions.")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Seed for sampling random configurations.")
+    parser.add_argument("--outputs", type=str, default=None,
+                        nargs=argparse.REMAINDER,
+                        help="Strings, separated by spaces, that indicate which of the "
+                             "metrics' models should be exported. If not given, all "
+                             "models present in 'model_dir' are exported.")
+
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_cli()
+    logging.basicConfig(level=logging.INFO,
+                        format="[%(asctime)s] %(name)s %(levelname)s: %(message)s",
+                        datefmt="%m/%d %H:%M:%S")
+    _log.setLevel(logging.INFO)
+    main(**vars(args))
@@ -0,0 +1,102 @@
+"""
+Measure the cold start of a benchmark, i.e. the time from starting a fresh process to
+the answer of its first query, broken down into importing the package, downloading and
+extracting the required data, deserializing it, building the indices and answering the
+first query. Every measurement happens in a fresh process. When the data has not been
+downloaded yet, only the first repeat downloads it, thus use a fresh `save_dir` and a
+single repeat to measure the cold start in a fresh container.
+"""
+
+import argparse
+import json
+import logging
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Optional, Sequence
+
+import pandas as pd
+
+_log = logging.getLogger(__name__)
+
+# Run with "python -c", since any module of the package, including this script, imports
+# the package itself
+_CHILD = """
+import json, sys, time
+start = time.perf_counter()
+from jahs_bench.api import Benchmark
+result = {"import": time.perf_counter() - start}
+task, kind, save_dir, metrics = json.loads(sys.argv[1])
+benchmark = Benchmark(task=task, kind=kind, download=True, save_dir=save_dir,
+                      metrics=metrics)
+result.update(benchmark.startup_times)
+config = benchmark.sample_config()
+start = time.perf_counter()
+benchmark(config, nepochs=200)
+result["first_query"] = time.perf_counter() - start
+print(json.dumps(result))
+"""
+
+
+def measure(task: str, kind: str, save_dir: Path,
+            metrics: Optional[Sequence[str]] = None) -> dict:
+    """ Start the benchmark in a fresh process and return its measurements. The time
+    not accounted for by any phase, e.g. starting the interpreter, is reported as
+    "other". """
+
+    args = json.dumps([task, kind, str(save_dir), metrics])
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-c", _CHILD, args], check=True,
+                          stdout=subprocess.PIPE, universal_newlines=True)
+    total = time.perf_counter() - start
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result["other"] = total - sum(result.values())
+    result["total"] = total
+    return result
+
+
+def main(task: str, kind: str, save_dir: Path, repeats: int = 3,
+         metrics: Optional[Sequence[str]] = None):
+    results = []
+    for r in range(repeats):
+        res = measure(task, kind, save_dir, metrics)
+        results.append(res)
+        _log.info(f"Started the benchmark and answered the first query in "
+                  f"{res['total']:.3f} seconds.")
+
+    results = pd.DataFrame(results)
+    _log.info(f"Time spent in each phase of the cold start, in seconds, over {repeats} "
+              f"starts:\n{results.to_string()}")
+    return results
+
+
+def parse_cli():
+    parser = argparse.ArgumentParser(
+        "Profile the time from starting a fresh process to answering the first query, "
+        "broken down into its phases."
+    )
+    parser.add_argument("--task", type=str, default="cifar10",
+                        help="The task of the benchmark.")
+    parser.add_argument("--kind", type=str, default="surrogate",
+                        choices=["surrogate", "table"],
+                        help="The kind of benchmark.")
+    parser.add_argument("--save_dir", type=Path, default=Path("jahs_bench_data"),
+                        help="The directory containing the data of the benchmark, to "
+                             "which it is downloaded if necessary.")
+    parser.add_argument("--repeats", type=int, default=3,
+                        help="The number of times the benchmark is started.")
+    parser.add_argument("--metrics", type=str, nargs="+", default=None,
+                        help="Only load these metrics. Defaults to all metrics.")
+
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_cli()
+    logging.basicConfig(level=logging.INFO,
+                        format="[%(asctime)s] %(name)s %(levelname)s: %(message)s",
+                        datefmt="%m/%d %H:%M:%S")
+    _log.setLevel(logging.INFO)
+    main(**vars(args))
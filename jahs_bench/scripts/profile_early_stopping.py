@@ -0,0 +1,122 @@
+"""
+Measure what early stopping saves when training the surrogate models. For each metric,
+one surrogate is trained with the fixed number of 500 boosting rounds and one with early
+stopping on a group-aware split of the training data, using the default hyperparameters
+and pipeline configuration. The number of trees, the training time, the Kendall tau on
+the validation set and the latency of the compiled models, for single queries as well as
+for the entire validation set, are reported, along with the relative savings.
+"""
+
+import argparse
+import logging
+import time
+from pathlib import Path
+from typing import Optional, Sequence
+
+import numpy as np
+import pandas as pd
+import scipy.stats
+
+from jahs_bench.surrogate import config as cfg
+from jahs_bench.surrogate.model import XGBSurrogate
+from jahs_bench.scripts.profile_surrogate_latency import time_calls
+
+_log = logging.getLogger(__name__)
+
+
+def profile(train_data: pd.DataFrame, valid_data: pd.DataFrame, output: str,
+            early_stopping_rounds: Optional[int], valid_fraction: float, repeats: int,
+            n_jobs: int, seed: Optional[int] = None) -> dict:
+    """ Train a single surrogate for `output` and measure it. """
+
+    groups = train_data["groups"] if "groups" in train_data else None
+    surrogate = XGBSurrogate(hyperparams=None, n_jobs=n_jobs)
+    start = time.perf_counter()
+    surrogate.fit(train_data["features"], train_data["labels"].loc[:, [output]],
+                  random_state=np.random.RandomState(seed),
+                  pipeline_config=cfg.default_pipeline_config.clone(),
+                  early_stopping_rounds=early_stopping_rounds, groups=groups,
+                  valid_fraction=valid_fraction)
+    train_s = time.perf_counter() - start
+
+    compiled = surrogate.compile()
+    compiled.set_nthread(1)
+    features = valid_data["features"].loc[:, list(compiled.feature_headers)].to_numpy()
+    ypred = compiled.predict(features)[:, 0]
+    ntrees = surrogate.estimators_per_output if surrogate.best_iteration_ is None else \
+        surrogate.best_iteration_ + 1
+    return {
+        "trees": ntrees,
+        "train_s": train_s,
+        "valid_kendall_tau": scipy.stats.kendalltau(
+            valid_data["labels"].loc[:, output], ypred).correlation,
+        "single_us": np.median(time_calls(lambda: compiled.predict(features[:1]),
+                                          repeats)),
+        "batch_ms": np.min(time_calls(lambda: compiled.predict(features),
+                                      max(1, repeats // 100))) / 1e3,
+    }
+
+
+def main(datadir: Path, outputs: Optional[Sequence[str]] = None,
+         early_stopping_rounds: int = 50, valid_fraction: float = 0.1,
+         repeats: int = 1000, n_jobs: int = 1, seed: Optional[int] = None):
+    train_data: pd.DataFrame = pd.read_pickle(datadir / "train_set.pkl.gz")
+    valid_data: pd.DataFrame = pd.read_pickle(datadir / "valid_set.pkl.gz")
+    outputs = outputs or train_data["labels"].columns.tolist()
+
+    results = {}
+    for output in outputs:
+        for label, rounds in [("fixed", None), ("early", early_stopping_rounds)]:
+            _log.info(f"Training the surrogate for {output} with {label} boosting "
+                      f"rounds.")
+            results[(output, label)] = profile(
+                train_data, valid_data, output, early_stopping_rounds=rounds,
+                valid_fraction=valid_fraction, repeats=repeats, n_jobs=n_jobs,
+                seed=seed)
+
+    results = pd.DataFrame.from_dict(results, orient="index").unstack(level=1)
+    for column in ["train_s", "single_us", "batch_ms"]:
+        results.loc[:, (column, "saved")] = \
+            1 - results.loc[:, (column, "early")] / results.loc[:, (column, "fixed")]
+    results = results.sort_index(axis=1, level=0, sort_remaining=False)
+    with pd.option_context("display.float_format", "{:.4g}".format):
+        _log.info(f"Savings due to early stopping by metric:\n{results.to_string()}")
+    return results
+
+
+def parse_cli():
+    parser = argparse.ArgumentParser(
+        "Measure the training time and inference latency saved by training the "
+        "surrogate models with early stopping."
+    )
+    parser.add_argument("--datadir", type=Path,
+                        help="Path to the directory where the training and validation "
+                             "data splits of a task are stored.")
+    parser.add_argument("--outputs", type=str, nargs="+", default=None,
+                        help="The metrics to train surrogates for. Defaults to all "
+                             "metrics in the training data.")
+    parser.add_argument("--early_stopping_rounds", type=int, default=50,
+                        help="The number of rounds without improvement after which "
+                             "boosting is stopped.")
+    parser.add_argument("--valid_fraction", type=float, default=0.1,
+                        help="The fraction of the training data held out for early "
+                             "stopping.")
+    parser.add_argument("--repeats", type=int, default=1000,
+                        help="The number of single queries timed per model. The "
+                             "median latency is reported.")
+    parser.add_argument("--n_jobs", type=int, default=1,
+                        help="The number of threads used by XGBoost for training.")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Seed for the training procedure.")
+
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_cli()
+    logging.basicConfig(level=logging.INFO,
+                        format="[%(asctime)s] %(name)s %(levelname)s: %(message)s",
+                        datefmt="%m/%d %H:%M:%S")
+    _log.setLevel(logging.INFO)
+    main(**vars(args))
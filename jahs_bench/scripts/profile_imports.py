@@ -0,0 +1,130 @@
+"""
+Guard the import time of the package against regressions. Each module is imported in a
+fresh interpreter with "python -X importtime", the reported times are parsed and the
+slowest imports are listed. The check fails, with a non-zero exit code, if a module
+imports any of the heavy dependencies it must not import, e.g. xgboost or torch for the
+API, or if its import takes longer than the given budget.
+
+    python -m jahs_bench.scripts.profile_imports --budget 3
+"""
+
+import argparse
+import logging
+import subprocess
+import sys
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+import pandas as pd
+
+_log = logging.getLogger(__name__)
+
+# Only needed by the surrogates, the live training or the surrogates' training pipeline
+_OPTIONAL = ("sklearn", "xgboost", "yacs", "torch", "torchvision", "tensorboard")
+_HEAVY = ("numpy", "pandas", "scipy", "ConfigSpace") + _OPTIONAL
+
+# The top-level packages that each module must not import
+FORBIDDEN: Dict[str, Sequence[str]] = {
+    "jahs_bench": _HEAVY,
+    "jahs_bench.download": _HEAVY,
+    "jahs_bench.api": _OPTIONAL,
+}
+
+
+class ImportTime(NamedTuple):
+    module: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+
+def parse_importtime(stderr: str) -> List[ImportTime]:
+    """ Parse the output of "python -X importtime", one entry per imported module. """
+
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue  # The header
+        name = fields[2].rstrip()
+        module = name.lstrip()
+        entries.append(ImportTime(module, int(fields[0]), int(fields[1]),
+                                  (len(name) - len(module) - 1) // 2))
+    return entries
+
+
+def measure(module: str) -> List[ImportTime]:
+    """ Import `module` in a fresh interpreter and return the import times of all
+    modules imported by it, excluding those imported at the interpreter's startup. """
+
+    def run(statement: str) -> List[ImportTime]:
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", statement],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                              universal_newlines=True, check=True)
+        return parse_importtime(proc.stderr)
+
+    startup = {e.module for e in run("pass")}
+    return [e for e in run(f"import {module}") if e.module not in startup]
+
+
+def check(module: str, forbidden: Sequence[str] = (), budget: Optional[float] = None,
+          repeats: int = 3, top: int = 10) -> bool:
+    """ Import `module` `repeats` times and check the fastest import against the list of
+    forbidden packages and the budget in seconds. Returns whether all checks passed. """
+
+    runs = [measure(module) for _ in range(repeats)]
+    totals = [sum(e.cumulative_us for e in run if e.depth == 0) / 1e6 for run in runs]
+    best = min(range(repeats), key=totals.__getitem__)
+    entries, total = runs[best], totals[best]
+
+    slowest = pd.DataFrame(entries).sort_values("cumulative_us", ascending=False)
+    _log.info(f"Importing {module} took {total:.3f} seconds. The slowest imports "
+              f"were:\n{slowest.head(top).to_string(index=False)}")
+
+    passed = True
+    imported = sorted({e.module.split(".")[0] for e in entries}.intersection(forbidden))
+    if imported:
+        _log.error(f"Importing {module} imported {imported}, which it must not import.")
+        passed = False
+    if budget is not None and total > budget:
+        _log.error(f"Importing {module} took {total:.3f} seconds, exceeding the budget "
+                   f"of {budget:.3f} seconds.")
+        passed = False
+    return passed
+
+
+def main(modules: Optional[Sequence[str]] = None, budget: Optional[float] = None,
+         repeats: int = 3, top: int = 10) -> bool:
+    modules = list(FORBIDDEN) if modules is None else modules
+    results = [check(m, FORBIDDEN.get(m, ()), budget, repeats, top) for m in modules]
+    return all(results)
+
+
+def parse_cli():
+    parser = argparse.ArgumentParser(
+        "Measure the time needed to import modules of the package and check that they do "
+        "not import heavy, optional dependencies."
+    )
+    parser.add_argument("--modules", type=str, nargs="+", default=None,
+                        help=f"The modules to import. Defaults to {list(FORBIDDEN)}.")
+    parser.add_argument("--budget", type=float, default=None,
+                        help="The maximum time, in seconds, that importing each module "
+                             "may take.")
+    parser.add_argument("--repeats", type=int, default=3,
+                        help="The number of times each module is imported. The fastest "
+                             "import is checked.")
+    parser.add_argument("--top", type=int, default=10,
+                        help="The number of slowest imports that are listed.")
+
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_cli()
+    logging.basicConfig(level=logging.INFO,
+                        format="[%(asctime)s] %(name)s %(levelname)s: %(message)s",
+                        datefmt="%m/%d %H:%M:%S")
+    _log.setLevel(logging.INFO)
+    sys.exit(0 if main(**vars(args)) else 1)
@@ -0,0 +1,145 @@
+"""
+Load test the local query server. A server is started in its own process and, for each
+given number of concurrent clients, that many client processes send single queries in a
+closed loop, i.e. each client sends its next query as soon as the previous one was
+answered. The aggregate throughput and the median and 99th percentile latencies over all
+clients are reported, along with the latency of querying a benchmark that was loaded
+into the querying process itself, for reference.
+"""
+
+import argparse
+import logging
+import multiprocessing
+import tempfile
+import time
+from pathlib import Path
+from typing import Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from jahs_bench.api import Benchmark
+from jahs_bench.lib.core.configspace import joint_config_space
+from jahs_bench.serve import BenchmarkClient, BenchmarkServer
+
+_log = logging.getLogger(__name__)
+
+
+def random_configs(nsamples: int, seed: Optional[int] = None) -> list:
+    random_state = np.random.RandomState(seed)
+    joint_config_space.seed(seed)
+    configs = joint_config_space.sample_configuration(nsamples)
+    configs = [configs] if nsamples == 1 else configs
+    return [{**c.get_dictionary(), "epoch": int(random_state.randint(1, 201))}
+            for c in configs]
+
+
+def _serve(address: str, task: str, save_dir: Path, max_batch: int, max_delay: float):
+    server = BenchmarkServer(address, [task], max_batch=max_batch, max_delay=max_delay,
+                             save_dir=save_dir, download=False)
+    server.serve_forever()
+
+
+def _run_client(address: str, task: str, nqueries: int, seed: int,
+                queue: multiprocessing.Queue):
+    configs = random_configs(nqueries, seed)
+    with BenchmarkClient(address, task) as client:
+        client(configs[0], nepochs=configs[0]["epoch"])  # Warm up
+        latencies = np.empty(nqueries)
+        start = time.time()
+        for i, config in enumerate(configs):
+            t = time.perf_counter()
+            client(config, nepochs=config["epoch"])
+            latencies[i] = time.perf_counter() - t
+        end = time.time()
+    queue.put((start, end, latencies))
+
+
+def load_test(address: str, task: str, nclients: int, nqueries: int,
+              seed: Optional[int] = None) -> dict:
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    seeds = np.random.RandomState(seed).randint(0, 2 ** 31, size=nclients)
+    clients = [ctx.Process(target=_run_client,
+                           args=(address, task, nqueries, int(s), queue))
+               for s in seeds]
+    for c in clients:
+        c.start()
+    results = [queue.get() for _ in clients]
+    for c in clients:
+        c.join()
+
+    starts, ends, latencies = zip(*results)
+    latencies = np.concatenate(latencies) * 1e3
+    return {"throughput_qps": latencies.size / (max(ends) - min(starts)),
+            "p50_ms": np.percentile(latencies, 50),
+            "p99_ms": np.percentile(latencies, 99)}
+
+
+def main(save_dir: Path, task: str = "cifar10", clients: Sequence[int] = (1, 2, 4, 8),
+         nqueries: int = 500, max_batch: int = 256, max_delay_ms: float = 1.,
+         seed: Optional[int] = None):
+    configs = random_configs(nqueries, seed)
+    benchmark = Benchmark(task=task, save_dir=save_dir, download=False)
+    latencies = []
+    for config in configs:
+        t = time.perf_counter()
+        benchmark(config, nepochs=config["epoch"])
+        latencies.append(time.perf_counter() - t)
+    latencies = np.asarray(latencies) * 1e3
+    results = {"in-process": {
+        "throughput_qps": latencies.size / latencies.sum() * 1e3,
+        "p50_ms": np.percentile(latencies, 50), "p99_ms": np.percentile(latencies, 99)}}
+    del benchmark
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        address = str(Path(tmpdir) / "jahs_bench.sock")
+        ctx = multiprocessing.get_context("spawn")
+        server = ctx.Process(target=_serve, daemon=True, args=(
+            address, task, save_dir, max_batch, max_delay_ms / 1000))
+        server.start()
+        try:
+            for n in clients:
+                _log.info(f"Running {n} concurrent clients.")
+                results[f"{n} clients"] = load_test(address, task, n, nqueries, seed)
+        finally:
+            server.terminate()
+            server.join()
+
+    results = pd.DataFrame.from_dict(results, orient="index")
+    _log.info(f"Throughput and latency of single queries:\n{results.to_string()}")
+    return results
+
+
+def parse_cli():
+    parser = argparse.ArgumentParser(
+        "Measure the throughput and latency of the local query server under a varying "
+        "number of concurrent clients."
+    )
+    parser.add_argument("--save_dir", type=Path, default=Path("jahs_bench_data"),
+                        help="The directory containing 'assembled_surrogates'.")
+    parser.add_argument("--task", type=str, default="cifar10",
+                        help="The task to be queried.")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 2, 4, 8],
+                        help="The numbers of concurrent clients to be tested.")
+    parser.add_argument("--nqueries", type=int, default=500,
+                        help="The number of queries sent by each client.")
+    parser.add_argument("--max_batch", type=int, default=256,
+                        help="The maximum number of queries answered at once.")
+    parser.add_argument("--max_delay_ms", type=float, default=1.,
+                        help="The maximum time, in milliseconds, that a query waits for "
+                             "other queries to be batched with.")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Seed for sampling the queried configurations.")
+
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_cli()
+    logging.basicConfig(level=logging.INFO,
+                        format="[%(asctime)s] %(name)s %(levelname)s: %(message)s",
+                        datefmt="%m/%d %H:%M:%S")
+    _log.setLevel(logging.INFO)
+    main(**vars(args))
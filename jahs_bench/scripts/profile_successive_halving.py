@@ -0,0 +1,112 @@
+"""
+Compare the CPU time needed to tune the surrogate models by successive halving against
+that of the full-budget random search of `parallel_hpo.py`, which evaluates every
+configuration like `pipeline.train_surrogate()` does. Both searches draw the same
+configurations. For each metric, the best validation Kendall tau of either search is
+reported along with the CPU-hours spent, as well as the CPU-hours the full-budget search
+needed to first reach a Kendall tau at least as high as the best one found by successive
+halving.
+"""
+
+import argparse
+import logging
+from pathlib import Path
+from typing import Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from jahs_bench.surrogate import utils as surrogate_utils
+from jahs_bench.surrogate_training import parallel_hpo
+
+_log = logging.getLogger(__name__)
+
+
+def cpu_hours_to_reach(trials: pd.DataFrame, loss: float, cpus_per_trial: int) -> float:
+    """ The CPU-hours spent by sequentially running the given trials, in the order of
+    their index, until the first trial with at most the given loss finishes. NaN if no
+    trial reaches the loss. """
+
+    trials = trials.sort_values("trial")
+    cumulative = trials.duration.cumsum() * cpus_per_trial / 3600
+    reached = trials.loss.to_numpy() <= loss + 1e-12
+    return float(cumulative.iloc[np.argmax(reached)]) if reached.any() else np.nan
+
+
+def main(datadir: Path, working_directory: Path, metrics: Optional[Sequence[str]] = None,
+         trials_per_metric: int = 27, min_budget: float = 1 / 9, eta: int = 3,
+         fidelity: str = "rows", cpus_per_trial: int = 1, n_cpus: Optional[int] = None,
+         seed: Optional[int] = None):
+    kwargs: dict = dict(metrics=metrics, trials_per_metric=trials_per_metric,
+                        cpus_per_trial=cpus_per_trial, n_cpus=n_cpus, seed=seed)
+    _log.info("Running the full-budget search.")
+    full = parallel_hpo.main(datadir, working_directory / "full", **kwargs)
+    _log.info("Running successive halving.")
+    halving = parallel_hpo.main(datadir, working_directory / "successive_halving",
+                                min_budget=min_budget, eta=eta, fidelity=fidelity,
+                                **kwargs)
+
+    results = {}
+    for metric, trials in full.groupby("metric"):
+        runs = halving.loc[halving.metric == metric]
+        best_loss = runs.loc[np.isclose(runs.budget, 1.)].loss.min()
+        results[metric] = {
+            "full_kendall_tau": -trials.loss.min(),
+            "full_cpu_hours": trials.duration.sum() * cpus_per_trial / 3600,
+            "full_cpu_hours_to_match": cpu_hours_to_reach(trials, best_loss,
+                                                          cpus_per_trial),
+            "halving_kendall_tau": -best_loss,
+            "halving_cpu_hours": runs.duration.sum() * cpus_per_trial / 3600,
+        }
+
+    results = pd.DataFrame.from_dict(results, orient="index")
+    results.loc["total"] = results.sum(numeric_only=True)
+    results.loc["total", ["full_kendall_tau", "halving_kendall_tau"]] = np.nan
+    results.loc[:, "speedup"] = \
+        results.full_cpu_hours_to_match / results.halving_cpu_hours
+    with pd.option_context("display.float_format", "{:.4g}".format):
+        _log.info(f"CPU-hours by metric:\n{results.to_string()}")
+    return results
+
+
+def parse_cli():
+    parser = argparse.ArgumentParser(
+        "Compare the CPU time of tuning the surrogate models by successive halving to "
+        "that of the full-budget random search."
+    )
+    parser.add_argument("--datadir", type=Path,
+                        help="Path to the directory where the training and validation "
+                             "data splits of a task are stored.")
+    parser.add_argument("--working_directory", type=Path,
+                        help="The directory in which both searches record their trials, "
+                             "in the sub-directories 'full' and 'successive_halving'.")
+    parser.add_argument("--metrics", type=str, nargs="+", default=None,
+                        help="The metrics to tune surrogates for. Defaults to all "
+                             "metrics present in the data.")
+    parser.add_argument("--trials_per_metric", type=int, default=27,
+                        help="The number of configurations drawn for each metric.")
+    parser.add_argument("--min_budget", type=float, default=1 / 9,
+                        help="The smallest budget of successive halving.")
+    parser.add_argument("--eta", type=int, default=3,
+                        help="The reduction factor of successive halving.")
+    parser.add_argument("--fidelity", type=str, default="rows",
+                        choices=surrogate_utils.FIDELITIES,
+                        help="What the budget of successive halving scales.")
+    parser.add_argument("--cpus_per_trial", type=int, default=1,
+                        help="The number of threads used by each trial.")
+    parser.add_argument("--n_cpus", type=int, default=None,
+                        help="The total number of CPUs to use. Defaults to all CPUs.")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Seed for sampling the hyperparameters.")
+
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_cli()
+    logging.basicConfig(level=logging.INFO,
+                        format="[%(asctime)s] %(name)s %(levelname)s: %(message)s",
+                        datefmt="%m/%d %H:%M:%S")
+    _log.setLevel(logging.INFO)
+    main(**vars(args))
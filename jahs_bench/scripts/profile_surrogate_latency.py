@@ -0,0 +1,117 @@
+"""
+Compare the compiled inference path of the surrogate models against their original
+sklearn pipelines. For each metric's model, the predictions of both paths are checked to
+be bit-for-bit identical on a batch of random configurations and the latency of single
+queries is reported in microseconds.
+"""
+
+import argparse
+import logging
+import time
+from pathlib import Path
+from typing import Callable, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from jahs_bench.lib.core.configspace import joint_config_space
+from jahs_bench.surrogate.model import XGBSurrogate
+
+_log = logging.getLogger(__name__)
+
+
+def random_features(nsamples: int, seed: Optional[int] = None) -> pd.DataFrame:
+    """ Sample random configurations along with random epochs in [1, 200]. """
+
+    random_state = np.random.RandomState(seed)
+    joint_config_space.seed(seed)
+    configs = joint_config_space.sample_configuration(nsamples)
+    configs = [configs] if nsamples == 1 else configs
+    features = pd.DataFrame([c.get_dictionary() for c in configs])
+    features.loc[:, "epoch"] = random_state.randint(1, 201, size=nsamples)
+    return features
+
+
+def time_calls(func: Callable, repeats: int) -> np.ndarray:
+    """ Call `func` `repeats` times and return the latency of each call in
+    microseconds. """
+
+    latencies = np.empty(repeats)
+    for i in range(repeats):
+        start = time.perf_counter()
+        func()
+        latencies[i] = time.perf_counter() - start
+    return latencies * 1e6
+
+
+def main(model_dir: Path, outputs: Optional[Sequence[str]] = None, nsamples: int = 1000,
+         repeats: int = 1000, seed: Optional[int] = None):
+    assert model_dir.exists() and model_dir.is_dir()
+
+    outputs = outputs or sorted(p.name for p in model_dir.iterdir() if p.is_dir())
+    features = random_features(nsamples, seed)
+    single = features.iloc[:1]
+
+    results = {}
+    for output in outputs:
+        _log.info(f"Loading and compiling the surrogate for output: {output}")
+        surrogate = XGBSurrogate.load(model_dir / output)
+        compiled = surrogate.compile()
+
+        identical = compiled.matches(surrogate, features)
+        if not identical:
+            _log.warning(f"The compiled model for {output} does NOT reproduce the "
+                         f"predictions of the original pipeline.")
+
+        raw = single.loc[:, list(compiled.feature_headers)].to_numpy()
+        encoded = compiled.transform(raw)
+        results[output] = {
+            "identical": identical,
+            "pipeline_us": np.median(time_calls(lambda: surrogate.predict(single),
+                                                repeats)),
+            "compiled_us": np.median(time_calls(lambda: compiled.predict(raw),
+                                                repeats)),
+            "encode_us": np.median(time_calls(lambda: compiled.transform(raw),
+                                              repeats)),
+            "booster_us": np.median(time_calls(
+                lambda: compiled.predict_encoded(encoded), repeats)),
+        }
+
+    results = pd.DataFrame.from_dict(results, orient="index")
+    results.loc[:, "speedup"] = results.pipeline_us / results.compiled_us
+    _log.info(f"Median single query latencies:\n{results.to_string()}")
+    return results
+
+
+def parse_cli():
+    parser = argparse.ArgumentParser(
+        "Verify and profile the compiled inference path of the surrogate models."
+    )
+    parser.add_argument("--model_dir", type=Path,
+                        help="The directory containing one sub-directory with a trained "
+                             "surrogate per metric, e.g. "
+                             "'jahs_bench_data/assembled_surrogates/cifar10'.")
+    parser.add_argument("--nsamples", type=int, default=1000,
+                        help="The number of random configurations used to verify that "
+                             "both inference paths generate identical predictions.")
+    parser.add_argument("--repeats", type=int, default=1000,
+                        help="The number of single queries to be timed per model.")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Seed for sampling random configurations.")
+    parser.add_argument("--outputs", type=str, default=None,
+                        nargs=argparse.REMAINDER,
+                        help="Strings, separated by spaces, that indicate which of the "
+                             "metrics' models should be profiled. If not given, all "
+                             "models present in 'model_dir' are used.")
+
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_cli()
+    logging.basicConfig(level=logging.INFO,
+                        format="[%(asctime)s] %(name)s %(levelname)s: %(message)s",
+                        datefmt="%m/%d %H:%M:%S")
+    _log.setLevel(logging.INFO)
+    main(**vars(args))
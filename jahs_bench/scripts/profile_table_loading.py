@@ -0,0 +1,124 @@
+"""
+Compare the time and memory needed to load the tabular benchmark from the compressed
+pickles against memory mapping the columnar version of the same data. Every load happens
+in a fresh process, such that neither the imports nor the memory of earlier loads affect
+the measurements. Memory usage is read from "/proc/self/statm" and is therefore only
+reported on Linux.
+
+The resident memory of a process that memory maps a table includes the pages of the
+table that it has touched, e.g. while building the index of the table, which are shared
+with all other processes mapping the same table. The unshared part of the resident
+memory is the cost that every additional worker process pays.
+"""
+
+import argparse
+import logging
+import multiprocessing
+import resource
+import time
+from pathlib import Path
+from typing import Optional, Sequence
+
+import pandas as pd
+
+from jahs_bench.lib.core import columnar
+
+_log = logging.getLogger(__name__)
+
+_PAGE_MB = resource.getpagesize() / 2 ** 20
+
+
+def memory_usage() -> dict:
+    """ The current resident and shared memory as well as the peak resident memory of
+    this process, in MB. """
+
+    usage = {"peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10}
+    try:
+        with open("/proc/self/statm") as fp:
+            _, resident, shared = map(int, fp.read().split()[:3])
+    except OSError:
+        return usage
+
+    usage["rss_mb"] = resident * _PAGE_MB
+    usage["shared_mb"] = shared * _PAGE_MB
+    return usage
+
+
+def _load(task: str, save_dir: Path, table_format: str, metrics: Optional[Sequence[str]],
+          queue: multiprocessing.Queue):
+    from jahs_bench.api import Benchmark
+
+    before = memory_usage()
+    start = time.perf_counter()
+    benchmark = Benchmark(task=task, kind="table", download=False, save_dir=save_dir,
+                          metrics=metrics, table_format=table_format)
+    load_time = time.perf_counter() - start
+    after = memory_usage()
+
+    result = {"load_time_s": load_time, "rss_mb": after.get("rss_mb"),
+              "unshared_rss_mb": after.get("rss_mb", 0.) - after.get("shared_mb", 0.),
+              "peak_rss_increase_mb": after["peak_rss_mb"] - before["peak_rss_mb"]}
+    queue.put(result)
+
+
+def measure(task: str, save_dir: Path, table_format: str,
+            metrics: Optional[Sequence[str]] = None) -> dict:
+    """ Load the tabular benchmark in a fresh process and return its measurements. """
+
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_load, args=(task, save_dir, table_format, metrics, queue))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+
+def main(task: str, save_dir: Path, repeats: int = 3,
+         metrics: Optional[Sequence[str]] = None):
+    table_dir = save_dir / "metric_data" / task
+    if not (table_dir / columnar.COLUMNAR_DIR_NAME / columnar.MANIFEST_NAME).exists():
+        _log.info(f"No columnar table found for the task {task}, converting it now.")
+        columnar.convert_pickles(table_dir)
+
+    results = []
+    for table_format in ("pickle", "columnar"):
+        for r in range(repeats):
+            res = measure(task, save_dir, table_format, metrics)
+            results.append({"format": table_format, "repeat": r, **res})
+            _log.info(f"Loaded the {table_format} table in {res['load_time_s']:.3f} "
+                      f"seconds.")
+
+    results = pd.DataFrame(results)
+    summary = results.groupby("format", sort=False).median().drop(columns="repeat")
+    _log.info(f"Median load time and memory usage over {repeats} loads:\n"
+              f"{summary.to_string()}")
+    return summary
+
+
+def parse_cli():
+    parser = argparse.ArgumentParser(
+        "Profile the load time and memory usage of the tabular benchmark for the pickled "
+        "and the columnar performance datasets."
+    )
+    parser.add_argument("--task", type=str, default="cifar10",
+                        help="The task whose performance table should be loaded.")
+    parser.add_argument("--save_dir", type=Path, default=Path("jahs_bench_data"),
+                        help="The directory containing 'metric_data/<task>'. The "
+                             "columnar table is created if it does not exist yet.")
+    parser.add_argument("--repeats", type=int, default=3,
+                        help="The number of times each format is loaded.")
+    parser.add_argument("--metrics", type=str, nargs="+", default=None,
+                        help="Only load these metrics. Defaults to all metrics.")
+
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_cli()
+    logging.basicConfig(level=logging.INFO,
+                        format="[%(asctime)s] %(name)s %(levelname)s: %(message)s",
+                        datefmt="%m/%d %H:%M:%S")
+    _log.setLevel(logging.INFO)
+    main(**vars(args))
@@ -0,0 +1,113 @@
+"""
+Compare the hashed index used by the tabular benchmark against answering every query
+with a join over the full performance table, as was done previously. Reports the time
+needed to build the index and the latencies of point, trajectory and batch lookups on
+randomly chosen configurations from the table.
+"""
+
+import argparse
+import logging
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from jahs_bench.api import Benchmark, BenchmarkTypes
+from jahs_bench.lib.core.configspace import joint_config_space
+from jahs_bench.lib.core.table_index import TableIndex
+
+_log = logging.getLogger(__name__)
+
+
+def merge_lookup(benchmark: Benchmark, config: dict, nepochs: int,
+                 full_trajectory: bool = False) -> pd.DataFrame:
+    """ The join based lookup previously used by the tabular benchmark. """
+
+    query = {k: v for k, v in config.items() if k != "epoch"}
+    query_df = pd.DataFrame(query, index=list(range(1, nepochs + 1))
+                            if full_trajectory else [nepochs])
+    query_df = query_df.rename_axis("epoch", axis=0).reset_index()
+    idx = pd.merge(benchmark._table_features, query_df, how="inner")["Sample ID"]
+    labels = benchmark._table_labels.loc[idx, :]
+    return labels.iloc[:nepochs] if full_trajectory else labels.iloc[:1]
+
+
+def mean_us(func, args) -> float:
+    start = time.perf_counter()
+    for a in args:
+        func(*a)
+    return (time.perf_counter() - start) / len(args) * 1e6
+
+
+def main(task: str, save_dir: Path, nqueries: int = 100, seed: int = 0):
+    benchmark = Benchmark(task=task, kind=BenchmarkTypes.Table, download=False,
+                          save_dir=save_dir)
+    nrows = benchmark._table_features.shape[0]
+
+    start = time.perf_counter()
+    index = TableIndex(benchmark._table_features,
+                       parameters=joint_config_space.get_hyperparameter_names())
+    build_time = time.perf_counter() - start
+    _log.info(f"Indexed {nrows} rows containing {len(index)} configurations in "
+              f"{build_time:.2f} seconds.")
+
+    random_state = np.random.RandomState(seed)
+    configs = [benchmark.sample_config(random_state) for _ in range(nqueries)]
+    points = [(c, c["epoch"]) for c in configs]
+    trajectories = [(c, c["epoch"], True) for c in configs]
+
+    for (c, e), row in zip(points, index.lookup_batch(
+            {k: np.array([c[k] for c, _ in points]) for k in index.parameters},
+            [e for _, e in points])):
+        assert np.array_equal(merge_lookup(benchmark, c, e).to_numpy(),
+                              benchmark._table_labels.iloc[[row]].to_numpy())
+
+    results = pd.DataFrame({
+        "merge_us": [mean_us(lambda c, e: merge_lookup(benchmark, c, e), points),
+                     mean_us(lambda c, e, f: merge_lookup(benchmark, c, e, f),
+                             trajectories)],
+        "index_us": [mean_us(index.lookup, points),
+                     mean_us(index.trajectory, [(c, e) for c, e, _ in trajectories])],
+        "benchmark_us": [mean_us(lambda c, e: benchmark(c, nepochs=e), points),
+                         mean_us(lambda c, e, f: benchmark(c, nepochs=e,
+                                                           full_trajectory=f),
+                                 trajectories)],
+    }, index=["point", "trajectory"])
+
+    start = time.perf_counter()
+    benchmark.query_batch(configs, nepochs=[e for _, e in points])
+    batch_us = (time.perf_counter() - start) / nqueries * 1e6
+    results.loc["batch", "benchmark_us"] = batch_us
+    results.loc[:, "speedup"] = results.merge_us / results.index_us
+
+    _log.info(f"Mean latencies per query on a table of {nrows} rows:\n"
+              f"{results.to_string()}")
+    return results
+
+
+def parse_cli():
+    parser = argparse.ArgumentParser(
+        "Profile lookups in the performance tables using the hashed index against the "
+        "previously used joins."
+    )
+    parser.add_argument("--task", type=str, default="cifar10",
+                        help="The task whose performance table should be profiled.")
+    parser.add_argument("--save_dir", type=Path, default=Path("jahs_bench_data"),
+                        help="The directory containing 'metric_data/<task>'.")
+    parser.add_argument("--nqueries", type=int, default=100,
+                        help="The number of random configurations to be queried.")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Seed for choosing the queried configurations.")
+
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_cli()
+    logging.basicConfig(level=logging.INFO,
+                        format="[%(asctime)s] %(name)s %(levelname)s: %(message)s",
+                        datefmt="%m/%d %H:%M:%S")
+    _log.setLevel(logging.INFO)
+    main(**vars(args))
@@ -0,0 +1,122 @@
+"""
+Measure how the surrogate benchmark scales with the number of threads. For each number
+of threads n, a benchmark is loaded with `n_threads=n` and two workloads are timed: a
+single large batch of configurations and n caller threads that share the benchmark and
+each send single queries in a closed loop. The throughput of either workload and its
+speedup over a single thread are reported, and the results of every run are checked
+against those of the single-threaded run.
+"""
+
+import argparse
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Sequence
+
+import pandas as pd
+
+from jahs_bench.api import Benchmark
+
+_log = logging.getLogger(__name__)
+
+
+def time_batch(benchmark: Benchmark, configs: list, repeats: int) -> float:
+    """ The fastest of `repeats` queries of the entire batch, in seconds. """
+
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        benchmark.query_batch(configs, nepochs=200)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def time_callers(benchmark: Benchmark, configs: list, ncallers: int) -> float:
+    """ The time needed by `ncallers` threads to query every configuration once, each
+    thread querying its share of the configurations one at a time. """
+
+    def call(share: list):
+        for config in share:
+            benchmark(config, nepochs=config["epoch"])
+
+    threads = [threading.Thread(target=call, args=(configs[i::ncallers],))
+               for i in range(ncallers)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - start
+
+
+def main(task: str, save_dir: Path, threads: Optional[Sequence[int]] = None,
+         batch_size: int = 100000, nqueries: int = 2000, repeats: int = 3,
+         seed: Optional[int] = None):
+    if threads is None:
+        ncores = os.cpu_count() or 1
+        threads = sorted({min(2 ** i, ncores) for i in range(ncores.bit_length() + 1)})
+
+    configs, reference = None, None
+    results = {}
+    for n in threads:
+        benchmark = Benchmark(task=task, save_dir=save_dir, download=False, n_threads=n)
+        if configs is None:
+            configs = list(benchmark.sample_configs(batch_size, random_state=seed))
+        outputs = benchmark.query_batch(configs[:nqueries], nepochs=200)
+        if reference is None:
+            reference = outputs
+        elif not outputs.equals(reference):
+            _log.warning(f"The results with {n} threads differ from those with "
+                         f"{threads[0]} threads.")
+
+        batch = time_batch(benchmark, configs, repeats)
+        callers = time_callers(benchmark, configs[:nqueries], n)
+        results[n] = {"batch_configs_per_s": batch_size / batch,
+                      "callers_queries_per_s": nqueries / callers}
+        _log.info(f"Finished the runs with {n} threads.")
+
+    results = pd.DataFrame.from_dict(results, orient="index")
+    results.index.name = "threads"
+    results.loc[:, "batch_speedup"] = \
+        results.batch_configs_per_s / results.batch_configs_per_s.iloc[0]
+    results.loc[:, "callers_speedup"] = \
+        results.callers_queries_per_s / results.callers_queries_per_s.iloc[0]
+    _log.info(f"Throughput by number of threads:\n{results.to_string()}")
+    return results
+
+
+def parse_cli():
+    parser = argparse.ArgumentParser(
+        "Measure the scaling of the surrogate benchmark with the number of threads."
+    )
+    parser.add_argument("--task", type=str, default="cifar10",
+                        help="The task of the benchmark.")
+    parser.add_argument("--save_dir", type=Path, default=Path("jahs_bench_data"),
+                        help="The directory containing the surrogate models.")
+    parser.add_argument("--threads", type=int, nargs="+", default=None,
+                        help="The numbers of threads to measure. Defaults to the powers "
+                             "of 2 up to the number of cores.")
+    parser.add_argument("--batch_size", type=int, default=100000,
+                        help="The number of configurations in the large batch.")
+    parser.add_argument("--nqueries", type=int, default=2000,
+                        help="The number of single queries sent by all caller threads "
+                             "together.")
+    parser.add_argument("--repeats", type=int, default=3,
+                        help="The number of times the large batch is queried. The "
+                             "fastest query is reported.")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Seed for sampling random configurations.")
+
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_cli()
+    logging.basicConfig(level=logging.INFO,
+                        format="[%(asctime)s] %(name)s %(levelname)s: %(message)s",
+                        datefmt="%m/%d %H:%M:%S")
+    _log.setLevel(logging.INFO)
+    main(**vars(args))
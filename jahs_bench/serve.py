@@ -0,0 +1,299 @@
+"""
+A local query server for the benchmark, such that any number of optimizer processes on
+one machine can share a single copy of the surrogate models (or performance tables)
+instead of each loading its own. Clients connect through a Unix socket and their
+queries are coalesced into micro-batches, which are answered with a single batched
+prediction each.
+
+Start a server with
+
+    python -m jahs_bench.serve --address /tmp/jahs_bench.sock --tasks cifar10
+
+and query it from any process with
+
+    with BenchmarkClient("/tmp/jahs_bench.sock", task="cifar10") as benchmark:
+        results = benchmark(config, nepochs=200)
+"""
+
+import argparse
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing.connection import Client, Connection, Listener
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Sequence, Union
+
+from jahs_bench.api import Benchmark, BenchmarkTasks, BenchmarkTypes
+
+_log = logging.getLogger(__name__)
+
+_QUERY = "query"
+_INFO = "info"
+
+
+class _Request(NamedTuple):
+    task: str
+    config: dict
+    nepochs: int
+    full_trajectory: bool
+    future: Future
+
+
+class BenchmarkServer:
+    """ Serves queries on one or more tasks using a single process-wide copy of each
+    task's benchmark. Every client connection is handled by its own thread, which hands
+    the client's queries to a single batching thread. The batching thread waits up to
+    `max_delay` seconds after the first query of a batch for more queries to arrive, up
+    to a total of `max_batch` queries, and answers all of them with one call to the
+    benchmark per task. Since every client waits for the answer to its query before
+    sending the next one, the batching thread stops waiting as soon as every connected
+    client has a query in the batch. """
+
+    def __init__(self, address: Union[str, Path], tasks: Sequence[str],
+                 max_batch: int = 256, max_delay: float = 1e-3, **benchmark_kwargs):
+        """
+        :param address: Path-like
+            The path of the Unix socket that the server listens on. An existing file at
+            this path is replaced.
+        :param tasks: sequence of str
+            The tasks to be served.
+        :param max_batch: int
+            The maximum number of queries answered with a single batched call.
+        :param max_delay: float
+            The maximum time, in seconds, that a query waits for other queries to be
+            batched with.
+        :param benchmark_kwargs:
+            Passed on to `jahs_bench.Benchmark` for every task, e.g. "kind", "save_dir"
+            or "metrics".
+        """
+
+        self.address = str(address)
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.benchmarks: Dict[str, Benchmark] = {}
+        for task in tasks:
+            _log.info(f"Loading the benchmark for the task {task}.")
+            self.benchmarks[BenchmarkTasks(task).value] = \
+                Benchmark(task=task, **benchmark_kwargs)
+
+        self._queue: "queue.Queue[_Request]" = queue.Queue()
+        self._listener: Optional[Listener] = None
+        self._stop = threading.Event()
+        self._nclients = 0
+        self._nclients_lock = threading.Lock()
+        self.nbatches = 0
+        self.nqueries = 0
+
+    def serve_forever(self):
+        """ Accept client connections until `shutdown()` is called. """
+
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+        self._listener = Listener(self.address, family="AF_UNIX")
+        threading.Thread(target=self._batch_loop, name="BatchLoop", daemon=True).start()
+        _log.info(f"Serving the tasks {list(self.benchmarks.keys())} at {self.address}.")
+
+        try:
+            while not self._stop.is_set():
+                try:
+                    conn = self._listener.accept()
+                except OSError:
+                    if self._stop.is_set():
+                        break
+                    raise
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+        finally:
+            self._listener.close()
+            if os.path.exists(self.address):
+                os.unlink(self.address)
+
+    def shutdown(self):
+        self._stop.set()
+        if self._listener is not None:
+            self._listener.close()
+
+    def _handle(self, conn: Connection):
+        """ Answer the queries of one client, one at a time. """
+
+        with self._nclients_lock:
+            self._nclients += 1
+
+        with conn:
+            while not self._stop.is_set():
+                try:
+                    kind, payload = conn.recv()
+                except (EOFError, OSError):
+                    break
+
+                try:
+                    if kind == _INFO:
+                        benchmark = self.benchmarks[BenchmarkTasks(payload).value]
+                        result = {"task": benchmark.task.value,
+                                  "kind": benchmark.kind.value,
+                                  "metrics": benchmark.metrics}
+                    elif kind == _QUERY:
+                        future: Future = Future()
+                        task, config, nepochs, full_trajectory = payload
+                        self._queue.put(_Request(task, config, nepochs, full_trajectory,
+                                                 future))
+                        result = future.result()
+                    else:
+                        raise ValueError(f"Unknown type of request: {kind}")
+                except Exception as e:
+                    conn.send((False, e))
+                else:
+                    conn.send((True, result))
+
+        with self._nclients_lock:
+            self._nclients -= 1
+
+    def _next_batch(self) -> List[_Request]:
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_delay
+        while len(batch) < min(self.max_batch, self._nclients):
+            timeout = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=timeout) if timeout > 0 else
+                             self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _batch_loop(self):
+        while not self._stop.is_set():
+            batch = self._next_batch()
+            self.nbatches += 1
+            self.nqueries += len(batch)
+
+            groups: Dict[tuple, List[_Request]] = {}
+            for request in batch:
+                groups.setdefault((request.task, request.full_trajectory), []).append(
+                    request)
+
+            for (task, full_trajectory), requests in groups.items():
+                self._answer(task, full_trajectory, requests)
+
+    def _answer(self, task: str, full_trajectory: bool, requests: List[_Request]):
+        try:
+            benchmark = self.benchmarks[BenchmarkTasks(task).value]
+            results = benchmark._call_batch([r.config for r in requests],
+                                            nepochs=[r.nepochs for r in requests],
+                                            full_trajectory=full_trajectory)
+        except Exception as e:
+            if len(requests) == 1:
+                requests[0].future.set_exception(e)
+                return
+
+            # Find out which queries were at fault, without failing the others
+            for request in requests:
+                self._answer(task, full_trajectory, [request])
+            return
+
+        for request, result in zip(requests, results):
+            request.future.set_result(result)
+
+
+class BenchmarkClient:
+    """ A thin client for a `BenchmarkServer` that can be used in place of a
+    `jahs_bench.Benchmark` object for querying a single task. Instances are thread-safe,
+    but concurrent queries from multiple threads of one client are answered one after
+    another - use one client per thread in order to have them batched together. """
+
+    def __init__(self, address: Union[str, Path], task: Union[str, BenchmarkTasks],
+                 timeout: float = 60.):
+        """
+        :param address: Path-like
+            The path of the Unix socket that the server listens on.
+        :param task: str or BenchmarkTasks
+            The task to be queried, which must be served by the server.
+        :param timeout: float
+            The time, in seconds, to wait for the server to accept the connection, e.g.
+            while it is still starting up.
+        """
+
+        self.address = str(address)
+        self._lock = threading.Lock()
+
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                self._conn = Client(self.address, family="AF_UNIX")
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.1)
+
+        task = task.value if isinstance(task, BenchmarkTasks) else task
+        info = self._request(_INFO, task)
+        self.task = BenchmarkTasks(info["task"])
+        self.kind = BenchmarkTypes(info["kind"])
+        self.metrics = info["metrics"]
+
+    def _request(self, kind: str, payload):
+        with self._lock:
+            self._conn.send((kind, payload))
+            success, result = self._conn.recv()
+        if not success:
+            raise result
+        return result
+
+    def __call__(self, config: dict, nepochs: Optional[int] = 200,
+                 full_trajectory: bool = False, **kwargs) -> dict:
+        return self._request(_QUERY, (self.task.value, config, nepochs, full_trajectory))
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def parse_cli():
+    parser = argparse.ArgumentParser(
+        "Serve queries on the benchmark to any number of local clients."
+    )
+    parser.add_argument("--address", type=Path, default=Path("jahs_bench.sock"),
+                        help="The path of the Unix socket to listen on.")
+    parser.add_argument("--tasks", type=str, nargs="+",
+                        default=[t.value for t in BenchmarkTasks],
+                        choices=[t.value for t in BenchmarkTasks],
+                        help="The tasks to be served. Defaults to all tasks.")
+    parser.add_argument("--kind", type=str, default=BenchmarkTypes.Surrogate.value,
+                        choices=[BenchmarkTypes.Surrogate.value,
+                                 BenchmarkTypes.Table.value],
+                        help="The kind of benchmark to be served.")
+    parser.add_argument("--save_dir", type=Path, default=Path("jahs_bench_data"),
+                        help="The directory containing the data of the benchmark.")
+    parser.add_argument("--no_download", action="store_true",
+                        help="When given, missing data is not downloaded.")
+    parser.add_argument("--max_batch", type=int, default=256,
+                        help="The maximum number of queries answered at once.")
+    parser.add_argument("--max_delay_ms", type=float, default=1.,
+                        help="The maximum time, in milliseconds, that a query waits for "
+                             "other queries to be batched with.")
+
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_cli()
+    logging.basicConfig(level=logging.INFO,
+                        format="[%(asctime)s] %(name)s %(levelname)s: %(message)s",
+                        datefmt="%m/%d %H:%M:%S")
+    _log.setLevel(logging.INFO)
+
+    server = BenchmarkServer(args.address, args.tasks, max_batch=args.max_batch,
+                             max_delay=args.max_delay_ms / 1000, kind=args.kind,
+                             save_dir=args.save_dir, download=not args.no_download)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        _log.info("Shutting down.")
@@ -0,0 +1,192 @@
+"""
+Simulates asynchronous, parallel hyperparameter optimization on the benchmark without
+waiting for any training to actually happen. Each of a number of virtual workers
+evaluates one configuration at a time, which takes as much simulated time as the
+benchmark's "runtime" metric predicts training it would, and the optimizer is asked for
+new configurations and told about finished ones in exactly the order in which this would
+happen in real time.
+
+    def ask():
+        return benchmark.sample_config(), 200
+
+    executor = SimulatedExecutor(benchmark, n_workers=1000)
+    trace = executor.run(ask, tell=lambda trial: None, max_time=3 * 24 * 3600)
+"""
+
+import heapq
+import logging
+import operator
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import pandas as pd
+
+from jahs_bench.api import Benchmark
+
+_log = logging.getLogger(__name__)
+
+AskType = Callable[[], Optional[Tuple[dict, int]]]
+
+
+@dataclass
+class Trial:
+    """ The evaluation of one configuration for `nepochs` epochs on one worker, starting
+    and ending at the given simulated times. `result` holds the metrics at `nepochs`
+    epochs, in the format of `Benchmark.__call__()`, but for the last epoch only. """
+
+    id: int
+    worker: int
+    config: dict
+    nepochs: int
+    start: float
+    end: Optional[float] = None
+    result: Optional[dict] = None
+
+    @property
+    def duration(self) -> Optional[float]:
+        return None if self.end is None else self.end - self.start
+
+
+class SimulatedExecutor:
+    """ Runs an optimizer given by an ask and a tell callback on a number of simulated,
+    parallel workers. Idle workers ask the optimizer for a configuration and the number
+    of epochs to train it for. A job's duration is the value of the runtime metric at
+    that number of epochs, i.e. every job trains its configuration from scratch. Jobs
+    finish in the order of their simulated end times and the optimizer is told about
+    each, after which the freed worker asks for the next job.
+
+    The surrogate is never queried one job at a time for all metrics: the duration of a
+    new job is needed right away, so only the runtime metric is predicted when it
+    starts, for all jobs starting at the same time in one batch. All other metrics of all
+    running jobs are predicted in a single batch when the first of them finishes. """
+
+    def __init__(self, benchmark: Benchmark, n_workers: int,
+                 objective: str = "valid-acc", mode: str = "max",
+                 runtime_metric: str = "runtime"):
+        """
+        :param benchmark: Benchmark
+            The surrogate or tabular benchmark on which the configurations are evaluated.
+        :param n_workers: int
+            The number of simulated parallel workers.
+        :param objective: str
+            The metric whose incumbent is recorded in the trace.
+        :param mode: str
+            Either "max" or "min", whether the objective is to be maximized or minimized.
+        :param runtime_metric: str
+            The metric containing the cumulative training time, in seconds, of a
+            configuration up to a given epoch.
+        """
+
+        missing = {objective, runtime_metric}.difference(benchmark.metrics)
+        if missing:
+            raise ValueError(f"The benchmark must provide the metrics {sorted(missing)}, "
+                             f"but provides only {benchmark.metrics}.")
+        if mode not in ("max", "min"):
+            raise ValueError(f"Invalid value of parameter 'mode': '{mode}'. Must be one "
+                             f"of 'max' or 'min'.")
+
+        self.benchmark = benchmark
+        self.n_workers = n_workers
+        self.objective = objective
+        self.mode = mode
+        self.runtime_metric = runtime_metric
+
+        self.time = 0.
+        self.trials: List[Trial] = []
+        self.nqueries = 0
+
+    def run(self, ask: AskType, tell: Callable[[Trial], None],
+            max_time: Optional[float] = None, max_trials: Optional[int] = None) \
+            -> pd.DataFrame:
+        """
+        Simulate the optimization until the simulated time exceeds `max_time`, until
+        `max_trials` trials have finished or until the optimizer has no more jobs to run.
+
+        :param ask: callable
+            Called without arguments whenever a worker is idle. Returns a configuration
+            and the number of epochs to train it for, or None if the optimizer has no job
+            to run at the moment, e.g. since it waits for the results of running jobs.
+            In that case, the idle workers ask again after the next job finishes. The
+            current simulated time is available as `SimulatedExecutor.time`.
+        :param tell: callable
+            Called with the finished Trial whenever a job finishes.
+        :param max_time: optional float
+            The simulated time, in seconds, at which the simulation ends. Jobs still
+            running at this time are never told about.
+        :param max_trials: optional int
+            The maximum number of jobs started. The simulation ends once all of them have
+            finished.
+        :return: pandas DataFrame
+            The trace of the optimization, with one row per finished trial in the order
+            in which they finished, giving the simulated time, the trial, the worker, the
+            number of epochs, the objective value and the incumbent objective value.
+        """
+
+        idle = list(range(self.n_workers - 1, -1, -1))
+        running: List[Tuple[float, int]] = []
+        unresolved: List[Trial] = []
+        trace = []
+        incumbent = None
+        better = operator.gt if self.mode == "max" else operator.lt
+
+        while True:
+            started = []
+            while idle and (max_trials is None or len(self.trials) < max_trials):
+                job = ask()
+                if job is None:
+                    break
+                config, nepochs = job
+                trial = Trial(id=len(self.trials), worker=idle.pop(), config=config,
+                              nepochs=int(nepochs), start=self.time)
+                self.trials.append(trial)
+                started.append(trial)
+
+            if started:
+                runtimes = self._query(started, [self.runtime_metric])
+                for trial, runtime in zip(started, runtimes):
+                    trial.end = trial.start + max(runtime[self.runtime_metric], 0.)
+                    heapq.heappush(running, (trial.end, trial.id))
+                unresolved += started
+
+            if not running:
+                break
+
+            end = running[0][0]
+            if max_time is not None and end > max_time:
+                self.time = max_time
+                break
+            self.time = end
+
+            finished = []
+            while running and running[0][0] == end:
+                finished.append(self.trials[heapq.heappop(running)[1]])
+
+            if any(trial.result is None for trial in finished):
+                # Resolve every running job at once instead of one at a time
+                for trial, result in zip(unresolved, self._query(unresolved)):
+                    trial.result = result
+                unresolved = []
+
+            for trial in finished:
+                assert trial.result is not None
+                value = trial.result[self.objective]
+                if incumbent is None or better(value, incumbent):
+                    incumbent = value
+                trace.append((self.time, trial.id, trial.worker, trial.nepochs, value,
+                              incumbent))
+                tell(trial)
+                idle.append(trial.worker)
+
+        _log.info(f"Simulated {len(trace)} finished trials on {self.n_workers} workers "
+                  f"up to a time of {self.time:.0f} seconds using {self.nqueries} "
+                  f"batched queries.")
+        return pd.DataFrame(trace, columns=["time", "trial", "worker", "nepochs",
+                                            self.objective, "incumbent"])
+
+    def _query(self, trials: Sequence[Trial], metrics: Optional[List[str]] = None) \
+            -> List[dict]:
+        self.nqueries += 1
+        outputs, labels = self.benchmark._query_arrays(
+            [t.config for t in trials], nepochs=[t.nepochs for t in trials],
+            metrics=metrics)
+        return [dict(zip(labels, row)) for row in outputs.tolist()]
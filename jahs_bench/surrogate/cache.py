@@ -0,0 +1,250 @@
+""" A bounded, thread-safe cache of surrogate models, such that a single process can serve
+queries on many (task, metric) pairs under a fixed memory budget without loading a model
+from the disk for every query. """
+
+import logging
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Set, Tuple, \
+    Union, TYPE_CHECKING
+
+from jahs_bench.surrogate.compiled import CompiledSurrogate
+
+if TYPE_CHECKING:
+    # Imports scikit-learn, which compiled models do not need
+    from jahs_bench.surrogate.model import XGBSurrogate
+
+_log = logging.getLogger(__name__)
+
+# The memory budget of the default cache, enough for the models of a few metrics
+DEFAULT_MAX_BYTES = 1024 ** 3
+
+ModelType = Union[CompiledSurrogate, "XGBSurrogate"]
+
+
+def load_model(model_pth: Path) -> ModelType:
+    """ Load a saved surrogate model and compile it for inference, unless a compiled
+    version of it has been saved as well. Models that cannot be compiled are returned as
+    is. """
+
+    if CompiledSurrogate.exists(model_pth):
+        return CompiledSurrogate.load(model_pth)
+
+    from jahs_bench.surrogate.model import XGBSurrogate
+    surrogate = XGBSurrogate.load(Path(model_pth))
+    try:
+        return surrogate.compile()
+    except NotImplementedError as e:
+        _log.warning(f"Could not compile the surrogate model at {model_pth}, falling "
+                     f"back to its sklearn pipeline: {e}")
+        return surrogate
+
+
+def estimate_nbytes(model: ModelType) -> int:
+    """ Approximate the memory footprint of a model in bytes. For compiled models, this is
+    the size of the serialized boosters, which dominate their footprint. """
+
+    if isinstance(model, CompiledSurrogate):
+        return sum(len(b.save_raw(raw_format="ubj")) for b in model.boosters)
+    return len(pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+class ModelCache:
+    """ A least-recently-used cache of models, keyed by an arbitrary hashable key such as
+    (task, metric). Whenever the total size of the cached models exceeds `max_bytes`, the
+    least recently used models are evicted. Models can be prefetched asynchronously and
+    concurrent requests for a model that is still being loaded wait for that single load
+    instead of loading it again. """
+
+    def __init__(self, max_bytes: Optional[int] = None,
+                 loader: Callable[[Path], ModelType] = load_model,
+                 sizeof: Callable[[ModelType], int] = estimate_nbytes,
+                 prefetch_workers: int = 1):
+        """
+        :param max_bytes: int or None
+            The memory budget of the cache in bytes. When None, models are never evicted.
+            A single model larger than the budget is still cached, but evicts all others.
+        :param loader: callable
+            Loads a model given the path it is stored at.
+        :param sizeof: callable
+            Estimates the size of a loaded model in bytes.
+        :param prefetch_workers: int
+            The number of threads used for loading models asynchronously.
+        """
+
+        self._max_bytes = max_bytes
+        self.loader = loader
+        self.sizeof = sizeof
+        self.prefetch_workers = prefetch_workers
+
+        self._entries: "OrderedDict[Hashable, Tuple[ModelType, int]]" = OrderedDict()
+        self._pending: Dict[Hashable, Future] = {}
+        self._loading: Set[Hashable] = set()
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._nbytes = 0
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "prefetches": 0,
+                       "load_time": 0.}
+
+    @property
+    def max_bytes(self) -> Optional[int]:
+        return self._max_bytes
+
+    @max_bytes.setter
+    def max_bytes(self, value: Optional[int]):
+        with self._lock:
+            self._max_bytes = value
+            self._evict()
+
+    @property
+    def nbytes(self) -> int:
+        """ The estimated total size of all cached models in bytes. """
+        return self._nbytes
+
+    @property
+    def stats(self) -> dict:
+        """ The numbers of cache hits, misses, evictions and prefetched models as well as
+        the total time spent loading models, in seconds. Requests for a model that is
+        still being prefetched count as hits. """
+
+        with self._lock:
+            return {**self._stats, "models": len(self._entries), "nbytes": self._nbytes}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def get(self, key: Hashable, model_pth: Path) -> ModelType:
+        """ Return the model identified by `key`, loading it from `model_pth` if it is
+        not cached. """
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return self._entries[key][0]
+
+            future = self._pending.get(key)
+            if future is not None:
+                self._stats["hits"] += 1
+            else:
+                self._stats["misses"] += 1
+                future = self._pending[key] = Future()
+
+        if self._claim(key, future):
+            self._load(key, model_pth, future)
+        return future.result()
+
+    def prefetch(self, items: Iterable[Tuple[Hashable, Path]]) -> List[Future]:
+        """ Asynchronously load the models given as (key, path) pairs which are neither
+        cached nor already being loaded. Returns the futures of all given models. """
+
+        futures = []
+        with self._lock:
+            for key, model_pth in items:
+                if key in self._entries:
+                    future: Future = Future()
+                    future.set_result(self._entries[key][0])
+                elif key in self._pending:
+                    future = self._pending[key]
+                else:
+                    if self._executor is None:
+                        self._executor = ThreadPoolExecutor(
+                            max_workers=self.prefetch_workers,
+                            thread_name_prefix="ModelCachePrefetch")
+                    future = self._pending[key] = Future()
+                    self._executor.submit(self._prefetch, key, model_pth, future)
+                    self._stats["prefetches"] += 1
+                futures.append(future)
+        return futures
+
+    def _prefetch(self, key: Hashable, model_pth: Path, future: Future):
+        # A request may have started loading this model in the meantime
+        if self._claim(key, future):
+            self._load(key, model_pth, future)
+
+    def _claim(self, key: Hashable, future: Future) -> bool:
+        """ Ensure that only one thread loads any given pending model. """
+
+        with self._lock:
+            if self._pending.get(key) is not future or key in self._loading:
+                return False
+            self._loading.add(key)
+            return True
+
+    def _load(self, key: Hashable, model_pth: Path, future: Future):
+        start = time.perf_counter()
+        try:
+            model = self.loader(model_pth)
+            nbytes = self.sizeof(model)
+        except BaseException as e:
+            with self._lock:
+                self._pending.pop(key, None)
+                self._loading.discard(key)
+            future.set_exception(e)
+            return
+
+        with self._lock:
+            self._pending.pop(key, None)
+            self._loading.discard(key)
+            self._stats["load_time"] += time.perf_counter() - start
+            self._entries[key] = (model, nbytes)
+            self._nbytes += nbytes
+            self._evict()
+        _log.debug(f"Loaded the model {key} of approximately {nbytes} bytes from "
+                   f"{model_pth}.")
+        future.set_result(model)
+
+    def _evict(self):
+        """ Evict the least recently used models until the budget is met. The most
+        recently used model is never evicted. Must be called while holding the lock. """
+
+        if self._max_bytes is None:
+            return
+
+        while self._nbytes > self._max_bytes and len(self._entries) > 1:
+            key, (_, nbytes) = self._entries.popitem(last=False)
+            self._nbytes -= nbytes
+            self._stats["evictions"] += 1
+            _log.debug(f"Evicted the model {key} from the cache.")
+
+        if self._nbytes > self._max_bytes:
+            _log.warning(f"The model {next(iter(self._entries))} alone requires "
+                         f"{self._nbytes} bytes, exceeding the cache's budget of "
+                         f"{self._max_bytes} bytes.")
+
+    def clear(self):
+        """ Remove all cached models. Models being loaded are still cached when done. """
+
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+
+    def close(self):
+        """ Stop the threads used for prefetching, after any pending loads finish. """
+
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+_default_cache: Optional[ModelCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def default_cache() -> ModelCache:
+    """ The cache shared by all lazily loaded benchmarks in this process. Its memory
+    budget is `DEFAULT_MAX_BYTES` unless another one is set, e.g.
+    `default_cache().max_bytes = 2 * 1024 ** 3`. """
+
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ModelCache(max_bytes=DEFAULT_MAX_BYTES)
+        return _default_cache
@@ -0,0 +1,691 @@
+""" An inference-only, pandas-free representation of trained surrogate models. Everything
+that the sklearn pipeline of an XGBSurrogate does at prediction time - column selection,
+one-hot encoding, walking the booster and undoing the target transformations - is
+extracted once, such that predictions go straight from NumPy arrays through
+`xgb.Booster.inplace_predict()` and a vectorized inverse target transform. The results
+are bit-for-bit identical to those of `XGBSurrogate.predict()`. """
+
+from __future__ import annotations
+
+import importlib
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Mapping, NamedTuple, Optional, Sequence, \
+    Tuple, Union, TYPE_CHECKING
+
+import numpy as np
+import xgboost as xgb
+
+from jahs_bench.lib.core.encoding import ConfigCodes
+
+if TYPE_CHECKING:
+    from jahs_bench.surrogate.model import XGBSurrogate
+
+_log = logging.getLogger(__name__)
+FeaturesType = Union[Mapping[str, Union[Sequence, np.ndarray]], np.ndarray]
+
+
+class _OneHotFeature(NamedTuple):
+    name: str
+    categories: np.ndarray
+    # Maps the index of each category to its encoded column, -1 for a dropped category
+    columns: np.ndarray
+    # Maps each category directly to its encoded column, used for very small batches
+    lookup: Dict[object, int]
+
+
+def _as_columns(features: FeaturesType, names: Sequence[str]) \
+        -> Dict[str, Union[Sequence, np.ndarray]]:
+    """ Convert features in any of the formats accepted by
+    `CompiledSurrogate.transform()` into a dict mapping the available features among
+    `names` to their values. """
+
+    if isinstance(features, np.ndarray):
+        if features.dtype.names is not None:
+            return {name: features[name] for name in features.dtype.names}
+        if features.ndim != 2 or features.shape[1] != len(names):
+            raise ValueError(f"Expected a 2D array with the columns {names}, got an "
+                             f"array of shape {features.shape}.")
+        return {name: features[:, i] for i, name in enumerate(names)}
+    return {name: features[name] for name in names if name in features}
+
+
+class MinMaxInverse:
+    """ The inverse of a fitted `sklearn.preprocessing.MinMaxScaler`. """
+
+    kind = "minmax"
+
+    def __init__(self, min_: np.ndarray, scale_: np.ndarray):
+        self.min_ = np.asarray(min_, dtype=np.float64)
+        self.scale_ = np.asarray(scale_, dtype=np.float64)
+
+    def __call__(self, arr: np.ndarray) -> np.ndarray:
+        # Mirrors MinMaxScaler.inverse_transform(), including the in-place arithmetic
+        # which keeps the dtype of the predictions intact.
+        arr = arr.copy()
+        arr -= self.min_
+        arr /= self.scale_
+        return arr
+
+    def to_dict(self) -> dict:
+        return {"kind": self.kind, "min_": self.min_.tolist(),
+                "scale_": self.scale_.tolist()}
+
+
+class FunctionInverse:
+    """ The inverse of a fitted `sklearn.preprocessing.FunctionTransformer`. """
+
+    kind = "function"
+
+    def __init__(self, func: Callable, kw_args: Optional[dict] = None):
+        self.func = func
+        self.kw_args = dict(kw_args) if kw_args else {}
+
+    def __call__(self, arr: np.ndarray) -> np.ndarray:
+        return self.func(arr, **self.kw_args)
+
+    def to_dict(self) -> dict:
+        # Functions are stored by reference, which requires them to be importable
+        name = f"{self.func.__module__}:{self.func.__qualname__}"
+        if "<" in name:
+            raise NotImplementedError(f"Cannot save a reference to the function {name}, "
+                                      f"which is not importable.")
+        return {"kind": self.kind, "func": name, "kw_args": self.kw_args}
+
+
+InverseType = Union[MinMaxInverse, FunctionInverse]
+
+
+def _inverse_from_dict(spec: dict) -> InverseType:
+    if spec["kind"] == MinMaxInverse.kind:
+        return MinMaxInverse(spec["min_"], spec["scale_"])
+    if spec["kind"] == FunctionInverse.kind:
+        module, qualname = spec["func"].split(":")
+        func: Any = importlib.import_module(module)
+        for attr in qualname.split("."):
+            func = getattr(func, attr)
+        return FunctionInverse(func, spec["kw_args"])
+    raise ValueError(f"Unknown kind of inverse target transformation {spec['kind']}.")
+
+
+def target_inverse(transformer) -> InverseType:
+    """ The inverse of a fitted target transformation of an XGBSurrogate. """
+
+    import sklearn.preprocessing
+
+    if isinstance(transformer, sklearn.preprocessing.MinMaxScaler):
+        return MinMaxInverse(transformer.min_, transformer.scale_)
+    if isinstance(transformer, sklearn.preprocessing.FunctionTransformer):
+        if transformer.validate:
+            raise NotImplementedError(
+                "Cannot compile a FunctionTransformer with validate=True.")
+        return FunctionInverse(transformer.inverse_func, transformer.inv_kw_args)
+    raise NotImplementedError(f"Cannot compile the target transformation {transformer}.")
+
+
+class CompiledSurrogate:
+    """ A compiled, inference-only version of a trained XGBSurrogate. Use
+    `XGBSurrogate.compile()` or `CompiledSurrogate.from_surrogate()` to generate one. """
+
+    feature_headers: Tuple[str, ...]
+    label_headers: Tuple[str, ...]
+    boosters: Tuple[xgb.Booster, ...]
+    iteration_ranges: Tuple[Tuple[int, int], ...]
+    target_inverses: Tuple[Tuple[InverseType, ...], ...]
+    manifest_filename = "compiled.json"
+    format_version = 1
+    _small_batch = 8
+
+    def __init__(self, feature_headers: Sequence[str], label_headers: Sequence[str],
+                 onehot: Sequence[Tuple[str, Union[Sequence, np.ndarray], Optional[int]]],
+                 passthrough: Sequence[str], boosters: Sequence[xgb.Booster],
+                 iteration_ranges: Sequence[Tuple[int, int]],
+                 target_inverses: Sequence[Sequence[InverseType]],
+                 sparse: bool = False):
+        """
+        :param feature_headers: sequence of str
+            The names of the raw input features, in the order the model was trained on.
+        :param label_headers: sequence of str
+            The names of the predicted outputs, one for each booster.
+        :param onehot: sequence of 3-tuples
+            For each one-hot encoded feature, in the order of the encoded columns, the
+            name of the feature, its sorted categories and the index of the category that
+            is dropped by the encoder or None.
+        :param passthrough: sequence of str
+            The names of the features that are passed on to the boosters as-is, in order,
+            following the one-hot encoded columns.
+        :param boosters: sequence of xgb.Booster
+            One booster per output.
+        :param iteration_ranges: sequence of 2-tuples of int
+            The range of boosting rounds used by each booster for predictions.
+        :param target_inverses: sequence of sequences of MinMaxInverse or FunctionInverse
+            For each output, the inverse target transformations in the order in which
+            they must be applied to the raw booster predictions.
+        :param sparse: bool
+            Whether the encoded inputs were handed to the boosters as a sparse matrix, in
+            which case all zeros are treated as missing values.
+        """
+
+        self.feature_headers = tuple(feature_headers)
+        self.label_headers = tuple(label_headers)
+        self.boosters = tuple(boosters)
+        self.iteration_ranges = tuple((r[0], r[1]) for r in iteration_ranges)
+        self.target_inverses = tuple(tuple(t) for t in target_inverses)
+        self.sparse = sparse
+
+        assert len(self.boosters) == len(self.label_headers) == \
+            len(self.iteration_ranges) == len(self.target_inverses)
+
+        self._onehot = []
+        offset = 0
+        for name, categories, drop_idx in onehot:
+            categories = np.asarray(list(categories))
+            columns = np.arange(categories.size) + offset
+            if drop_idx is not None:
+                columns[drop_idx + 1:] -= 1
+                columns[drop_idx] = -1
+            offset = columns.max() + 1
+            lookup = dict(zip(categories.tolist(), columns.tolist()))
+            self._onehot.append(_OneHotFeature(name, categories, columns, lookup))
+
+        self._passthrough = tuple((name, offset + i)
+                                  for i, name in enumerate(passthrough))
+        self.n_encoded = offset + len(self._passthrough)
+        self._code_tables: Dict[Tuple[str, tuple], np.ndarray] = {}
+
+    @property
+    def onehot(self) -> Tuple[Tuple[str, np.ndarray, Optional[int]], ...]:
+        """ The layout of the one-hot encoded features, as accepted by `__init__()`. """
+
+        layout = []
+        for feature in self._onehot:
+            dropped = np.flatnonzero(feature.columns < 0)
+            layout.append((feature.name, feature.categories,
+                           int(dropped[0]) if dropped.size else None))
+        return tuple(layout)
+
+    @property
+    def passthrough(self) -> Tuple[str, ...]:
+        """ The names of the features that are not one-hot encoded, in order. """
+
+        return tuple(name for name, _ in self._passthrough)
+
+    @classmethod
+    def from_surrogate(cls, surrogate: XGBSurrogate) -> CompiledSurrogate:
+        """ Extract everything needed for inference from a trained XGBSurrogate. """
+
+        # sklearn is only needed in order to pick apart a fitted pipeline
+        import sklearn.compose
+        import sklearn.multioutput
+        import sklearn.preprocessing
+
+        if not surrogate.trained_:
+            raise RuntimeError("Only a trained surrogate can be compiled.")
+        assert surrogate.model is not None and surrogate.feature_headers is not None \
+            and surrogate.label_headers is not None
+
+        preprocess, estimator = surrogate.model.steps[0][1], surrogate.model.steps[-1][1]
+        feature_headers = [str(f) for f in surrogate.feature_headers]
+
+        onehot, passthrough = [], []
+        for name, transformer, columns in preprocess.transformers_:
+            if name == "remainder":
+                if transformer == "drop":
+                    continue
+                if transformer != "passthrough":
+                    raise NotImplementedError(
+                        f"Cannot compile a pipeline with the remainder {transformer}.")
+                passthrough += [feature_headers[c] if isinstance(c, (int, np.integer))
+                                else str(c) for c in columns]
+            elif isinstance(transformer, sklearn.preprocessing.OneHotEncoder):
+                drop_idx = transformer.drop_idx_
+                for i, column in enumerate(columns):
+                    drop = None if drop_idx is None or drop_idx[i] is None \
+                        else int(drop_idx[i])
+                    onehot.append((str(column), transformer.categories_[i].tolist(),
+                                   drop))
+            else:
+                raise NotImplementedError(
+                    f"Cannot compile a pipeline containing the transformer {name}: "
+                    f"{transformer}.")
+
+        if isinstance(estimator, sklearn.multioutput.MultiOutputRegressor):
+            estimators = estimator.estimators_
+        else:
+            estimators = [estimator]
+
+        boosters, iteration_ranges, target_inverses = [], [], []
+        for est in estimators:
+            inverses = []
+            while isinstance(est, sklearn.compose.TransformedTargetRegressor):
+                inverses.append(target_inverse(est.transformer_))
+                est = est.regressor_
+
+            booster = est.get_booster()
+            best_iteration = booster.attr("best_iteration")
+            boosters.append(booster)
+            iteration_ranges.append((0, int(best_iteration) + 1)
+                                    if best_iteration is not None else (0, 0))
+            # Nested TransformedTargetRegressors are undone from the inside out
+            target_inverses.append(inverses[::-1])
+
+        return cls(feature_headers=feature_headers,
+                   label_headers=[str(l) for l in surrogate.label_headers],
+                   onehot=onehot, passthrough=passthrough, boosters=boosters,
+                   iteration_ranges=iteration_ranges, target_inverses=target_inverses,
+                   sparse=bool(getattr(preprocess, "sparse_output_", False)))
+
+    def save(self, outdir: Union[str, Path]):
+        """ Save this model in a format that does not depend on sklearn or pickle: every
+        booster is written in XGBoost's native UBJSON format and everything else, i.e.
+        the input encoding and the target transformations, goes into a small JSON
+        manifest. Use `CompiledSurrogate.load()` to read the model back. """
+
+        outdir = Path(outdir)
+        outdir.mkdir(parents=True, exist_ok=True)
+        outputs = []
+        for i, (label, booster, iteration_range, inverses) in enumerate(zip(
+                self.label_headers, self.boosters, self.iteration_ranges,
+                self.target_inverses)):
+            booster_file = f"booster_{i}.ubj"
+            booster.save_model(outdir / booster_file)
+            outputs.append({"label": label, "booster": booster_file,
+                            "iteration_range": list(iteration_range),
+                            "target_inverses": [inv.to_dict() for inv in inverses]})
+
+        manifest = {
+            "version": self.format_version, "xgboost_version": xgb.__version__,
+            "feature_headers": list(self.feature_headers),
+            "onehot": [{"name": name, "categories": categories.tolist(), "drop": drop}
+                       for name, categories, drop in self.onehot],
+            "passthrough": list(self.passthrough), "sparse": self.sparse,
+            "outputs": outputs,
+        }
+        with open(outdir / self.manifest_filename, "w") as fp:
+            json.dump(manifest, fp, indent=2)
+
+    @classmethod
+    def exists(cls, outdir: Union[str, Path]) -> bool:
+        """ Whether a model saved by `save()` exists in the given directory. """
+        return (Path(outdir) / cls.manifest_filename).exists()
+
+    @classmethod
+    def remove(cls, outdir: Union[str, Path]):
+        """ Delete the model saved by `save()` in the given directory, if any. """
+
+        outdir = Path(outdir)
+        if cls.exists(outdir):
+            (outdir / cls.manifest_filename).unlink()
+        for booster_file in outdir.glob("booster_*.ubj"):
+            booster_file.unlink()
+
+    @classmethod
+    def load(cls, outdir: Union[str, Path]) -> CompiledSurrogate:
+        """ Load a model previously saved by `save()`. """
+
+        outdir = Path(outdir)
+        with open(outdir / cls.manifest_filename) as fp:
+            manifest = json.load(fp)
+
+        if manifest["version"] != cls.format_version:
+            raise ValueError(f"Unsupported version {manifest['version']} of the compiled "
+                             f"surrogate at {outdir}, expected {cls.format_version}.")
+
+        outputs = manifest["outputs"]
+        return cls(feature_headers=manifest["feature_headers"],
+                   label_headers=[o["label"] for o in outputs],
+                   onehot=[(o["name"], o["categories"], o["drop"])
+                           for o in manifest["onehot"]],
+                   passthrough=manifest["passthrough"],
+                   boosters=[xgb.Booster(model_file=outdir / o["booster"])
+                             for o in outputs],
+                   iteration_ranges=[o["iteration_range"] for o in outputs],
+                   target_inverses=[[_inverse_from_dict(i) for i in o["target_inverses"]]
+                                    for o in outputs],
+                   sparse=manifest["sparse"])
+
+    def set_nthread(self, nthread: int):
+        """ Set the number of threads that each booster uses for a prediction. Not safe
+        while predictions are being made concurrently. """
+
+        for booster in self.boosters:
+            booster.set_param("nthread", nthread)
+
+    def _columns(self, features: FeaturesType) -> Dict[str, Union[Sequence, np.ndarray]]:
+        return _as_columns(features, self.feature_headers)
+
+    def _code_table(self, feature: _OneHotFeature, choices: tuple) -> np.ndarray:
+        """ Maps the codes of a `ConfigEncoder` for the given feature to the encoded
+        columns, -1 for a dropped category and -2 for a category unknown to the model. """
+
+        key = (feature.name, choices)
+        table = self._code_tables.get(key)
+        if table is None:
+            table = np.array([feature.lookup.get(c, -2) for c in choices], dtype=np.intp)
+            self._code_tables[key] = table
+        return table
+
+    def transform(self, features: FeaturesType, codes: Optional[ConfigCodes] = None) \
+            -> np.ndarray:
+        """ Encode the given raw features into the float32 matrix expected by the
+        boosters. `features` may be any mapping from feature names to 1D arrays, such as
+        a dict or a pandas DataFrame, a structured NumPy array, or a 2D NumPy array whose
+        columns follow the order of `feature_headers`. When the `codes` of the features,
+        as generated by a `ConfigEncoder`, are given, the one-hot encoding is looked up
+        from the codes instead of matching the raw values. """
+
+        columns = self._columns(features)
+        nrows = len(columns[self.feature_headers[0]])
+        encoded = np.zeros((nrows, self.n_encoded), dtype=np.float32)
+        rows = np.arange(nrows)
+
+        for feature in self._onehot:
+            if codes is not None and feature.name in codes.codes:
+                choices = codes.choices[feature.name]
+                cols = self._code_table(feature, choices)[codes.codes[feature.name]]
+                if np.any(cols == -2):
+                    unknown = {choices[c] for c in codes.codes[feature.name][cols == -2]}
+                    raise ValueError(f"Found unknown categories {sorted(unknown)} in "
+                                     f"column {feature.name} during transform.")
+                sel = cols >= 0
+                encoded[rows[sel], cols[sel]] = 1.
+                continue
+
+            if nrows <= self._small_batch:
+                # Vectorization does not pay off for a handful of rows
+                for row, value in enumerate(columns[feature.name]):
+                    col = feature.lookup.get(value, None)
+                    if col is None:
+                        raise ValueError(f"Found unknown categories [{value}] in column "
+                                         f"{feature.name} during transform.")
+                    if col >= 0:
+                        encoded[row, col] = 1.
+                continue
+
+            values = np.asarray(columns[feature.name])
+            pos = np.searchsorted(feature.categories, values)
+            np.minimum(pos, feature.categories.size - 1, out=pos)
+            unknown = feature.categories[pos] != values
+            if np.any(unknown):
+                raise ValueError(f"Found unknown categories "
+                                 f"{np.unique(values[unknown]).tolist()} in column "
+                                 f"{feature.name} during transform.")
+            cols = feature.columns[pos]
+            sel = cols >= 0
+            encoded[rows[sel], cols[sel]] = 1.
+
+        for name, col in self._passthrough:
+            encoded[:, col] = np.asarray(columns[name], dtype=np.float64)
+
+        if self.sparse:
+            # Entries absent from a sparse matrix are missing values to XGBoost
+            encoded[encoded == 0.] = np.nan
+
+        return encoded
+
+    def transform_at(self, features: FeaturesType, index: np.ndarray, epochs: np.ndarray,
+                     epoch_feature: str = "epoch", codes: Optional[ConfigCodes] = None) \
+            -> np.ndarray:
+        """ Encode the configurations in `features` selected by `index`, each at the
+        corresponding value in `epochs`. Every configuration is encoded only once, its
+        encoding is then replicated as needed and only the epoch column is varied, which
+        makes this much cheaper than `transform()` for e.g. full learning curves. Any
+        epoch values present in `features` are ignored. `codes` are the codes of the
+        configurations in `features`, see `transform()`. """
+
+        static = self.transform_static(features, epoch_feature, codes)
+        return self.expand(static, index, epochs, epoch_feature)
+
+    def transform_static(self, features: FeaturesType, epoch_feature: str = "epoch",
+                         codes: Optional[ConfigCodes] = None) -> np.ndarray:
+        """ Encode the configurations in `features` once, independent of any epoch, such
+        that the encoding can later be evaluated at any epochs using `expand()`. """
+
+        columns = self._columns(features)
+        columns = {name: columns[name] for name in self.feature_headers
+                   if name != epoch_feature}
+        nconfigs = len(next(iter(columns.values())))
+        columns[epoch_feature] = np.ones(nconfigs)
+        return self.transform(columns, codes)
+
+    def expand(self, static: np.ndarray, index: np.ndarray, epochs: np.ndarray,
+               epoch_feature: str = "epoch") -> np.ndarray:
+        """ Replicate the rows of an encoding generated by `transform_static()` selected
+        by `index`, each at the corresponding value in `epochs`. """
+
+        encoded = static.take(np.asarray(index), axis=0)
+        col = dict(self._passthrough)[epoch_feature]
+        encoded[:, col] = epochs
+        if self.sparse:
+            encoded[encoded[:, col] == 0., col] = np.nan
+
+        return encoded
+
+    def predict_encoded(self, encoded: np.ndarray) -> np.ndarray:
+        """ Generate predictions of shape [n_rows, n_outputs] for inputs that have
+        already been encoded by `transform()`. """
+
+        outputs = []
+        for booster, iteration_range, inverses in zip(
+                self.boosters, self.iteration_ranges, self.target_inverses):
+            ypred = booster.inplace_predict(encoded, iteration_range=iteration_range,
+                                            missing=np.nan)
+            if inverses:
+                ypred = ypred.reshape(-1, 1)
+                for inverse in inverses:
+                    ypred = inverse(ypred).reshape(-1, 1)
+                ypred = ypred.squeeze(axis=1)
+            outputs.append(ypred)
+
+        return np.column_stack(outputs)
+
+    def predict(self, features: FeaturesType) -> np.ndarray:
+        """ Generate predictions of shape [n_rows, n_outputs] for the given raw features.
+        Consult `transform()` for the accepted input formats. """
+
+        return self.predict_encoded(self.transform(features))
+
+    def matches(self, surrogate: XGBSurrogate, features) -> bool:
+        """ Check that the predictions of this compiled model are bit-for-bit identical
+        to those of the original `surrogate` on the given pandas DataFrame of features.
+        """
+
+        expected = surrogate.predict(features).loc[:, list(self.label_headers)]
+        expected = expected.to_numpy()
+        actual = self.predict(features)
+        return expected.dtype == actual.dtype and \
+            np.array_equal(expected, actual, equal_nan=True)
+
+    @property
+    def layout(self) -> tuple:
+        """ A hashable description of the encoded inputs expected by the boosters. Models
+        with equal layouts can share a single encoding of their inputs. """
+
+        onehot = tuple((name, tuple(categories.tolist()), drop)
+                       for name, categories, drop in self.onehot)
+        return self.feature_headers, onehot, self.passthrough, self.sparse
+
+
+class FusedSurrogate:
+    """ Several compiled surrogates, e.g. one per metric, that are queried together. The
+    raw features are encoded only once for all models sharing the same input layout and
+    the encoded matrix is re-used by every booster. Optionally, the boosters are run
+    concurrently in a thread pool, which gives a real speedup since XGBoost releases the
+    GIL during prediction. Large batches are then split into one chunk of rows per
+    thread. All predictions are thread-safe. """
+
+    def __init__(self, models: Mapping[str, CompiledSurrogate],
+                 max_workers: Optional[int] = None,
+                 executor: Optional[ThreadPoolExecutor] = None,
+                 min_rows_per_worker: int = 4096):
+        """
+        :param models: mapping from str to CompiledSurrogate
+            The models to be fused, keyed by an arbitrary name such as the metric they
+            predict. The outputs of all models are concatenated in this order.
+        :param max_workers: int or None
+            When greater than 1, the boosters of batches of at least
+            `min_rows_per_worker` rows are evaluated concurrently using a pool of up to
+            this many threads and batches of at least `2 * min_rows_per_worker` rows are
+            split into up to this many chunks, which are evaluated concurrently.
+            Otherwise, everything is evaluated one after another.
+        :param executor: ThreadPoolExecutor or None
+            The pool of threads used when `max_workers` is greater than 1, e.g. one
+            shared by several fused models. By default, a pool of `max_workers` threads
+            is created when first needed.
+        :param min_rows_per_worker: int
+            The smallest chunk of rows a batch is split into. Smaller batches are not
+            worth the overhead of the thread pool.
+        """
+
+        self.models = dict(models)
+        self.max_workers = max_workers
+        self.min_rows_per_worker = min_rows_per_worker
+        self._executor = executor
+        self._owns_executor = executor is None
+        self._executor_lock = threading.Lock()
+
+        label_headers: List[str] = []
+        self._groups: Dict[tuple, list] = {}
+        for name, model in self.models.items():
+            start = len(label_headers)
+            label_headers += model.label_headers
+            # Remember where each model's outputs go in the fused output array
+            self._groups.setdefault(model.layout, []).append(
+                (name, model, slice(start, len(label_headers))))
+        self.label_headers = tuple(label_headers)
+
+        if len(self._groups) > 1:
+            _log.debug(f"The fused models require {len(self._groups)} different input "
+                       f"encodings.")
+
+    def _map(self, func, *iterables) -> list:
+        if self.max_workers is None or self.max_workers <= 1:
+            return list(map(func, *iterables))
+
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        return list(self._executor.map(func, *iterables))
+
+    def _chunks(self, nrows: int) -> List[slice]:
+        """ Split `nrows` rows into one chunk per worker, unless they are too few. """
+
+        nchunks = min(self.max_workers or 1, nrows // self.min_rows_per_worker)
+        if nchunks <= 1:
+            return [slice(0, nrows)]
+        bounds = np.linspace(0, nrows, nchunks + 1).astype(int).tolist()
+        return [slice(start, stop) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+    def predict(self, features: FeaturesType,
+                models: Optional[Sequence[str]] = None) -> np.ndarray:
+        """ Generate predictions of shape [n_rows, n_outputs] of all the fused models, or
+        only those named in `models`, for the given raw features. Consult
+        `CompiledSurrogate.transform()` for the accepted input formats. """
+
+        return self._predict(lambda m: m.transform(features), models)
+
+    def _predict(self, encode: Callable[[CompiledSurrogate], np.ndarray],
+                 models: Optional[Sequence[str]] = None,
+                 concurrent: bool = True) -> np.ndarray:
+        selected = set(self.models.keys() if models is None else models)
+        tasks = []
+        for group in self._groups.values():
+            group = [g for g in group if g[0] in selected]
+            if not group:
+                continue
+            encoded = encode(group[0][1])
+            tasks += [(name, model, encoded, out) for name, model, out in group]
+
+        if tasks and tasks[0][2].shape[0] < self.min_rows_per_worker:
+            concurrent = False
+        predict = self._map if concurrent else lambda f, t: list(map(f, t))
+        predictions = predict(lambda t: t[1].predict_encoded(t[2]), tasks)
+        if models is not None:
+            # Honour the order in which the models were requested
+            by_name = {t[0]: ypred for t, ypred in zip(tasks, predictions)}
+            return np.column_stack([by_name[name] for name in models])
+
+        outputs = np.empty((predictions[0].shape[0], len(self.label_headers)),
+                           dtype=np.result_type(*predictions))
+        for (_, _, _, out), ypred in zip(tasks, predictions):
+            outputs[:, out] = ypred
+        return outputs
+
+    def predict_at(self, features: FeaturesType, index: np.ndarray, epochs: np.ndarray,
+                   models: Optional[Sequence[str]] = None,
+                   codes: Optional[ConfigCodes] = None) -> np.ndarray:
+        """ Generate predictions of shape [len(index), n_outputs] for the configurations
+        in `features` selected by `index`, each at the corresponding value in `epochs`.
+        Consult `CompiledSurrogate.transform_at()` for details. """
+
+        if len(self._chunks(len(index))) > 1:
+            # Encode the configurations once, only their expansion is split
+            return self.predict_prepared(self.prepare(features, codes=codes), index,
+                                         epochs, models)
+        return self._predict(
+            lambda m: m.transform_at(features, index, epochs, codes=codes), models)
+
+    def prepare(self, features: FeaturesType, codes: Optional[ConfigCodes] = None) \
+            -> Dict[tuple, np.ndarray]:
+        """ Encode the configurations in `features` once for every distinct input layout
+        of the fused models, independent of any epoch. The result can be passed to
+        `predict_prepared()` any number of times, e.g. in order to extend the learning
+        curves of the same configurations step by step. """
+
+        return {layout: group[0][1].transform_static(features, codes=codes)
+                for layout, group in self._groups.items()}
+
+    def predict_prepared(self, prepared: Dict[tuple, np.ndarray], index: np.ndarray,
+                         epochs: np.ndarray, models: Optional[Sequence[str]] = None) \
+            -> np.ndarray:
+        """ Same as `predict_at()`, but for configurations already encoded by
+        `prepare()`. """
+
+        index, epochs = np.asarray(index), np.asarray(epochs)
+        chunks = self._chunks(len(index))
+        if len(chunks) == 1:
+            return self._predict(lambda m: m.expand(prepared[m.layout], index, epochs),
+                                 models)
+
+        # Each chunk evaluates its boosters one after another, the chunks run in parallel
+        return np.concatenate(self._map(lambda rows: self._predict(
+            lambda m: m.expand(prepared[m.layout], index[rows], epochs[rows]), models,
+            concurrent=False), chunks), axis=0)
+
+    def predict_learning_curves(self, features: FeaturesType, epochs: Sequence[int],
+                                models: Optional[Sequence[str]] = None,
+                                max_rows: Optional[int] = 2 ** 20,
+                                codes: Optional[ConfigCodes] = None) -> np.ndarray:
+        """ Predict the learning curves of all configurations in `features` at every
+        epoch in `epochs`, which may be any sparse grid of epochs, e.g.
+        [1, 3, 9, 27, 81, 200]. Returns an array of shape [n_configs, n_epochs,
+        n_outputs]. The configurations are processed in chunks of at most `max_rows`
+        encoded rows in order to bound the memory consumption. """
+
+        grid = np.asarray(epochs)
+        columns = _as_columns(features, next(iter(self.models.values())).feature_headers)
+        nconfigs = len(next(iter(columns.values())))
+        step = nconfigs if max_rows is None else max(1, max_rows // max(grid.size, 1))
+
+        curves = []
+        for start in range(0, nconfigs, step):
+            stop = min(start + step, nconfigs)
+            chunk = {name: np.asarray(v)[start:stop] for name, v in columns.items()}
+            chunk_codes = None if codes is None else ConfigCodes(
+                {k: v[start:stop] for k, v in codes.codes.items()}, codes.choices)
+            index = np.repeat(np.arange(stop - start), grid.size)
+            ypred = self.predict_at(chunk, index, np.tile(grid, stop - start), models,
+                                    codes=chunk_codes)
+            curves.append(ypred.reshape(stop - start, grid.size, -1))
+
+        return np.concatenate(curves, axis=0)
+
+    def close(self):
+        """ Shut down the thread pool, unless it was given to `__init__()`. """
+
+        if self._executor is not None and self._owns_executor:
+            self._executor.shutdown(wait=True)
+            self._executor = None
@@ -0,0 +1,420 @@
+""" A dense, precomputed grid of the surrogate's predictions. Apart from the learning rate
+and the weight decay, the search space is discrete, thus the predictions for every
+combination of the discrete parameters - the lattice - crossed with a grid of values of
+the numerical parameters and a grid of epochs fit into a single tensor. Once computed,
+the tensor is memory mapped and queries are answered by index arithmetic instead of by
+the surrogate models, optionally interpolating multilinearly between the grid points of
+the numerical parameters, on a log scale for log-scaled parameters. A lookup is not free,
+since the configurations still have to be encoded into indices: a single configuration
+takes a few hundred microseconds, but in batches of thousands of configurations each one
+takes only about ten. Exhaustive analyses, e.g. finding the global optimum of a metric,
+become a scan over an array.
+
+A grid is a directory containing the following files:
+    grid.json           The version of the format, the choices of every discrete
+                        parameter, the grid of every numerical parameter, the epochs, the
+                        metrics and how much of the tensor has been computed yet.
+    predictions.npy     The tensor, of shape [n_lattice, *numerical grid sizes, n_epochs,
+                        n_metrics], in C order.
+
+The lattice follows the order of the discrete parameters in `grid.json`, the last
+parameter changing fastest, as in `np.ravel_multi_index()`. The tensor is stored
+uncompressed, which memory mapping requires, but may be stored as float16 to halve its
+size. With the full search space of 2.5 million combinations, a grid of 5 learning
+rates, 5 weight decays and 4 epochs holds 1.77 billion values for 7 metrics, i.e.
+3.5 GB as float16. """
+
+from __future__ import annotations
+
+import json
+import logging
+import time
+from pathlib import Path
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple, Union, TYPE_CHECKING
+
+import numpy as np
+import pandas as pd
+
+from jahs_bench.lib.core.encoding import ConfigEncoder, ConfigsType, \
+    joint_config_encoder
+
+if TYPE_CHECKING:
+    from jahs_bench.api import Benchmark
+    from jahs_bench.lib.core.columnar import MmapModeType
+
+_log = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+MANIFEST_NAME = "grid.json"
+DATA_NAME = "predictions.npy"
+# Batches up to this size are looked up without pandas
+_SMALL_BATCH = 64
+
+
+def _write_manifest(path: Path, manifest: dict):
+    tmp = path / (MANIFEST_NAME + ".tmp")
+    with open(tmp, "w") as fp:
+        json.dump(manifest, fp, indent=2)
+    tmp.replace(path / MANIFEST_NAME)
+
+
+class PredictionGrid:
+    """ A memory mapped grid of predictions, see the module's documentation. Use
+    `PredictionGrid.build()` to compute a grid and `PredictionGrid(path)` to open one. """
+
+    def __init__(self, path: Union[str, Path], mmap_mode: MmapModeType = "r",
+                 encoder: ConfigEncoder = joint_config_encoder):
+        """
+        :param path: Path-like
+            The directory containing the grid.
+        :param mmap_mode: str
+            The mode in which the tensor is memory mapped, consult `np.load()`.
+        :param encoder: ConfigEncoder
+            Used to read configurations given in any of the formats supported by
+            `ConfigEncoder.columns()`.
+        """
+
+        self.path = Path(path)
+        self.encoder = encoder
+        with open(self.path / MANIFEST_NAME) as fp:
+            manifest = json.load(fp)
+        if manifest["version"] != FORMAT_VERSION:
+            raise RuntimeError(f"Unsupported version {manifest['version']} of the "
+                               f"prediction grid at {self.path}.")
+
+        self.choices: Dict[str, tuple] = {p: tuple(c)
+                                          for p, c in manifest["choices"].items()}
+        self.parameters: Tuple[str, ...] = tuple(self.choices)
+        self.grids: Dict[str, np.ndarray] = {a: np.asarray(g, dtype=np.float64)
+                                             for a, g in manifest["grids"].items()}
+        self.axes: Tuple[str, ...] = tuple(self.grids)
+        self.log: Dict[str, bool] = manifest["log"]
+        self.epochs = np.asarray(manifest["epochs"], dtype=int)
+        self.metrics: Tuple[str, ...] = tuple(manifest["metrics"])
+        self.complete: int = manifest["complete"]
+
+        self.data: np.ndarray = np.load(self.path / DATA_NAME, mmap_mode=mmap_mode)
+        self.n_lattice = self.data.shape[0]
+        # A view of the tensor with one row per grid point and epoch
+        self._rows = self.data.reshape(-1, len(self.metrics))
+
+        self._sizes = tuple(len(c) for c in self.choices.values())
+        self._values = {p: np.asarray(c) for p, c in self.choices.items()}
+        self._indexes = {p: pd.Index(c) for p, c in self.choices.items()}
+        self._lookups = {p: {v: i for i, v in enumerate(c)}
+                         for p, c in self.choices.items()}
+        self._coords = {a: np.log(g) if self.log[a] else g for a, g in self.grids.items()}
+        self._epoch_lookup = {e: i for i, e in enumerate(self.epochs.tolist())}
+
+        if self.complete < self.n_lattice:
+            _log.warning(f"Only {self.complete} of the {self.n_lattice} lattice points "
+                         f"of the prediction grid at {self.path} have been computed yet.")
+
+    @property
+    def nbytes(self) -> int:
+        return self.data.nbytes
+
+    @classmethod
+    def build(cls, benchmark: Benchmark, path: Union[str, Path],
+              grids: Mapping[str, Sequence[float]], epochs: Sequence[int],
+              choices: Optional[Mapping[str, Sequence]] = None, dtype="float32",
+              chunk_size: int = 1 << 16, encoder: ConfigEncoder = joint_config_encoder) \
+            -> PredictionGrid:
+        """
+        Compute the predictions of `benchmark` on a grid and save it to `path`. The
+        computation proceeds in chunks of the lattice and an interrupted build is resumed
+        if `build()` is called again with the same arguments.
+
+        :param benchmark: Benchmark
+            Usually a surrogate benchmark. Its metrics are stored in the order of
+            `Benchmark.metrics`.
+        :param path: Path-like
+            The directory that the grid is saved to.
+        :param grids: mapping of str to sequence of floats
+            The values of each numerical parameter of the search space, i.e. the learning
+            rate and the weight decay, at which the predictions are computed.
+        :param epochs: sequence of ints
+            The epochs at which the predictions are computed.
+        :param choices: optional mapping of str to sequence
+            Restricts the lattice to these values of some of the discrete parameters,
+            e.g. {"Resolution": [1.0]}. By default, the lattice contains every value of
+            every discrete parameter.
+        :param dtype: NumPy dtype
+            The dtype of the stored predictions, e.g. "float16" to halve the size.
+        :param chunk_size: int
+            The number of configurations queried at once.
+        :param encoder: ConfigEncoder
+            Defines the search space.
+        """
+
+        path = Path(path)
+        choices = dict(choices or {})
+        unknown = set(choices).difference(encoder.choices)
+        if unknown:
+            raise ValueError(f"Only the choices of the discrete parameters "
+                             f"{list(encoder.choices)} can be restricted, not of "
+                             f"{sorted(unknown)}.")
+        numerical = [n for n in encoder.names if n not in encoder.choices]
+        if set(grids) != set(numerical):
+            raise ValueError(f"A grid must be given for exactly the numerical parameters "
+                             f"{numerical}, but was given for {sorted(grids)}.")
+
+        lattice = {p: list(choices.get(p, c)) for p, c in encoder.choices.items()}
+        for p, values in lattice.items():
+            if not values or any(v not in encoder.choices[p] for v in values):
+                raise ValueError(f"Invalid choices {values} of the parameter {p}, must "
+                                 f"be a non-empty subset of {list(encoder.choices[p])}.")
+            # E.g. 1.0 instead of 1
+            known = encoder.choices[p]
+            lattice[p] = [known[known.index(v)] for v in values]
+        axes = {a: sorted(float(v) for v in grids[a]) for a in numerical}
+        for a, values in axes.items():
+            hp = encoder.config_space.get_hyperparameter(a)
+            if not values or values[0] < hp.lower or values[-1] > hp.upper or \
+                    len(set(values)) != len(values):
+                raise ValueError(f"The grid {values} of the parameter {a} must consist "
+                                 f"of unique values within [{hp.lower}, {hp.upper}].")
+
+        manifest: dict = {
+            "version": FORMAT_VERSION,
+            "choices": lattice,
+            "grids": axes,
+            "log": {a: bool(encoder.config_space.get_hyperparameter(a).log)
+                    for a in numerical},
+            "epochs": [int(e) for e in epochs],
+            "metrics": list(benchmark.metrics),
+            "dtype": np.dtype(dtype).name,
+            "complete": 0,
+        }
+        n_lattice = int(np.prod([len(c) for c in lattice.values()]))
+        shape = (n_lattice, *(len(g) for g in axes.values()), len(manifest["epochs"]),
+                 len(manifest["metrics"]))
+
+        data = None
+        if (path / MANIFEST_NAME).exists() and (path / DATA_NAME).exists():
+            with open(path / MANIFEST_NAME) as fp:
+                existing = json.load(fp)
+            if {**existing, "complete": 0} == manifest:
+                manifest["complete"] = existing["complete"]
+                data = np.load(path / DATA_NAME, mmap_mode="r+")
+                _log.info(f"Resuming the build of the prediction grid at {path} from "
+                          f"lattice point {manifest['complete']} of {n_lattice}.")
+        if data is None:
+            path.mkdir(parents=True, exist_ok=True)
+            _log.info(f"Building a prediction grid of shape {shape} at {path}, which "
+                      f"takes {np.prod(shape) * np.dtype(dtype).itemsize / 2 ** 30:.2f} "
+                      f"GiB.")
+            data = np.lib.format.open_memmap(path / DATA_NAME, mode="w+", dtype=dtype,
+                                             shape=shape)
+            _write_manifest(path, manifest)
+
+        arrays = {p: np.asarray(c) for p, c in lattice.items()}
+        sizes = tuple(len(c) for c in lattice.values())
+        points = int(np.prod(shape[1:-2]))
+        step = max(1, chunk_size // points)
+        # The values of the numerical parameters at every point of their grids, with the
+        # last parameter changing fastest
+        mesh = [m.reshape(-1) for m in np.meshgrid(*axes.values(), indexing="ij")]
+
+        start_time = time.monotonic()
+        first = manifest["complete"]
+        for start in range(first, n_lattice, step):
+            stop = min(start + step, n_lattice)
+            codes = np.unravel_index(np.arange(start, stop), sizes)
+            configs = {p: np.repeat(arrays[p][c], points)
+                       for p, c in zip(lattice, codes)}
+            configs.update({a: np.tile(m, stop - start) for a, m in zip(axes, mesh)})
+            curves = benchmark.learning_curves(configs, epochs=manifest["epochs"])
+            data[start:stop] = curves.reshape(stop - start, *shape[1:])
+
+            data.flush()
+            manifest["complete"] = stop
+            _write_manifest(path, manifest)
+            elapsed = time.monotonic() - start_time
+            remaining = elapsed / (stop - first) * (n_lattice - stop)
+            _log.info(f"Computed {stop} of {n_lattice} lattice points, about "
+                      f"{remaining:.0f} seconds remaining.")
+
+        del data
+        return cls(path, encoder=encoder)
+
+    def _lattice_index(self, columns: Dict[str, np.ndarray]) -> np.ndarray:
+        codes = []
+        for p in self.parameters:
+            values = np.asarray(columns[p])
+            if values.size <= _SMALL_BATCH:
+                # Hashing a few values is much cheaper than building a pandas indexer
+                code = np.fromiter((self._lookups[p].get(v, -1) for v in values.tolist()),
+                                   dtype=np.intp, count=values.size)
+            else:
+                code = self._indexes[p].get_indexer(values)
+            unmatched = np.flatnonzero(code < 0)
+            if unmatched.size:
+                # Fall back to Python's notion of equality, e.g. 1 == True
+                code[unmatched] = [self._lookups[p].get(v, -1)
+                                   for v in values[unmatched].tolist()]
+                if np.any(code < 0):
+                    raise ValueError(f"Found values {np.unique(values[code < 0])} of the "
+                                     f"parameter {p} that are not part of the grid, "
+                                     f"which contains {list(self.choices[p])}.")
+            codes.append(code)
+        return np.asarray(np.ravel_multi_index(codes, self._sizes))
+
+    def _locate(self, axis: str, values: np.ndarray, interpolate: bool) \
+            -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """ The indices of the grid points of `axis` below and above each value and the
+        weight of the one above. Without interpolation, each value must lie on the
+        grid. """
+
+        grid = self._coords[axis]
+        x = np.asarray(values, dtype=np.float64)
+        x = np.log(x) if self.log[axis] else x
+        tol = 1e-9 * max(1., float(np.max(np.abs(grid))))
+
+        if not interpolate or grid.size == 1:
+            upper = np.clip(np.searchsorted(grid, x), 1, max(grid.size - 1, 1))
+            lower = upper - 1
+            nearest = np.where(np.abs(grid[lower] - x) <= np.abs(grid[upper] - x),
+                               lower, upper) if grid.size > 1 else np.zeros_like(upper)
+            off = np.abs(grid[nearest] - x) > tol
+            if np.any(off):
+                raise ValueError(f"Found values {np.unique(values[off])[:5]} of the "
+                                 f"parameter {axis} that do not lie on its grid "
+                                 f"{self.grids[axis].tolist()}. Use interpolate=True to "
+                                 f"interpolate between the grid points.")
+            return nearest, nearest, np.zeros(x.shape)
+
+        outside = (x < grid[0] - tol) | (x > grid[-1] + tol)
+        if np.any(outside):
+            raise ValueError(f"Found values {np.unique(values[outside])[:5]} of the "
+                             f"parameter {axis} outside of its grid "
+                             f"[{self.grids[axis][0]}, {self.grids[axis][-1]}], which "
+                             f"cannot be interpolated.")
+        lower = np.clip(np.searchsorted(grid, x, side="right") - 1, 0, grid.size - 2)
+        weight = np.clip((x - grid[lower]) / (grid[lower + 1] - grid[lower]), 0., 1.)
+        return lower, lower + 1, weight
+
+    def query(self, configs: ConfigsType,
+              nepochs: Union[int, Sequence[int], np.ndarray] = 200,
+              interpolate: bool = False) -> np.ndarray:
+        """
+        Look up the predictions for a batch of configurations.
+
+        :param configs: sequence of dicts, pandas DataFrame, NumPy array or mapping
+            The configurations, in any format supported by `ConfigEncoder.columns()`.
+            Their discrete parameters must be part of the lattice.
+        :param nepochs: int or sequence of ints
+            The epoch to query, either for all configurations or for each of them. Must
+            be one of the epochs of the grid.
+        :param interpolate: bool
+            When False, the numerical parameters must lie on their grids. When True, the
+            predictions are interpolated multilinearly between the surrounding grid
+            points, on a log scale for log-scaled parameters.
+        :return: NumPy array
+            The predictions, of shape [n_configs, n_metrics], in the order of `metrics`.
+        """
+
+        columns = self.encoder.columns(configs)
+        n = len(columns[self.encoder.names[0]])
+        epochs = np.broadcast_to(np.asarray(nepochs, dtype=int), (n,))
+        try:
+            epoch_idx = np.fromiter((self._epoch_lookup[e] for e in epochs.tolist()),
+                                    dtype=np.intp, count=n)
+        except KeyError as e:
+            raise ValueError(f"The epoch {e.args[0]} is not part of the grid, which "
+                             f"contains the epochs {self.epochs.tolist()}.") from e
+
+        lattice = self._lattice_index(columns)
+        if np.any(lattice >= self.complete):
+            raise RuntimeError(f"The predictions of some of the configurations have not "
+                               f"been computed yet, the build of the grid at {self.path} "
+                               f"is incomplete.")
+
+        # Each query reads a single grid point or, when interpolating, the 2^d corners of
+        # the surrounding cell of the grid, given by their flat indices and weights
+        corners: List[Tuple[np.ndarray, np.ndarray]] = [(lattice, np.ones(n))]
+        for axis in self.axes:
+            size = self.grids[axis].size
+            lower, upper, weight = self._locate(axis, columns[axis], interpolate)
+            if interpolate:
+                corners = [c for index, w in corners
+                           for c in ((index * size + lower, w * (1. - weight)),
+                                     (index * size + upper, w * weight))]
+            else:
+                corners = [(index * size + lower, w) for index, w in corners]
+
+        if not interpolate:
+            index = corners[0][0]
+            return self._rows[index * self.epochs.size + epoch_idx].astype(np.float64)
+
+        outputs = np.zeros((n, len(self.metrics)), dtype=np.float64)
+        for index, w in corners:
+            outputs += w[:, None] * self._rows[index * self.epochs.size + epoch_idx]
+        return outputs
+
+    def __call__(self, config: dict, nepochs: int = 200, interpolate: bool = False) \
+            -> dict:
+        """ Look up a single configuration, in the format of `Benchmark.__call__()`. """
+
+        outputs = self.query([config], nepochs, interpolate)[0]
+        return {nepochs: dict(zip(self.metrics, outputs.tolist()))}
+
+    def values(self, metric: str, nepochs: int) -> np.ndarray:
+        """ A memory mapped view of the predictions of `metric` at `nepochs` epochs, of
+        shape [n_lattice, *grid sizes], e.g. for computing rank statistics. """
+
+        return self.data[..., self._epoch(nepochs), self._metric(metric)]
+
+    def configs(self, index: np.ndarray) -> Dict[str, np.ndarray]:
+        """ The configurations at the given flat indices into `values()`, in the format
+        of `ConfigEncoder.columns()`. """
+
+        shape = (self.n_lattice, *(g.size for g in self.grids.values()))
+        codes = np.unravel_index(np.asarray(index), shape)
+        lattice = np.unravel_index(codes[0], self._sizes)
+        columns = {p: self._values[p][c] for p, c in zip(self.parameters, lattice)}
+        columns.update({a: self.grids[a][c] for a, c in zip(self.axes, codes[1:])})
+        return {name: columns[name] for name in self.encoder.names}
+
+    def best(self, metric: str, nepochs: int = 200, k: int = 10, mode: str = "max",
+             chunk_size: int = 1 << 22) -> pd.DataFrame:
+        """ Exhaustively search the grid for the `k` best configurations w.r.t. `metric`
+        at `nepochs` epochs, reading the tensor in chunks of `chunk_size` values. Returns
+        a DataFrame of the configurations and their values, best first. """
+
+        if mode not in ("max", "min"):
+            raise ValueError(f"Invalid value of parameter 'mode': '{mode}'. Must be one "
+                             f"of 'max' or 'min'.")
+        values = self.values(metric, nepochs)[:self.complete]
+        values = values.reshape(values.shape[0], -1)
+        sign = -1. if mode == "max" else 1.
+        step = max(1, chunk_size // values.shape[1])
+
+        best_index, best_values = np.empty(0, dtype=np.intp), np.empty(0)
+        for start in range(0, values.shape[0], step):
+            chunk = sign * np.asarray(values[start:start + step], dtype=np.float64)
+            chunk = chunk.reshape(-1)
+            top = np.argpartition(chunk, k - 1)[:k] if chunk.size > k \
+                else np.arange(chunk.size)
+            best_index = np.concatenate([best_index, top + start * values.shape[1]])
+            best_values = np.concatenate([best_values, chunk[top]])
+            keep = np.argsort(best_values, kind="stable")[:k]
+            best_index, best_values = best_index[keep], best_values[keep]
+
+        result = pd.DataFrame(self.configs(best_index))
+        result[metric] = sign * best_values
+        return result
+
+    def _epoch(self, nepochs: int) -> int:
+        try:
+            return self._epoch_lookup[int(nepochs)]
+        except KeyError as e:
+            raise ValueError(f"The epoch {nepochs} is not part of the grid, which "
+                             f"contains the epochs {self.epochs.tolist()}.") from e
+
+    def _metric(self, metric: str) -> int:
+        try:
+            return self.metrics.index(metric)
+        except ValueError as e:
+            raise ValueError(f"Unknown metric {metric}, must be one of "
+                             f"{list(self.metrics)}.") from e
@@ -12,6 +12,7 @@ import numpy as np
 import pandas as pd
 import scipy.stats
 import sklearn
+import sklearn.base
 import sklearn.compose
 import sklearn.metrics
 import sklearn.model_selection
@@ -22,7 +23,9 @@ import xgboost as xgb
 import yacs.config as config
 from jahs_bench.lib.core import utils as core_utils
 from jahs_bench.lib.core.configspace import joint_config_space
+from jahs_bench.lib.core.encoding import joint_config_encoder
 from jahs_bench.surrogate import utils as surrogate_utils, config
+from jahs_bench.surrogate.compiled import CompiledSurrogate
 
 _log = logging.getLogger(__name__)
 ConfigType = Union[dict, ConfigSpace.Configuration]
@@ -37,13 +40,14 @@ class XGBSurrogate:
     label_headers: Optional[pd.Index]
     feature_headers: Optional[pd.Series]
     trained_: bool
+    best_iteration_: Optional[int]
 
     __params_filename = "params.pkl.gz"
     __headers_filename = "label_headers.pkl.gz"
     __model_filename = "model.pkl.gz"
     __param_keys = ["estimators_per_output", "hyperparams", "config_space",
                     "label_headers", "feature_headers",
-                    "trained_"]
+                    "trained_", "best_iteration_"]
     __objective = "reg:squarederror"
 
     _hpo_search_space = {
@@ -99,29 +103,33 @@ class XGBSurrogate:
     def __init__(self, config_space: Optional[
         ConfigSpace.ConfigurationSpace] = joint_config_space,
                  estimators_per_output: int = 500, use_gpu: Optional[bool] = None,
-                 hyperparams: dict = None):
+                 hyperparams: Optional[dict] = None, n_jobs: int = 1):
         """
         Initialize the internal parameters needed for the surrogate to understand the
         data it is dealing with.
         :param config_space: ConfigSpace.ConfigurationSpace
             A config space to describe what each model config looks like.
         :param estimators_per_output: int
-            The number of trees that each XGB forest should boost. Experimental, will
-            probably be removed in favour of a dynamic approach soon.
+            The number of trees that each XGB forest should boost. When early stopping
+            is used during training, this is the maximum number of trees.
         :param use_gpu: bool
             A flag to ensure that a GPU is used for model training. If False (default),
             the decision is left up to XGBoost itself, which in turn depends on being
             able to detect a GPU.
+        :param n_jobs: int
+            The number of threads used by XGBoost for training.
         """
 
         self.config_space = config_space
         self.estimators_per_output = estimators_per_output
         self.hyperparams = hyperparams
         self.use_gpu = use_gpu
+        self.n_jobs = n_jobs
         self.model = None
         self.feature_headers = None
         self.label_headers = None
         self.trained_ = False
+        self.best_iteration_ = None
 
         # Both initializes some internal attributes as well as performs a sanity test
         if self.hyperparams is None:
@@ -203,8 +211,9 @@ class XGBSurrogate:
 
         prep_pipe = self.preprocessing_pipeline
         xgboost_estimator = xgb.sklearn.XGBRegressor(
-            n_estimators=500, tree_method="gpu_hist" if self.use_gpu else "auto",
-            n_jobs=1, **self.hyperparams)
+            n_estimators=self.estimators_per_output,
+            tree_method="gpu_hist" if self.use_gpu else "auto",
+            n_jobs=self.n_jobs, **self.hyperparams)
 
         if multiout:
             multi_regressor = sklearn.multioutput.MultiOutputRegressor(
@@ -241,8 +250,9 @@ class XGBSurrogate:
         # Build input preprocessing pipeline and bare-bones XGBoost estimator
         prep_pipe = self.preprocessing_pipeline
         xgboost_estimator = xgb.sklearn.XGBRegressor(
-            n_estimators=500, tree_method="gpu_hist" if self.use_gpu else "auto",
-            n_jobs=1, **self.hyperparams)
+            n_estimators=self.estimators_per_output,
+            tree_method="gpu_hist" if self.use_gpu else "auto",
+            n_jobs=self.n_jobs, **self.hyperparams)
 
         # Target processing pipeline steps
         target_config = pipeline_config.target_config
@@ -366,7 +376,11 @@ class XGBSurrogate:
             ytest = labels.iloc[idx_test]
             strata = strata.iloc[idx_train] if stratify else strata
 
-        cv = splitter_type(n_splits=num_cv_splits, random_state=random_state)
+        if splitter_type is sklearn.model_selection.GroupKFold:
+            # GroupKFold is deterministic and does not accept a random state
+            cv = splitter_type(n_splits=num_cv_splits)
+        else:
+            cv = splitter_type(n_splits=num_cv_splits, random_state=random_state)
 
         _log.info("Dataset splits successfully generated.")
         return xtrain, xtest, ytrain, ytest, groups, strata, cv
@@ -376,7 +390,9 @@ class XGBSurrogate:
     #  of each)
     def fit(self, features: pd.DataFrame, labels: pd.DataFrame,
             random_state: np.random.RandomState = None,
-            pipeline_config: Optional[config.CfgNode] = None):
+            pipeline_config: Optional[config.CfgNode] = None,
+            early_stopping_rounds: Optional[int] = None,
+            groups: Optional[pd.DataFrame] = None, valid_fraction: float = 0.1):
         """
         Pre-process the given dataset, fit an XGBoost model on it and return the training
         errors.
@@ -391,6 +407,19 @@ class XGBSurrogate:
         :param pipeline_config: ConfigNode or None
             A configuration object specifying how to build the training pipeline. Consult
             `XGBSurrogate._build_pipeline()` and `surrogate.constants` for more details.
+        :param early_stopping_rounds: int or None
+            If given, a validation split of roughly `valid_fraction` of the data is held
+            out and boosting stops once the validation error has not improved for this
+            many rounds, up to at most `estimators_per_output` rounds. The stored
+            booster is then truncated to the best iteration, which is also recorded in
+            `best_iteration_`. Only supported for a single label.
+        :param groups: DataFrame or None
+            Consult `prepare_dataset_for_training()`. Rows of the same group are never
+            split between the training and the validation split. If None, all rows with
+            the same features apart from the epoch are treated as one group. Only used
+            for early stopping.
+        :param valid_fraction: float
+            The approximate fraction of the data held out for early stopping.
         :return:
         """
 
@@ -406,18 +435,31 @@ class XGBSurrogate:
         else:
             labels = labels.loc[:, self.label_headers]
 
-        # TODO: Implement early stopping to determine correct final value for
-        #  n_estimators - NASLib used a fixed value of 500, so this procedure may or may
-        #  not be useful and certainly needs a reference. This is a method to prevent
-        #  overfitting, analogous to cutting off NN training after a certain number of
-        #  epochs.
-
         num_regressands = labels.columns.size
         pipeline = self._get_simple_pipeline(multiout=num_regressands > 1) \
             if not pipeline_config else self._build_pipeline(pipeline_config)
 
-        self.model = pipeline.fit(features, labels)
+        fit_params = {}
+        if early_stopping_rounds is not None:
+            if num_regressands > 1:
+                raise ValueError(f"Early stopping is only supported for a single label, "
+                                 f"was given {num_regressands} labels.")
+            if groups is None:
+                groups = surrogate_utils.config_groups(features)
+            *_, cv = self.prepare_dataset_for_training(
+                features, labels, groups=groups, random_state=random_state,
+                num_cv_splits=max(2, round(1 / valid_fraction)), stratify=False)
+            idx_train, idx_valid = next(cv.split(features, groups=groups))
+            xvalid, yvalid = features.iloc[idx_valid], labels.iloc[idx_valid]
+            features, labels = features.iloc[idx_train], labels.iloc[idx_train]
+            fit_params = self._early_stopping_params(
+                pipeline, features, labels, xvalid, yvalid, early_stopping_rounds)
+
+        self.model = pipeline.fit(features, labels, **fit_params)
         self.trained_ = True
+        if early_stopping_rounds is not None:
+            best_iteration = self._truncate_to_best_iteration()
+            self.best_iteration_ = best_iteration
 
         ypred_train = self.predict(features)
         train_r2 = sklearn.metrics.r2_score(labels, ypred_train)
@@ -427,8 +469,64 @@ class XGBSurrogate:
             "train_mse": train_mse,
         }
 
+        if early_stopping_rounds is not None:
+            ypred_valid = self.predict(xvalid)
+            scores["valid_r2"] = sklearn.metrics.r2_score(yvalid, ypred_valid)
+            scores["valid_mse"] = sklearn.metrics.mean_squared_error(yvalid, ypred_valid)
+            scores["best_iteration"] = best_iteration
+            _log.info(f"Early stopping kept {best_iteration + 1} of at most "
+                      f"{self.estimators_per_output} boosting rounds.")
+
         return scores
 
+    @staticmethod
+    def _early_stopping_params(pipeline: sklearn.pipeline.Pipeline,
+                               xtrain: pd.DataFrame, ytrain: pd.DataFrame,
+                               xvalid: pd.DataFrame, yvalid: pd.DataFrame,
+                               early_stopping_rounds: int) -> dict:
+        """ Enable early stopping on the XGBoost estimator at the end of the given, not
+        yet fitted, pipeline and return the fit parameters that pass the validation data
+        to it. Since XGBoost only sees encoded inputs and transformed targets, the
+        validation data is encoded and transformed exactly like the pipeline is going
+        to encode and transform the training data. """
+
+        xvalid = sklearn.base.clone(pipeline.steps[0][1]).fit(xtrain).transform(xvalid)
+        ytrain = ytrain.to_numpy(dtype=float)
+        # The target transforms, e.g. a MinMax scaling followed by an inverse sigmoid, are
+        # only defined on the range of the training targets, which also bounds the
+        # predictions of the pipeline.
+        yvalid = np.clip(yvalid.to_numpy(dtype=float), ytrain.min(axis=0),
+                         ytrain.max(axis=0))
+
+        name, estimator = pipeline.steps[-1]
+        while isinstance(estimator, sklearn.compose.TransformedTargetRegressor):
+            transformer = sklearn.base.clone(estimator.transformer).fit(ytrain)
+            ytrain = transformer.transform(ytrain)
+            yvalid = transformer.transform(yvalid)
+            estimator = estimator.regressor
+
+        estimator.set_params(early_stopping_rounds=early_stopping_rounds)
+        return {f"{name}__eval_set": [(xvalid, yvalid.squeeze(axis=1))],
+                f"{name}__verbose": False}
+
+    def _truncate_to_best_iteration(self) -> int:
+        """ Drop the trees boosted after the best iteration found by early stopping
+        from the fitted XGBoost estimator and return the best iteration. """
+
+        assert self.model is not None
+        estimator = self.model.steps[-1][1]
+        while isinstance(estimator, sklearn.compose.TransformedTargetRegressor):
+            estimator = estimator.regressor_
+
+        booster = estimator.get_booster()
+        best_iteration = estimator.best_iteration
+        truncated = booster[:best_iteration + 1]
+        # Keeps "best_iteration", which XGBoost and `CompiledSurrogate` rely on
+        truncated.set_attr(**booster.attributes())
+        estimator._Booster = truncated
+        estimator.set_params(n_estimators=best_iteration + 1)
+        return best_iteration
+
     def predict(self, features: pd.DataFrame) -> pd.DataFrame:
         """ Given some input data, generate model predictions. The input data will be
         properly encoded when this function is called. """
@@ -438,6 +536,37 @@ class XGBSurrogate:
         ypredict = pd.DataFrame(ypredict, columns=self.label_headers)
         return ypredict
 
+    def compile(self) -> CompiledSurrogate:
+        """ Extract a pandas- and sklearn-free representation of this trained surrogate
+        that generates identical predictions at a fraction of the per-call overhead.
+        Consult `jahs_bench.surrogate.compiled` for details. """
+
+        return CompiledSurrogate.from_surrogate(self)
+
+    def save_compiled(self, outdir: Path, features: Optional[pd.DataFrame] = None,
+                      nsamples: int = 1000, seed: Optional[int] = None) \
+            -> CompiledSurrogate:
+        """ Compile this trained surrogate and save the compiled model to `outdir`, see
+        `CompiledSurrogate.save()`, but only after verifying that it reproduces the
+        predictions of this surrogate bit-for-bit on `features`, by default `nsamples`
+        random configurations at random epochs. Otherwise, any compiled model saved to
+        `outdir` before is removed, such that the pickled pipeline is used instead, and
+        a RuntimeError is raised. Returns the compiled model. """
+
+        if features is None:
+            random_state = np.random.RandomState(seed)
+            features = pd.DataFrame(joint_config_encoder.sample(nsamples, random_state))
+            features.loc[:, "epoch"] = random_state.randint(1, 201, size=nsamples)
+
+        compiled = self.compile()
+        if not compiled.matches(self, features):
+            CompiledSurrogate.remove(outdir)
+            raise RuntimeError(f"The compiled surrogate does not reproduce the "
+                               f"predictions of the original pipeline, it was not saved "
+                               f"to {outdir}.")
+        compiled.save(outdir)
+        return compiled
+
     def dump(self, outdir: Path, protocol: int = 0):
         """ Save a trained surrogate to disk so that it can be loaded up later. """
 
@@ -2,7 +2,7 @@ import functools
 import logging
 from enum import Enum
 from pathlib import Path
-from typing import Callable, Optional, Sequence
+from typing import Callable, Optional, Sequence, Tuple, Union
 
 import numpy as np
 import pandas as pd
@@ -14,6 +14,12 @@ from jahs_bench.surrogate import loss
 
 _log = logging.getLogger(__name__)
 
+# Matches the number of trees of the pipelines built by XGBSurrogate
+NUM_BOOST_ROUND = 500
+# The fidelities of successive halving: a fraction of the rows, of the boosting rounds, or
+# of both
+FIDELITIES = ("rows", "rounds", "both")
+
 
 def custom_loss_function(loss_params: config.CfgNode) -> Callable:
     """ Given a configuration, construct a custom loss function. """
@@ -203,3 +209,40 @@ def adjust_dataset(datapth: Path, outputs: Optional[Sequence[str]] = None,
             labels.fillna(fillvals, inplace=True)
 
     return features, labels, groups, strata
+
+
+def config_groups(features: pd.DataFrame, epoch_feature: str = "epoch") -> pd.Series:
+    """ Assign the same integer group to all rows of `features` that describe the same
+    model config, i.e. that only differ in the epoch. A substitute for the column
+    "model_ID" of the performance data, for data that does not have it. """
+
+    columns = features.columns.drop(epoch_feature, errors="ignore").tolist()
+    return features.groupby(columns, sort=False).ngroup()
+
+
+def subsample_groups(groups: Union[pd.Series, pd.DataFrame, np.ndarray], fraction: float,
+                     seed: int = 0) -> np.ndarray:
+    """ Select all the rows of a random subset of `fraction` of the groups, such that the
+    trajectories of the selected model configs remain intact. Returns a boolean mask
+    over the rows. For a fixed seed, the subset of a smaller fraction is always contained
+    in that of a larger fraction. """
+
+    if not 0. < fraction <= 1.:
+        raise ValueError(f"The fraction of groups must be in the range (0, 1], was "
+                         f"given {fraction}.")
+    codes, uniques = pd.factorize(np.asarray(groups).ravel())
+    rank = np.random.RandomState(seed).permutation(uniques.size)
+    return rank[codes] < int(np.ceil(fraction * uniques.size))
+
+
+def budget_scaling(budget: float, fidelity: str = "rows") -> Tuple[float, int]:
+    """ The fraction of the training rows and the number of boosting rounds used for
+    training a model at the given budget in (0, 1]. """
+
+    if fidelity not in FIDELITIES:
+        raise ValueError(f"The fidelity must be one of {FIDELITIES}, was given "
+                         f"{fidelity}.")
+    fraction = budget if fidelity in ("rows", "both") else 1.
+    rounds = NUM_BOOST_ROUND if fidelity == "rows" else \
+        max(1, int(round(budget * NUM_BOOST_ROUND)))
+    return fraction, rounds
@@ -11,6 +11,8 @@ import yaml
 from typing import Sequence, Iterator, Dict, Tuple, Optional
 from numpy import inf
 
+from jahs_bench.surrogate.model import XGBSurrogate
+
 _log = logging.getLogger(__name__)
 
 def get_loss(config_dir: Path) -> float:
@@ -76,23 +78,28 @@ def identify_best_configs(root_dir: Path, common_suffix_dirs: Optional[
 
     return best_configs
 
-def assemble_surrogate(best_configs: Dict[str, Tuple[Path, float]], final_dir: Path) \
-        -> Path:
+def assemble_surrogate(best_configs: Dict[str, Tuple[Path, float]], final_dir: Path,
+                       native: bool = False) -> Path:
     """ Given a mapping from metric names to a tuple containing the path to the best
     configuration and its loss for that metric, copies all the models into the new
     directory tree that can be used by the JAHS-Bench-201 public API to load a surrogate
-    model. The path to this directory is returned. """
+    model. When 'native' is True, each model is additionally exported in the native
+    format of XGBoost along with a JSON manifest, which the API loads considerably faster
+    than the pickled sklearn pipelines, once its predictions have been verified. The
+    path to this directory is returned. """
 
     final_dir.mkdir(exist_ok=True, parents=False)
     for metric, (config_dir, loss) in best_configs.items():
         model_dir = config_dir / "xgb_model"
         pth: Path = shutil.copytree(model_dir, final_dir / metric)
+        if native:
+            XGBSurrogate.load(pth).save_compiled(pth)
         _log.info(f"Inserted best configuration for metric '{metric}' at {pth}")
 
     return final_dir
 
 def main(final_dir: Path, root_dir: Path, max_configs: Optional[int] = None,
-         common_suffix_dirs: Optional[Sequence[str]] = None):
+         common_suffix_dirs: Optional[Sequence[str]] = None, native: bool = False):
     """ Executes the main program control. """
 
     assert root_dir.exists() and root_dir.is_dir()
@@ -101,7 +108,7 @@ def main(final_dir: Path, root_dir: Path, max_configs: Optional[int] = None,
     best_configs = identify_best_configs(root_dir, common_suffix_dirs, max_configs)
 
     _log.info(f"Assembling the individual models into one directory at {final_dir}.")
-    final_model_dir = assemble_surrogate(best_configs, final_dir)
+    final_model_dir = assemble_surrogate(best_configs, final_dir, native=native)
 
     _log.info(f"Assembled the final model at: {final_model_dir}")
 
@@ -121,6 +128,9 @@ def parse_cli():
                              "best performing config. When given, only the first "
                              "'max-configs' configs are considered, otherwise all "
                              "available configs are considered.")
+    parser.add_argument("--native", action="store_true",
+                        help="When given, each model is also exported in the native "
+                             "format of XGBoost, which the public API loads faster.")
     parser.add_argument("--common_suffix_dirs", type=str, default=None,
                         nargs=argparse.REMAINDER,
                         help="An optional sequence of strings defining further "
@@ -5,9 +5,8 @@ from typing import Optional, Sequence
 import yaml
 
 import pandas as pd
-import scipy.stats
-import sklearn.metrics
 from jahs_bench.surrogate import model
+from jahs_bench.surrogate_training import scoring
 
 _default_test_set_fn = "test_set.pkl.gz"
 _default_test_pred_fn = "test_pred.pkl.gz"
@@ -73,7 +72,8 @@ def evaluate_test_set(test_set: pd.DataFrame, model_dir: Path,
 
 def score_predictions(test_set: pd.DataFrame, ypred: pd.DataFrame):
     """ Given a test set and predictions made on that test set, returns the Kendall-Tau
-    rank correlation (KT) and Coefficient of Determination (R2) scores. """
+    rank correlation (KT), Coefficient of Determination (R2), Mean Squared Error (MSE) and
+    Spearman rank correlation scores. """
 
     _log.info("Extracting the input features and expected labels from the test set.")
     xtest = test_set.loc[:, "features"]
@@ -82,27 +82,35 @@ def score_predictions(test_set: pd.DataFrame, ypred: pd.DataFrame):
 
     _log.info(f"Generating quality of fit scores for {ypred.shape[0]} samples and "
               f"{ypred.shape[1]} outputs.")
+    table = scoring.score(ytest, ypred, pvalue=True)
     scores = {}
-    for output in ytest.columns:
-        r2_score = sklearn.metrics.r2_score(ytest[output], ypred[output])
-
-        # No need to adjust for minimization when comparing two series of the same metric.
-        ranks_test = ytest[output].rank()
-        ranks_pred = ypred[output].rank()
-        # kt_corr, kt_p = scipy.stats.kendalltau(ytest[output], ypred[output])
-        kt_corr, kt_p = scipy.stats.kendalltau(ranks_test, ranks_pred)
+    for output, row in table.iterrows():
         scores[output] = {
-            "R2": float(r2_score),
-            "KT": [float(kt_corr), float(kt_p)]
+            "R2": float(row.R2),
+            "MSE": float(row.MSE),
+            "Spearman": float(row.Spearman),
+            "KT": [float(row.KT), float(row.KT_p)]
         }
 
     _log.info(f"Generated scores:\n{scores}")
     return scores
 
 
+def score_predictions_by(test_set: pd.DataFrame, ypred: pd.DataFrame,
+                         groupby: Sequence[str]) -> pd.DataFrame:
+    """ Given a test set and predictions made on that test set, returns the scores of
+    `score_predictions()` separately for each group of rows with the same values of the
+    input features `groupby`, e.g. for every epoch. """
+
+    _log.info(f"Generating quality of fit scores grouped by {list(groupby)}.")
+    groups = test_set.loc[:, [("features", c) for c in groupby]].droplevel(0, axis=1)
+    return scoring.score(test_set.loc[:, "labels"], ypred, groups=groups)
+
+
 def main(testset_file: Path, model_dir: Optional[Path] = None,
          outputs: Optional[Sequence[str]] = None, scores_only: bool = False,
-         predictions_only: bool = False, save_dir: Optional[Path] = None):
+         predictions_only: bool = False, save_dir: Optional[Path] = None,
+         groupby: Optional[Sequence[str]] = None):
     assert testset_file is not None
     test_set = load_test_set(testset_file, outputs)
 
@@ -120,6 +128,11 @@ def main(testset_file: Path, model_dir: Optional[Path] = None,
         if save_dir is not None:
             with open(save_dir / "scores.yaml", "w") as fp:
                 yaml.safe_dump(scores, fp)
+        if groupby:
+            grouped = score_predictions_by(test_set, ypred, groupby)
+            _log.info(f"Generated grouped scores:\n{grouped.to_string()}")
+            if save_dir is not None:
+                grouped.to_csv(save_dir / f"scores_by_{'_'.join(groupby)}.csv")
 
     _log.info(f"Finished.")
 
@@ -159,6 +172,13 @@ def parse_cli():
                              "If this flag is given, any previously generated "
                              "predictions will get overwritten by newly generated "
                              "predictions.")
+    parser.add_argument("--groupby", type=str, nargs="+", default=None,
+                        help="Names of input features, e.g. 'epoch', such that the "
+                             "scores are additionally generated separately for every "
+                             "group of test points with the same values of these "
+                             "features. The grouped scores are stored in a file called "
+                             "'scores_by_<features>.csv' in --save-dir, if given. Must "
+                             "be given before --outputs.")
     parser.add_argument("--outputs", type=str, default=None,
                         nargs=argparse.REMAINDER,
                         help="Strings, separated by spaces, that indicate which of the "
@@ -0,0 +1,467 @@
+"""
+Tune and train the surrogate models of all metrics of a task on a single machine, as an
+alternative to running `pipeline.py` once per metric, e.g. as a cluster array job.
+
+The training and validation data are loaded and encoded only once. The encoded data is
+cached on the disk, from where a pool of worker processes memory maps it and each worker
+builds a single matrix of the training data, which is re-used by every trial that the
+worker runs - only the labels are swapped between trials. With xgboost 1.7 or newer, this
+is an `xgb.QuantileDMatrix`, which keeps only the quantized features in memory. The
+trials of all metrics are interleaved in the pool and each trial uses a fixed number of
+CPUs, thus `n_cpus // cpus_per_trial` trials run at any time.
+
+The hyperparameters follow the search space of `pipeline.py`. The default configuration
+is evaluated first, all others are sampled at random. Every trial trains the same model
+as `XGBSurrogate.fit()` would and is scored, like `pipeline.train_surrogate()`, by the
+negative Kendall tau correlation on the validation data. Finally, the best
+configuration of each metric is trained once more by `XGBSurrogate.fit()` and saved in
+the directory layout used by the public API, as `assemble_models.py` does.
+
+    python -m jahs_bench.surrogate_training.parallel_hpo --datadir $datadir \\
+        --working_directory $workdir --final_dir $final_dir --trials_per_metric 50 \\
+        --cpus_per_trial 4
+
+With `min_budget < 1`, the trials are promoted through the rungs of successive halving
+instead: all configurations are first evaluated at the smallest budget, only the best
+`1 / eta` of them at the next larger budget, and so on until the full budget of 1. The
+budget is the fraction of the model configs in the training data, whose rows are sampled
+as a whole such that their learning curves remain intact, the fraction of the boosting
+rounds, or both, depending on `fidelity`. Each worker keeps one training matrix per
+fraction of the data it has trained on.
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+import scipy.sparse
+import xgboost as xgb
+
+from jahs_bench.surrogate import config as cfg, utils as surrogate_utils
+from jahs_bench.surrogate.utils import FIDELITIES, budget_scaling
+from jahs_bench.surrogate.model import XGBSurrogate
+from jahs_bench.surrogate_training import scoring
+
+_log = logging.getLogger(__name__)
+
+# The same search space as `pipeline.xgb_hp_space`: name -> (lower, upper, log, integer,
+# default)
+SEARCH_SPACE = {
+    "max_depth": (1, 15, False, True, 6),
+    "min_child_weight": (1, 10, False, True, 1),
+    "colsample_bytree": (0., 1., False, False, 1.),
+    "learning_rate": (0.001, 0.5, True, False, 0.3),
+    "colsample_bylevel": (0., 1., False, False, 1.),
+    "sigmoid_k": (0.01, 2., True, False, 1.),
+}
+TRIALS_FILENAME = "trials.csv"
+_CACHE_MANIFEST = "manifest.json"
+_SPLITS = ("train", "valid")
+
+# The data of a worker process, loaded once by `_worker_data()`
+_worker_state: dict = {}
+
+
+def default_hyperparams() -> dict:
+    return {name: default for name, (*_, default) in SEARCH_SPACE.items()}
+
+
+def sample_hyperparams(random_state: np.random.RandomState) -> dict:
+    params: Dict[str, float] = {}
+    for name, (lower, upper, log, integer, _) in SEARCH_SPACE.items():
+        if integer:
+            params[name] = int(random_state.randint(lower, upper + 1))
+        elif log:
+            params[name] = float(np.exp(random_state.uniform(np.log(lower),
+                                                             np.log(upper))))
+        else:
+            # XGBoost rejects a column sampling ratio of exactly 0
+            params[name] = float(random_state.uniform(lower, upper) or upper)
+    return params
+
+
+def _typed(hyperparams: dict) -> dict:
+    """ Restore the types of hyperparameters read back from e.g. a CSV file. """
+
+    return {name: int(v) if SEARCH_SPACE[name][3] else float(v)
+            for name, v in hyperparams.items()}
+
+
+def pipeline_config(sigmoid_k: Optional[float] = None):
+    """ The pipeline configuration used by `pipeline.train_surrogate()`. """
+
+    pipeline_config = cfg.default_pipeline_config.clone()
+    if sigmoid_k is not None:
+        pipeline_config.defrost()
+        pipeline_config.target_config.params.params[1].k = float(sigmoid_k)
+        pipeline_config.freeze()
+    return pipeline_config
+
+
+def _target_transformers(sigmoid_k: Optional[float]) -> list:
+    """ The chain of target transformations applied by the pipeline of an XGBSurrogate,
+    in the order in which they are applied to the labels. """
+
+    target_config = pipeline_config(sigmoid_k).target_config
+    if target_config.transform.lower() == "chain":
+        return [surrogate_utils._get_single_transform(f, **p) for f, p in
+                zip(target_config.params["funcs"], target_config.params["params"])]
+    return [surrogate_utils._get_single_transform(target_config.transform,
+                                                  **target_config.params)]
+
+
+def rung_budgets(min_budget: float = 1., eta: int = 3) -> List[float]:
+    """ The budgets of the rungs of successive halving, growing by a factor of `eta`
+    from no less than `min_budget` up to 1. """
+
+    if not 0. < min_budget <= 1.:
+        raise ValueError(f"The minimum budget must be in the range (0, 1], was given "
+                         f"{min_budget}.")
+    if eta < 2:
+        raise ValueError(f"The reduction factor eta must be at least 2, was given {eta}.")
+    nrungs = int(np.floor(np.log(1 / min_budget) / np.log(eta) + 1e-9)) + 1
+    return [float(eta) ** -k for k in range(nrungs - 1, -1, -1)]
+
+
+def _cache_key(datadir: Path) -> dict:
+    files = [datadir / f"{split}_set.pkl.gz" for split in _SPLITS]
+    return {"datadir": str(datadir.resolve()),
+            "files": {f.name: [f.stat().st_size, f.stat().st_mtime] for f in files}}
+
+
+def prepare_cache(datadir: Path, cache_dir: Path,
+                  metrics: Optional[Sequence[str]] = None) -> List[str]:
+    """ Load the training and validation data from `datadir`, encode the features with
+    the preprocessing pipeline of an XGBSurrogate and save the encoded features, the
+    labels and the raw training data to `cache_dir`. A cache of the same data is re-used.
+    Returns the metrics, i.e. the labels, present in the cache. """
+
+    key = _cache_key(datadir)
+    manifest_pth = cache_dir / _CACHE_MANIFEST
+    if manifest_pth.exists():
+        with open(manifest_pth) as fp:
+            manifest = json.load(fp)
+        if manifest["key"] == key and (cache_dir / "train_groups.npy").exists() and \
+                (metrics is None or set(metrics).issubset(manifest["metrics"])):
+            _log.info(f"Re-using the encoded data cached at {cache_dir}.")
+            return manifest["metrics"] if metrics is None else list(metrics)
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    data = {}
+    for split in _SPLITS:
+        _log.info(f"Loading the {split} data.")
+        data[split] = pd.read_pickle(datadir / f"{split}_set.pkl.gz")
+        _log.info(f"Loaded {split} data of shape {data[split].shape}.")
+
+    labels = data["train"]["labels"].columns
+    metrics = labels.tolist() if metrics is None else list(metrics)
+    missing = set(metrics).difference(labels)
+    if missing:
+        raise ValueError(f"The metrics {sorted(missing)} are not present in the "
+                         f"training data, which contains {labels.tolist()}.")
+
+    preprocess = XGBSurrogate().preprocessing_pipeline
+    encoded = {"train": preprocess.fit_transform(data["train"]["features"]),
+               "valid": None}
+    encoded["valid"] = preprocess.transform(data["valid"]["features"])
+    for split in _SPLITS:
+        x = encoded[split]
+        for stale in (cache_dir / f"{split}_x.npz", cache_dir / f"{split}_x.npy"):
+            if stale.exists():
+                stale.unlink()
+        if scipy.sparse.issparse(x):
+            # Absent entries are missing values to XGBoost, as in the sklearn pipeline
+            scipy.sparse.save_npz(cache_dir / f"{split}_x.npz",
+                                  scipy.sparse.csr_matrix(x, dtype=np.float32))
+        else:
+            np.save(cache_dir / f"{split}_x.npy", np.asarray(x, dtype=np.float32))
+        np.save(cache_dir / f"{split}_y.npy",
+                data[split]["labels"].loc[:, metrics].to_numpy(dtype=np.float64))
+
+    # The model config of every training row, for sampling the rows by model config
+    train = data["train"]
+    groups = train["groups"] if "groups" in train else \
+        surrogate_utils.config_groups(train["features"])
+    np.save(cache_dir / "train_groups.npy", pd.factorize(np.asarray(groups).ravel())[0])
+
+    # The raw training data, uncompressed, for re-training the best configurations
+    selected = data["train"]["features"].columns.tolist()
+    data["train"].loc[:, [("features", c) for c in selected] +
+                         [("labels", m) for m in metrics]].to_pickle(
+        cache_dir / "train_set.pkl")
+
+    with open(manifest_pth, "w") as fp:
+        json.dump({"key": key, "metrics": metrics,
+                   "sparse": bool(scipy.sparse.issparse(encoded["train"]))}, fp)
+    _log.info(f"Cached the encoded data at {cache_dir}.")
+    return metrics
+
+
+def _load_x(cache_dir: Path, split: str):
+    if (cache_dir / f"{split}_x.npz").exists():
+        return scipy.sparse.load_npz(cache_dir / f"{split}_x.npz")
+    return np.load(cache_dir / f"{split}_x.npy", mmap_mode="r")
+
+
+def _training_matrix(x, nthread: int, ref: Optional[xgb.DMatrix] = None) -> xgb.DMatrix:
+    """ A training matrix of the encoded features `x`, quantized using the quantiles of
+    `ref`, if given. xgboost versions older than 1.7 lack `xgb.QuantileDMatrix`, in
+    which case the features are kept as they are and quantized by every trial. """
+
+    if hasattr(xgb, "QuantileDMatrix"):
+        return xgb.QuantileDMatrix(x, ref=ref, nthread=nthread)
+    return xgb.DMatrix(x, nthread=nthread)
+
+
+def _worker_data(cache_dir: Path, nthread: int) -> dict:
+    """ The data of this worker process, loaded on first use. """
+
+    if not _worker_state:
+        with open(cache_dir / _CACHE_MANIFEST) as fp:
+            metrics = json.load(fp)["metrics"]
+        # The quantiles of the features are computed once and shared by all trials
+        dtrain = _training_matrix(_load_x(cache_dir, "train"), nthread)
+        _worker_state.update(
+            cache_dir=cache_dir, metrics=metrics, dtrain=dtrain, subsets={},
+            groups=np.load(cache_dir / "train_groups.npy"),
+            dvalid=xgb.DMatrix(_load_x(cache_dir, "valid"), nthread=nthread),
+            ytrain=np.load(cache_dir / "train_y.npy", mmap_mode="r"),
+            yvalid=np.load(cache_dir / "valid_y.npy", mmap_mode="r"))
+    return _worker_state
+
+
+def _worker_dtrain(data: dict, fraction: float, nthread: int) -> \
+        Tuple[xgb.DMatrix, np.ndarray]:
+    """ The training matrix of this worker process for the given fraction of the model
+    configs and the indices of the rows it contains, built on first use. """
+
+    if fraction >= 1.:
+        return data["dtrain"], np.arange(data["ytrain"].shape[0])
+    if fraction not in data["subsets"]:
+        rows = np.flatnonzero(surrogate_utils.subsample_groups(data["groups"], fraction))
+        x = _load_x(data["cache_dir"], "train")[rows]
+        # Re-uses the quantiles of the full training data
+        dtrain = _training_matrix(x, nthread, ref=data["dtrain"])
+        data["subsets"][fraction] = (dtrain, rows)
+    return data["subsets"][fraction]
+
+
+def run_trial(cache_dir: Path, metric: str, trial: int, hyperparams: dict,
+              nthread: int = 1, tree_method: str = "hist", budget: float = 1.,
+              fidelity: str = "rows") -> dict:
+    """ Train a model for `metric` with the given hyperparameters on the cached data,
+    scaled down to the given budget, and return its validation loss, the negative
+    Kendall tau correlation. """
+
+    start = time.perf_counter()
+    data = _worker_data(cache_dir, nthread)
+    col = data["metrics"].index(metric)
+    fraction, num_boost_round = budget_scaling(budget, fidelity)
+    dtrain, rows = _worker_dtrain(data, fraction, nthread)
+
+    xgb_params = dict(hyperparams)
+    transformers = _target_transformers(xgb_params.pop("sigmoid_k", None))
+    ytrain = np.asarray(data["ytrain"][rows, col]).reshape(-1, 1)
+    for transformer in transformers:
+        ytrain = transformer.fit_transform(ytrain)
+    dtrain.set_label(ytrain.ravel())
+
+    params = {"objective": "reg:squarederror", "booster": "gbtree",
+              "tree_method": tree_method, "nthread": nthread, **xgb_params}
+    booster = xgb.train(params, dtrain, num_boost_round=num_boost_round)
+
+    ypred = booster.predict(data["dvalid"]).reshape(-1, 1)
+    for transformer in transformers[::-1]:
+        ypred = transformer.inverse_transform(ypred)
+    scores = scoring.score(pd.DataFrame({metric: data["yvalid"][:, col]}),
+                           pd.DataFrame({metric: ypred.ravel()})).iloc[0]
+    loss = np.inf if np.isnan(scores.KT) else -float(scores.KT)
+
+    return {"metric": metric, "trial": trial, "budget": budget, "loss": loss,
+            **hyperparams, "valid_r2": scores.R2, "valid_mse": scores.MSE,
+            "valid_spearman": scores.Spearman, "duration": time.perf_counter() - start}
+
+
+def retrain(cache_dir: Path, metric: str, hyperparams: dict, outdir: Path,
+            nthread: int = 1, native: bool = False) -> Path:
+    """ Train the model for `metric` with the given hyperparameters through
+    `XGBSurrogate.fit()` and save it to `outdir`, optionally also in the native format
+    of XGBoost. """
+
+    train_data: pd.DataFrame = pd.read_pickle(cache_dir / "train_set.pkl")
+    xgb_params = dict(hyperparams)
+    config = pipeline_config(xgb_params.pop("sigmoid_k", None))
+
+    surrogate = XGBSurrogate(hyperparams=xgb_params, n_jobs=nthread)
+    scores = surrogate.fit(train_data["features"], train_data["labels"].loc[:, [metric]],
+                           pipeline_config=config)
+    _log.info(f"Re-trained the surrogate for {metric} with the scores {scores}.")
+
+    outdir.mkdir(parents=True, exist_ok=True)
+    surrogate.dump(outdir)
+    if native:
+        surrogate.save_compiled(outdir)
+    return outdir
+
+
+def _promote(results: pd.DataFrame, candidates: Dict[str, list], budget: float,
+             eta: int) -> Dict[str, list]:
+    """ Keep the best `1 / eta` of the candidate trials of each metric, by their loss at
+    the given budget. """
+
+    promoted = {}
+    at_budget = results.loc[np.isclose(results.budget, budget)]
+    for metric, trials in candidates.items():
+        losses = at_budget.loc[at_budget.metric == metric].set_index("trial").loss
+        ranked = sorted(trials, key=lambda t: losses.get(t[0], np.inf))
+        promoted[metric] = ranked[:int(np.ceil(len(trials) / eta))]
+    return promoted
+
+
+def main(datadir: Path, working_directory: Path, final_dir: Optional[Path] = None,
+         metrics: Optional[Sequence[str]] = None, trials_per_metric: int = 20,
+         cpus_per_trial: int = 1, n_cpus: Optional[int] = None,
+         tree_method: str = "hist", native: bool = False, min_budget: float = 1.,
+         eta: int = 3, fidelity: str = "rows",
+         seed: Optional[int] = None) -> pd.DataFrame:
+    cache_dir = working_directory / "cache"
+    metrics = prepare_cache(datadir, cache_dir, metrics)
+    budgets = rung_budgets(min_budget, eta)
+    budget_scaling(budgets[0], fidelity)  # Validates the fidelity
+
+    trials_pth = working_directory / TRIALS_FILENAME
+    done = pd.read_csv(trials_pth) if trials_pth.exists() else pd.DataFrame()
+    if not done.empty and "budget" not in done:
+        # Recorded before successive halving was supported
+        done.insert(2, "budget", 1.)
+    finished = set() if done.empty else \
+        set(zip(done.metric, done.trial, done.budget.round(8)))
+    if finished:
+        _log.info(f"Resuming after {len(finished)} finished trials.")
+
+    random_state = np.random.RandomState(seed)
+    candidates: Dict[str, List[Tuple[int, dict]]] = {metric: [] for metric in metrics}
+    for trial in range(trials_per_metric):
+        for metric in metrics:
+            hyperparams = default_hyperparams() if trial == 0 else \
+                sample_hyperparams(random_state)
+            candidates[metric].append((trial, hyperparams))
+    if not done.empty:
+        # Resumed trials keep their recorded hyperparameters, which would otherwise only
+        # be drawn again given the same seed
+        recorded = done.drop_duplicates(["metric", "trial"])
+        recorded = recorded.set_index(["metric", "trial"]).loc[:, list(SEARCH_SPACE)]
+        candidates = {m: [(t, _typed(recorded.loc[(m, t)].to_dict()))
+                          if (m, t) in recorded.index else (t, h) for t, h in trials]
+                      for m, trials in candidates.items()}
+
+    nworkers = max(1, (n_cpus or os.cpu_count() or 1) // cpus_per_trial)
+    _log.info(f"Running {trials_per_metric} trials for each of the metrics {metrics} "
+              f"at the budgets {[round(b, 4) for b in budgets]} in {nworkers} processes "
+              f"using {cpus_per_trial} CPUs each.")
+
+    results = [] if done.empty else done.to_dict(orient="records")
+    # Forking a process that has initialized OpenMP, e.g. by using XGBoost, is unsafe
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=nworkers, mp_context=ctx) as pool:
+        for rung, budget in enumerate(budgets):
+            jobs = [(m, t, h) for m, trials in candidates.items() for t, h in trials
+                    if (m, t, round(budget, 8)) not in finished]
+            futures = [pool.submit(run_trial, cache_dir, m, t, h, cpus_per_trial,
+                                   tree_method, budget, fidelity) for m, t, h in jobs]
+            for i, future in enumerate(as_completed(futures), start=1):
+                result = future.result()
+                results.append(result)
+                pd.DataFrame(results).to_csv(trials_pth, index=False)
+                _log.info(f"Finished trial {result['trial']} of {result['metric']} at "
+                          f"budget {budget:.4f} with loss {result['loss']:.4f} in "
+                          f"{result['duration']:.1f} seconds, {i} of {len(jobs)} trials "
+                          f"of rung {rung} done.")
+            if rung + 1 < len(budgets):
+                candidates = _promote(pd.DataFrame(results), candidates, budget, eta)
+
+        results = pd.DataFrame(results)
+        final = results.loc[np.isclose(results.budget, budgets[-1]) &
+                            results.metric.isin(metrics)]
+        best = final.loc[final.groupby("metric").loss.idxmin()]
+        _log.info(f"The best configurations are:\n{best.to_string(index=False)}")
+        _log.info(f"All trials took {results.duration.sum() * cpus_per_trial / 3600:.3f} "
+                  f"CPU-hours.")
+
+        if final_dir is not None:
+            names = list(SEARCH_SPACE)
+            retrained = {pool.submit(retrain, cache_dir, row.metric,
+                                     _typed({n: getattr(row, n) for n in names}),
+                                     final_dir / row.metric, cpus_per_trial, native):
+                         row.metric for row in best.itertuples(index=False)}
+            for saved in as_completed(retrained):
+                _log.info(f"Saved the surrogate for {retrained[saved]} at "
+                          f"{saved.result()}.")
+
+    return results
+
+
+def parse_cli():
+    parser = argparse.ArgumentParser(
+        "Tune and train the surrogate models of all metrics of a task concurrently on a "
+        "single machine."
+    )
+    parser.add_argument("--datadir", type=Path,
+                        help="Path to the directory where the cleaned, tidy training "
+                             "and validation data splits to be used are stored.")
+    parser.add_argument("--working_directory", type=Path,
+                        help="The directory in which the encoded data is cached and the "
+                             "results of all trials are recorded. A run is resumed from "
+                             "the recorded trials.")
+    parser.add_argument("--final_dir", type=Path, default=None,
+                        help="The directory to which the best model of each metric is "
+                             "saved, in the layout used by the public API. When not "
+                             "given, no model is saved.")
+    parser.add_argument("--metrics", type=str, nargs="+", default=None,
+                        help="The metrics to train surrogates for. Defaults to all "
+                             "metrics present in the data.")
+    parser.add_argument("--trials_per_metric", type=int, default=20,
+                        help="The number of configurations evaluated for each metric.")
+    parser.add_argument("--cpus_per_trial", type=int, default=1,
+                        help="The number of threads used by each trial.")
+    parser.add_argument("--n_cpus", type=int, default=None,
+                        help="The total number of CPUs to use. Defaults to all CPUs.")
+    parser.add_argument("--tree_method", type=str, default="hist",
+                        help="The tree method of XGBoost used by the trials.")
+    parser.add_argument("--native", action="store_true",
+                        help="When given, each model is also exported in the native "
+                             "format of XGBoost, which the public API loads faster.")
+    parser.add_argument("--min_budget", type=float, default=1.,
+                        help="The smallest budget of successive halving, a fraction in "
+                             "(0, 1]. Defaults to 1, i.e. all trials use the full "
+                             "budget.")
+    parser.add_argument("--eta", type=int, default=3,
+                        help="The factor by which the budget grows and the number of "
+                             "trials shrinks from one rung of successive halving to the "
+                             "next.")
+    parser.add_argument("--fidelity", type=str, default="rows", choices=FIDELITIES,
+                        help="What the budget of successive halving scales: the "
+                             "fraction of the model configs in the training data, the "
+                             "number of boosting rounds or both.")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Seed for sampling the hyperparameters.")
+
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO,
+                        format="[%(asctime)s] %(name)s %(levelname)s: %(message)s",
+                        datefmt="%m/%d %H:%M:%S")
+    _log.setLevel(logging.INFO)
+    args = parse_cli()
+    main(**vars(args))
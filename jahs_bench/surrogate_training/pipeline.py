@@ -7,8 +7,9 @@ from typing import Tuple, Optional
 import joblib
 import neps
 import pandas as pd
-import scipy.stats
-from jahs_bench.surrogate import model, config as cfg
+from jahs_bench.surrogate import model, config as cfg, utils as surrogate_utils
+from jahs_bench.surrogate_training import scoring
+from jahs_bench.surrogate.utils import FIDELITIES, budget_scaling
 
 _log = logging.getLogger(__name__)
 
@@ -34,7 +35,8 @@ xgb_hp_space = {
 }
 
 def train_surrogate(working_directory: Path, train_data: pd.DataFrame,
-                    valid_data: pd.DataFrame, **config_dict):
+                    valid_data: pd.DataFrame, early_stopping_rounds: Optional[int] = None,
+                    fidelity: str = "rows", **config_dict):
     """
 
     :param working_directory:
@@ -47,13 +49,23 @@ def train_surrogate(working_directory: Path, train_data: pd.DataFrame,
         validation data. Level 0 should contain the columns "features" and "labels".
         Level 1 can contain arbitrary columns, but they should match those in
         `train_data`.
+    :param early_stopping_rounds: int or None
+        If given, the number of boosting rounds is determined by early stopping on a
+        split of the training data that respects the column "groups" of `train_data`,
+        if present. Consult `XGBSurrogate.fit()`.
+    :param fidelity: str
+        What the hyperparameter "budget", if given, scales: the fraction of the model
+        configs in the training data, the number of boosting rounds or both. Consult
+        `surrogate.utils.budget_scaling()`.
     :param config_dict: keyword-arguments
-        These specify the various hyperparameters to be used for the model.
+        These specify the various hyperparameters to be used for the model, optionally
+        including the budget of a multi-fidelity optimizer in (0, 1].
     :return:
     """
 
     xtrain = train_data["features"]
     ytrain = train_data["labels"]
+    groups = train_data["groups"] if "groups" in train_data else None
 
     xvalid = valid_data["features"]
     yvalid = valid_data["labels"]
@@ -62,18 +74,31 @@ def train_surrogate(working_directory: Path, train_data: pd.DataFrame,
     pipeline_config = cfg.default_pipeline_config.clone()
     xgb_params = config_dict.copy()
     sigmoid_k = xgb_params.pop("sigmoid_k", None)
+    fraction, rounds = budget_scaling(float(xgb_params.pop("budget", 1.)), fidelity)
+
+    if fraction < 1.:
+        # Sample entire model configs, such that their learning curves remain intact
+        mask = surrogate_utils.subsample_groups(
+            surrogate_utils.config_groups(xtrain) if groups is None else groups,
+            fraction)
+        xtrain, ytrain = xtrain.loc[mask], ytrain.loc[mask]
+        groups = None if groups is None else groups.loc[mask]
+        _log.info(f"Training on {xtrain.shape[0]} rows, a fraction of {fraction:.4f} of "
+                  f"the model configs, with {rounds} boosting rounds.")
 
     if sigmoid_k is not None:
         pipeline_config.defrost()
         pipeline_config.target_config.params.params[1].k = float(sigmoid_k)
         pipeline_config.freeze()
 
-    surrogate = model.XGBSurrogate(hyperparams=xgb_params, use_gpu=True)
+    surrogate = model.XGBSurrogate(hyperparams=xgb_params, use_gpu=True,
+                                   estimators_per_output=rounds)
 
     _log.info("Training surrogate.")
     random_state = None
     scores = surrogate.fit(xtrain, ytrain, random_state=random_state,
-                           pipeline_config=pipeline_config)
+                           pipeline_config=pipeline_config,
+                           early_stopping_rounds=early_stopping_rounds, groups=groups)
     _log.info(f"Trained surrogate has scores: {scores}")
 
     modeldir = working_directory / "xgb_model"
@@ -85,11 +110,11 @@ def train_surrogate(working_directory: Path, train_data: pd.DataFrame,
 
     _log.info(f"Generating validation scores.")
     ypred = surrogate.predict(xvalid)
-    valid_score = scipy.stats.kendalltau(yvalid, ypred)
+    valid_scores = scoring.score(yvalid, ypred)
 
-    _log.info(f"Trained surrogate has validation score: {valid_score}")
+    _log.info(f"Trained surrogate has validation scores:\n{valid_scores.to_string()}")
     # Return negative KT correlation since NEPS minimizes the loss
-    return -valid_score.correlation
+    return -float(valid_scores.KT.iloc[0])
 
 def load_data(datadir: Path, output: Optional[str]) -> Tuple[pd.DataFrame, pd.DataFrame]:
     _log.info("Loading training data.")
@@ -112,24 +137,40 @@ def load_data(datadir: Path, output: Optional[str]) -> Tuple[pd.DataFrame, pd.Da
         assert output in labels, f"The chosen prediction label {output} is not present " \
                                  f"in the training data."
         selected_cols = train_data[["features"]].columns.tolist() + [("labels", output)]
-        train_data = train_data.loc[:, selected_cols]
         valid_data = valid_data.loc[:, selected_cols]
+        if "groups" in train_data:
+            selected_cols += train_data[["groups"]].columns.tolist()
+        train_data = train_data.loc[:, selected_cols]
 
     return train_data, valid_data
 
 def perform_hpo(working_directory: Path, datadir: Path, output: str,
-                max_evaluations_total: int = 5,):
+                max_evaluations_total: int = 5,
+                early_stopping_rounds: Optional[int] = None,
+                min_budget: Optional[float] = None, eta: int = 3, fidelity: str = "rows"):
     _log.info(f"Performing HPO using the working directory {working_directory}, using "
               f"the data at {datadir}, over {max_evaluations_total} evaluations.")
 
     train_data, valid_data = load_data(datadir=datadir, output=output)
     pipeline = functools.partial(train_surrogate, train_data=train_data,
-                                 valid_data=valid_data)
+                                 valid_data=valid_data,
+                                 early_stopping_rounds=early_stopping_rounds,
+                                 fidelity=fidelity)
+    if min_budget is None:
+        pipeline_space, searcher_kwargs = xgb_hp_space, {}
+    else:
+        _log.info(f"Using successive halving with budgets in [{min_budget}, 1] scaling "
+                  f"the {fidelity} and eta={eta}.")
+        pipeline_space = {**xgb_hp_space, "budget": neps.FloatParameter(
+            lower=min_budget, upper=1., log=True, is_fidelity=True)}
+        searcher_kwargs = {"searcher": "successive_halving", "eta": eta}
+
     neps.run(
         run_pipeline=pipeline,
-        pipeline_space=xgb_hp_space,
+        pipeline_space=pipeline_space,
         working_directory=working_directory,
         max_evaluations_total=max_evaluations_total,
+        **searcher_kwargs
     )
 
     _log.info("Finished.")
@@ -151,6 +192,21 @@ def parse_cli():
     parser.add_argument("--max_evaluations_total", type=int, default=5,
                         help="Number of evaluations that this NEPS worker should "
                              "perform.")
+    parser.add_argument("--early_stopping_rounds", type=int, default=None,
+                        help="If given, stop boosting once the error on a held out, "
+                             "group-aware split of the training data has not improved "
+                             "for this many rounds and keep only the trees up to the "
+                             "best round. By default, all 500 rounds are boosted.")
+    parser.add_argument("--min_budget", type=float, default=None,
+                        help="If given, the configurations are evaluated by successive "
+                             "halving, at budgets from this fraction in (0, 1] up to 1. "
+                             "By default, every evaluation uses the full budget.")
+    parser.add_argument("--eta", type=int, default=3,
+                        help="The reduction factor of successive halving.")
+    parser.add_argument("--fidelity", type=str, default="rows", choices=FIDELITIES,
+                        help="What the budget of successive halving scales: the "
+                             "fraction of the model configs in the training data, the "
+                             "number of boosting rounds or both.")
 
     args = parser.parse_args()
     return args
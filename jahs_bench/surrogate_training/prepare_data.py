@@ -7,6 +7,7 @@ import numpy as np
 import pandas as pd
 # Make sure that the system path contains the correct repository
 from jahs_bench.surrogate import model, utils
+from jahs_bench.surrogate_training import streaming
 
 _seed = 3501623856
 
@@ -15,7 +16,18 @@ _log = logging.getLogger(__name__)
 
 def generate_splits(datadir: Path, datafile: str, test_size: float,
                     valid_size: Optional[float] = None,
-                    outputs: Optional[Sequence[str]] = None, seed: Optional[int] = _seed):
+                    outputs: Optional[Sequence[str]] = None, seed: Optional[int] = _seed,
+                    chunk_rows: Optional[int] = None):
+    if chunk_rows is not None:
+        subdir = datadir / f"valid-{valid_size}-test-{test_size}-shards"
+        _log.info(f"Streaming the dataset in chunks of {chunk_rows} rows into shards in "
+                  f"{subdir}.")
+        streaming.generate_split_shards(
+            table=datadir / datafile, outdir=subdir, test_size=test_size,
+            valid_size=valid_size or 0., outputs=outputs, seed=seed, fillna=True,
+            chunk_rows=chunk_rows)
+        return
+
     _log.info(f"Setting up the output directory and random state using the seed {seed}.")
     subdir = datadir / f"valid-{valid_size}-test-{test_size}"
     subdir.mkdir(exist_ok=False, parents=False)
@@ -96,6 +108,13 @@ def parse_cli():
     parser.add_argument("--valid_size", type=float,
                         help="The fraction of the full dataset that should be used for "
                              "generating the validation split.")
+    parser.add_argument("--chunk_rows", type=int, default=None,
+                        help="If given, `datafile` is expected to be a table in the "
+                             "columnar format, including the column group "
+                             "'sampling_index', which is streamed in chunks of this many "
+                             "rows and split by model config into shards of the data "
+                             "splits, for datasets that do not fit into memory. See "
+                             "`jahs_bench.surrogate_training.streaming`.")
     parser.add_argument("--outputs", type=str, default=None,
                         nargs=argparse.REMAINDER,
                         help="Strings, separated by spaces, that indicate which of the "
@@ -0,0 +1,475 @@
+"""
+An out-of-core alternative to `prepare_data.generate_splits()` and `parallel_hpo.py`, for
+performance datasets that do not fit into memory.
+
+The raw dataset is read from a table in the columnar format of
+`jahs_bench.lib.core.columnar`, which must contain the group "sampling_index", in chunks
+of rows, of which only the pages of the memory mapped columns that are currently needed
+are ever read. Every row is assigned to the training, validation or test split by a hash
+of its "model_ID", such that all the rows of a model config always end up in the same
+split, independent of the order of the rows and of the size of the chunks. The rows of
+every chunk are then written to one shard per split, each a columnar table of its own,
+such that no split is ever held in memory as a whole.
+
+    python -m jahs_bench.surrogate_training.prepare_data --datadir $datadir \\
+        --datafile columnar --test_size 0.2 --valid_size 0.1 --chunk_rows 1000000
+
+The surrogates are then trained on the shards of the training split by
+`xgb.train()`, which reads them one at a time through an `xgb.DataIter`, using the same
+model, target transformations and hyperparameters as `parallel_hpo.py`. By default, the
+training matrix uses XGBoost's external memory, i.e. it is paged from a cache on the
+disk, otherwise only its quantized version is kept in memory. The trained models are
+saved in the native format of `CompiledSurrogate`, which the Benchmark API loads
+directly.
+
+    python -m jahs_bench.surrogate_training.streaming --shard_dir $shard_dir \\
+        --final_dir $final_dir --trials $workdir/trials.csv
+
+The statistics that depend on the full training data, i.e. the categories of the
+one-hot encoded features, the ranges of the labels and the values that replace missing
+labels, are collected in a separate pass over the data beforehand.
+"""
+
+import argparse
+import json
+import logging
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+
+from jahs_bench.lib.core import columnar
+from jahs_bench.surrogate.compiled import CompiledSurrogate, target_inverse
+from jahs_bench.surrogate.model import XGBSurrogate
+from jahs_bench.surrogate.utils import NUM_BOOST_ROUND
+from jahs_bench.surrogate_training import parallel_hpo, scoring
+
+_log = logging.getLogger(__name__)
+
+SPLITS = ("train", "valid", "test")
+FORMAT_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+CHUNK_ROWS = 1_000_000
+
+
+def split_codes(model_ids: Union[pd.Series, np.ndarray], test_size: float,
+                valid_size: float, seed: Optional[int] = None) -> np.ndarray:
+    """ Assign every row to one of `SPLITS` by hashing its model ID, such that the rows
+    of a model config share the same split and a fraction of about `test_size` and
+    `valid_size` of the model configs fall into the test and validation splits. Returns
+    the index of the split of every row. """
+
+    if test_size < 0. or valid_size < 0. or test_size + valid_size >= 1.:
+        raise ValueError(f"The test and validation splits must be non-negative fractions "
+                         f"that add up to less than 1, were given {test_size} and "
+                         f"{valid_size}.")
+    hashes = pd.util.hash_array(np.asarray(model_ids).ravel(), categorize=False)
+    hashes = pd.util.hash_array(hashes ^ np.uint64(seed or 0))
+    position = hashes.astype(np.float64) / 2. ** 64
+    codes = np.zeros(position.size, dtype=np.int8)
+    codes[position < test_size + valid_size] = SPLITS.index("valid")
+    codes[position < test_size] = SPLITS.index("test")
+    return codes
+
+
+def iter_chunks(table: Path, chunk_rows: int = CHUNK_ROWS,
+                columns: Optional[Dict[str, Optional[Sequence[str]]]] = None) \
+        -> Iterator[Dict[str, pd.DataFrame]]:
+    """ Iterate over consecutive chunks of at most `chunk_rows` rows of a columnar table.
+    `columns` maps the column groups to be read to the names of the columns, None for
+    all columns of a group. Yields a dict mapping each group to a DataFrame. """
+
+    manifest = columnar.read_manifest(table)
+    columns = {g: None for g in manifest["columns"]} if columns is None else columns
+    for start in range(0, manifest["nrows"], chunk_rows):
+        rows = slice(start, start + chunk_rows)
+        yield {group: columnar.read_group(table, group, names, rows=rows,
+                                          manifest=manifest)
+               for group, names in columns.items()}
+
+
+def _onehot_columns() -> List[str]:
+    _, _, columns = XGBSurrogate().preprocessing_pipeline.transformers[0]
+    return list(columns)
+
+
+def _fill_value(metric: str, max_value: float) -> float:
+    # The same rules as `surrogate.utils.adjust_dataset()`
+    if "acc" in metric:
+        return 0.
+    if "loss" in metric or "duration" in metric:
+        return 100 * max_value
+    raise RuntimeError(f"Could not find appropriate fill value to replace NaNs with for "
+                       f"metric: {metric}")
+
+
+def collect_statistics(table: Path, test_size: float, valid_size: float,
+                       outputs: Optional[Sequence[str]] = None,
+                       seed: Optional[int] = None, fillna: bool = True,
+                       chunk_rows: int = CHUNK_ROWS) -> dict:
+    """ Collect, in one pass over the table, everything that depends on the entire
+    training split: the categories of the one-hot encoded features in the training
+    split, the values that replace missing labels and the ranges of the training labels
+    after doing so. """
+
+    manifest = columnar.read_manifest(table)
+    features = [e["name"] for e in manifest["columns"]["features"]]
+    labels = [e["name"] for e in manifest["columns"]["labels"]] if outputs is None \
+        else list(outputs)
+    onehot = [c for c in _onehot_columns() if c in features]
+
+    categories: Dict[str, set] = {c: set() for c in onehot}
+    overall_max = pd.Series(-np.inf, index=labels)
+    missing = pd.Series(False, index=labels)
+    train_min = pd.Series(np.inf, index=labels)
+    train_max = pd.Series(-np.inf, index=labels)
+    train_missing = pd.Series(False, index=labels)
+
+    columns: Dict[str, Optional[Sequence[str]]] = {
+        "features": onehot, "labels": labels, "sampling_index": ["model_ID"]}
+    for chunk in iter_chunks(table, chunk_rows, columns):
+        train = split_codes(chunk["sampling_index"]["model_ID"], test_size, valid_size,
+                            seed) == SPLITS.index("train")
+        for c in onehot:
+            categories[c].update(pd.unique(np.asarray(chunk["features"][c])[train]))
+        y = chunk["labels"]
+        overall_max = np.fmax(overall_max, y.max())
+        missing |= y.isna().any()
+        y = y.loc[train]
+        train_min = np.fmin(train_min, y.min())
+        train_max = np.fmax(train_max, y.max())
+        train_missing |= y.isna().any()
+
+    fillvals = {m: _fill_value(m, overall_max[m]) for m in labels
+                if fillna and missing[m]}
+    if fillvals:
+        _log.info(f"Filling NaN values according to the mapping: {fillvals}")
+    for m, value in fillvals.items():
+        if train_missing[m]:
+            train_min[m] = min(train_min[m], value)
+            train_max[m] = max(train_max[m], value)
+
+    return {
+        "features": features, "labels": labels, "fillna": fillvals,
+        "onehot": {c: np.unique(np.asarray(list(categories[c]))).tolist()
+                   for c in onehot},
+        "label_range": {m: [float(train_min[m]), float(train_max[m])] for m in labels},
+    }
+
+
+def generate_split_shards(table: Path, outdir: Path, test_size: float,
+                          valid_size: float = 0., outputs: Optional[Sequence[str]] = None,
+                          seed: Optional[int] = None, fillna: bool = True,
+                          chunk_rows: int = CHUNK_ROWS) -> Path:
+    """
+    Split the raw performance dataset in the columnar table `table` into training,
+    validation and test splits, grouped by model config, and write every split to
+    `outdir` as a sequence of shards, each a columnar table of at most `chunk_rows`
+    rows. Only one chunk of rows is ever held in memory. The shards of the training
+    split keep the "sampling_index" of the raw dataset.
+
+    :param table: Path
+        A table in the columnar format with the groups "features", "labels" and
+        "sampling_index", the latter containing at least the column "model_ID".
+    :param outdir: Path
+        The directory that the shards and their manifest are written to.
+    :param test_size: float
+        The approximate fraction of the model configs that go into the test split.
+    :param valid_size: float
+        The approximate fraction of the model configs that go into the validation split.
+    :param outputs: optional sequence of str
+        The metrics to keep. All metrics are kept when None.
+    :param seed: optional int
+        Seeds the hash that assigns the model configs to the splits.
+    :param fillna: bool
+        Whether missing labels are filled in, as `surrogate.utils.adjust_dataset()` does.
+    :param chunk_rows: int
+        The number of rows read from `table` at once.
+    :return: Path
+        The path to the manifest of the shards.
+    """
+
+    table, outdir = Path(table), Path(outdir)
+    outdir.mkdir(parents=True, exist_ok=False)
+
+    _log.info(f"Collecting the statistics of the training split of {table}.")
+    stats = collect_statistics(table, test_size, valid_size, outputs=outputs, seed=seed,
+                               fillna=fillna, chunk_rows=chunk_rows)
+
+    shards: Dict[str, List[dict]] = {split: [] for split in SPLITS}
+    columns = {"features": stats["features"], "labels": stats["labels"],
+               "sampling_index": None}
+    for i, chunk in enumerate(iter_chunks(table, chunk_rows, columns)):
+        chunk["labels"] = chunk["labels"].fillna(stats["fillna"])
+        chunk = pd.concat(chunk, axis=1)
+        codes = split_codes(chunk[("sampling_index", "model_ID")], test_size,
+                            valid_size, seed)
+        for code, split in enumerate(SPLITS):
+            rows = codes == code
+            if not rows.any():
+                continue
+            shard = f"{split}/{i:05d}"
+            columnar.write_columnar(chunk.loc[rows], outdir / shard)
+            shards[split].append({"dir": shard, "nrows": int(rows.sum())})
+
+    manifest = {"version": FORMAT_VERSION, "source": str(table.resolve()), "seed": seed,
+                "test_size": test_size, "valid_size": valid_size, **stats,
+                "nrows": {s: sum(shard["nrows"] for shard in shards[s]) for s in SPLITS},
+                "shards": shards}
+    manifest_pth = outdir / MANIFEST_NAME
+    with open(manifest_pth, "w") as fp:
+        json.dump(manifest, fp, indent=2)
+    _log.info(f"Wrote the splits of {manifest['nrows']} rows to {outdir}.")
+    return manifest_pth
+
+
+def read_manifest(shard_dir: Path) -> dict:
+    with open(Path(shard_dir) / MANIFEST_NAME) as fp:
+        manifest = json.load(fp)
+
+    if manifest.get("version") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported version {manifest.get('version')} of the data "
+                         f"splits at {shard_dir}, expected version {FORMAT_VERSION}.")
+    return manifest
+
+
+def input_encoding(manifest: dict) -> CompiledSurrogate:
+    """ A model without any outputs, which encodes the features of the shards exactly
+    like the preprocessing pipeline of an XGBSurrogate that was fitted on the entire
+    training split would. """
+
+    _, encoder, onehot_columns = XGBSurrogate().preprocessing_pipeline.transformers[0]
+    onehot = []
+    for name in onehot_columns:
+        categories = manifest["onehot"][name]
+        drop = 0 if encoder.drop == "if_binary" and len(categories) == 2 else None
+        onehot.append((name, categories, drop))
+    passthrough = [f for f in manifest["features"] if f not in manifest["onehot"]]
+    # The encoded features are always dense, as the pipeline's are for this layout
+    return CompiledSurrogate(feature_headers=manifest["features"], label_headers=[],
+                             onehot=onehot, passthrough=passthrough, boosters=[],
+                             iteration_ranges=[], target_inverses=[])
+
+
+def fit_target_transformers(manifest: dict, metric: str,
+                            sigmoid_k: Optional[float] = None) -> list:
+    """ The target transformations of `metric`, fitted to the range of its training
+    labels. All of them are element-wise and monotonic, which makes them identical to
+    the ones fitted to all the training labels. """
+
+    transformers = parallel_hpo._target_transformers(sigmoid_k)
+    y = np.asarray(manifest["label_range"][metric], dtype=np.float64).reshape(-1, 1)
+    for transformer in transformers:
+        y = transformer.fit_transform(y)
+    return transformers
+
+
+class ShardIter(xgb.DataIter):
+    """ Hands the shards of one split of the data to XGBoost one at a time, encoded and
+    with the target transformations applied to the labels. """
+
+    def __init__(self, shard_dir: Path, split: str, metric: str,
+                 encoding: CompiledSurrogate, transformers: Sequence = (),
+                 cache_prefix: Optional[str] = None):
+        self.shard_dir = Path(shard_dir)
+        manifest = read_manifest(self.shard_dir)
+        self.shards = [self.shard_dir / s["dir"] for s in manifest["shards"][split]]
+        if not self.shards:
+            raise ValueError(f"The {split} split at {shard_dir} is empty.")
+        self.metric = metric
+        self.encoding = encoding
+        self.transformers = list(transformers)
+        self._it = 0
+        super().__init__(cache_prefix=cache_prefix)
+
+    def load(self, i: int) -> Tuple[np.ndarray, np.ndarray]:
+        """ The encoded features and the raw labels of the i-th shard. """
+
+        features, labels = columnar.read_columnar(
+            self.shards[i], features=self.encoding.feature_headers, labels=[self.metric])
+        return self.encoding.transform(features), labels[self.metric].to_numpy(np.float64)
+
+    def next(self, input_data: Callable) -> int:
+        if self._it == len(self.shards):
+            return 0
+        x, y = self.load(self._it)
+        y = y.reshape(-1, 1)
+        for transformer in self.transformers:
+            y = transformer.transform(y)
+        input_data(data=x, label=y.ravel())
+        self._it += 1
+        return 1
+
+    def reset(self):
+        self._it = 0
+
+
+def train(shard_dir: Path, metric: str, hyperparams: Optional[dict] = None,
+          num_boost_round: int = NUM_BOOST_ROUND,
+          external_memory: bool = True, cache_dir: Optional[Path] = None,
+          nthread: int = 1) -> CompiledSurrogate:
+    """
+    Train the surrogate of `metric` on the training split of the shards in
+    `shard_dir`, like `parallel_hpo.run_trial()` does at the full budget.
+
+    :param shard_dir: Path
+        A directory written by `generate_split_shards()`.
+    :param metric: str
+    :param hyperparams: optional dict
+        Values from `parallel_hpo.SEARCH_SPACE`. The defaults when None.
+    :param num_boost_round: int
+    :param external_memory: bool
+        If True, XGBoost pages the training matrix from a cache on the disk, otherwise
+        only the quantized training matrix is held in memory, which requires xgboost
+        1.7 or newer.
+    :param cache_dir: optional Path
+        The directory in which a temporary directory for the cache of the external
+        memory is created, `shard_dir` when None. Only the temporary directory is
+        removed after training.
+    :param nthread: int
+    :return: CompiledSurrogate
+    """
+
+    shard_dir = Path(shard_dir)
+    manifest = read_manifest(shard_dir)
+    xgb_params = dict(parallel_hpo.default_hyperparams() if hyperparams is None
+                      else hyperparams)
+    transformers = fit_target_transformers(manifest, metric,
+                                           xgb_params.pop("sigmoid_k", None))
+    encoding = input_encoding(manifest)
+
+    if not external_memory and not hasattr(xgb, "QuantileDMatrix"):
+        raise RuntimeError(f"Training without external memory requires xgboost 1.7 or "
+                           f"newer, found version {xgb.__version__}.")
+
+    cache = None
+    if external_memory:
+        cache_dir = shard_dir if cache_dir is None else Path(cache_dir)
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        # A private directory, such that nothing else in `cache_dir` is ever removed
+        cache = Path(tempfile.mkdtemp(prefix="xgb_cache_", dir=cache_dir))
+        it = ShardIter(shard_dir, "train", metric, encoding, transformers,
+                       cache_prefix=str(cache / "cache"))
+        dtrain = xgb.DMatrix(it, nthread=nthread)
+    else:
+        it = ShardIter(shard_dir, "train", metric, encoding, transformers)
+        dtrain = xgb.QuantileDMatrix(it, nthread=nthread)
+
+    params = {"objective": "reg:squarederror", "booster": "gbtree",
+              "tree_method": "hist", "nthread": nthread, **xgb_params}
+    try:
+        booster = xgb.train(params, dtrain, num_boost_round=num_boost_round)
+    finally:
+        del dtrain
+        if cache is not None:
+            shutil.rmtree(cache, ignore_errors=True)
+
+    return CompiledSurrogate(
+        feature_headers=encoding.feature_headers, label_headers=[metric],
+        onehot=encoding.onehot, passthrough=encoding.passthrough, boosters=[booster],
+        iteration_ranges=[(0, 0)],
+        target_inverses=[[target_inverse(t) for t in transformers[::-1]]])
+
+
+def evaluate(model: CompiledSurrogate, shard_dir: Path, split: str = "valid",
+             **kwargs) -> pd.DataFrame:
+    """ Score the predictions of `model` on one split of the shards, predicted one shard
+    at a time. Additional keyword arguments are passed on to `scoring.score()`. """
+
+    manifest = read_manifest(shard_dir)
+    outputs = list(model.label_headers)
+    ytrue, ypred = [], []
+    for shard in manifest["shards"][split]:
+        features, labels = columnar.read_columnar(
+            Path(shard_dir) / shard["dir"], features=model.feature_headers,
+            labels=outputs)
+        ytrue.append(labels.to_numpy(np.float64))
+        ypred.append(model.predict(features))
+    return scoring.score(pd.DataFrame(np.concatenate(ytrue), columns=outputs),
+                         pd.DataFrame(np.concatenate(ypred), columns=outputs), **kwargs)
+
+
+def best_hyperparams(trials: pd.DataFrame, metric: str) -> dict:
+    """ The best hyperparameters of `metric` among the trials recorded by
+    `parallel_hpo.py` at the full budget. """
+
+    trials = trials.loc[trials.metric == metric]
+    if "budget" in trials:
+        trials = trials.loc[np.isclose(trials.budget, 1.)]
+    if trials.empty:
+        raise ValueError(f"Found no trials of {metric} at the full budget.")
+    best = trials.loc[trials.loss.idxmin()]
+    return parallel_hpo._typed(best[list(parallel_hpo.SEARCH_SPACE)].to_dict())
+
+
+def main(shard_dir: Path, final_dir: Path, metrics: Optional[Sequence[str]] = None,
+         trials: Optional[Path] = None,
+         num_boost_round: int = NUM_BOOST_ROUND,
+         external_memory: bool = True, cache_dir: Optional[Path] = None,
+         nthread: int = 1) -> pd.DataFrame:
+    manifest = read_manifest(shard_dir)
+    metrics = manifest["labels"] if metrics is None else list(metrics)
+    trials = None if trials is None else pd.read_csv(trials)
+
+    scores = []
+    for metric in metrics:
+        hyperparams = None if trials is None else best_hyperparams(trials, metric)
+        _log.info(f"Training the surrogate for {metric} with the hyperparameters "
+                  f"{hyperparams or parallel_hpo.default_hyperparams()}.")
+        model = train(shard_dir, metric, hyperparams, num_boost_round=num_boost_round,
+                      external_memory=external_memory, cache_dir=cache_dir,
+                      nthread=nthread)
+        model.save(final_dir / metric)
+        if manifest["shards"]["valid"]:
+            scores.append(evaluate(model, shard_dir, "valid"))
+            _log.info(f"Validation scores of {metric}:\n{scores[-1].to_string()}")
+
+    return pd.concat(scores) if scores else pd.DataFrame()
+
+
+def parse_cli():
+    parser = argparse.ArgumentParser(
+        "Train the surrogate models out-of-core on the data splits written by "
+        "`prepare_data.py --chunk_rows`."
+    )
+    parser.add_argument("--shard_dir", type=Path,
+                        help="The directory containing the shards of the data splits.")
+    parser.add_argument("--final_dir", type=Path,
+                        help="The directory that the trained models are saved to, one "
+                             "sub-directory per metric, in the native model format.")
+    parser.add_argument("--metrics", type=str, nargs="+", default=None,
+                        help="The metrics to train surrogates for. Defaults to all "
+                             "metrics present in the data.")
+    parser.add_argument("--trials", type=Path, default=None,
+                        help="The trials recorded by `parallel_hpo.py`, e.g. on a sample "
+                             "of the data, from which the best hyperparameters of each "
+                             "metric are taken. Defaults to the default hyperparameters.")
+    parser.add_argument("--num_boost_round", type=int,
+                        default=NUM_BOOST_ROUND,
+                        help="The number of boosting rounds.")
+    parser.add_argument("--in_memory", dest="external_memory", action="store_false",
+                        help="Keep the quantized training matrix in memory instead of "
+                             "paging it from a cache on the disk. Requires xgboost 1.7 "
+                             "or newer.")
+    parser.add_argument("--cache_dir", type=Path, default=None,
+                        help="The directory in which a temporary directory for the "
+                             "external memory cache of XGBoost is created. Defaults to "
+                             "the shard directory.")
+    parser.add_argument("--nthread", type=int, default=1,
+                        help="The number of threads used by XGBoost.")
+
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_cli()
+    logging.basicConfig(level=logging.INFO,
+                        format="[%(asctime)s] %(name)s %(levelname)s: %(message)s",
+                        datefmt="%m/%d %H:%M:%S")
+    _log.setLevel(logging.INFO)
+    main(**vars(args))